@@ -0,0 +1,207 @@
+import common
+import values
+
+# Primitive operations on integers.
+#
+# An operation is computed as soon as both of its arguments are
+# integers. If an argument is a metavariable that is not instantiated
+# yet, the operation is suspended on it (see values.Metavar.suspend_goal)
+# and resumed when the metavariable gets instantiated:
+#   - an arithmetic operation evaluates to a fresh metavariable, which is
+#     unified with the result once it is known,
+#   - a comparison succeeds, and fails later if it turns out not to hold.
+#
+# An addition, subtraction or multiplication with a single unknown
+# argument is also suspended on its result. If the result gets known
+# first, the operation is solved for the unknown argument, so that
+# (x + 1 == 5) instantiates x to 4.
+#
+# An answer that still depends on suspended operations flounders: its
+# metavariables stand for the values that satisfy the operations, which
+# cannot be enumerated. Evaluators show the operations together with the
+# answer (see residual_answer) instead of showing the metavariables as
+# if they were unconstrained.
+#
+# The functions are parameterized by the `eval_value` and `unify`
+# functions of the evaluator that uses them.
+
+OPERATIONS = {
+    common.OP_ADD: lambda n, m: n + m,
+    common.OP_SUB: lambda n, m: n - m,
+    common.OP_MUL: lambda n, m: n * m,
+    # Division by zero fails.
+    common.OP_DIV: lambda n, m: None if m == 0 else n // m,
+    common.OP_MOD: lambda n, m: None if m == 0 else n % m,
+}
+
+RELATIONS = {
+    common.OP_LT: lambda n, m: n < m,
+    common.OP_LE: lambda n, m: n <= m,
+}
+
+PRIMITIVES = list(OPERATIONS.keys()) + list(RELATIONS.keys())
+
+def apply_primitive(name, val1, val2, eval_value, unify):
+    for v1 in decided(val1, eval_value):
+        for v2 in decided(val2, eval_value):
+            yield from _apply_decided(name, v1, v2, eval_value, unify)
+
+def decided(value, eval_value):
+    "Evaluates a value, following the instantiated metavariables."
+    for v in eval_value(value):
+        if v.is_flex_structure() and not v.is_decided():
+            yield from decided(v, eval_value)
+        else:
+            yield v
+
+def _apply_decided(name, v1, v2, eval_value, unify):
+    if flex_symbol(v1, v2) is None:
+        if name in RELATIONS:
+            if RELATIONS[name](v1.value, v2.value):
+                yield values.unit()
+        else:
+            n = OPERATIONS[name](v1.value, v2.value)
+            if n is not None:
+                yield values.IntegerConstant(n)
+        return
+    if name in RELATIONS:
+        result = values.unit()
+    else:
+        result = values.FlexStructure(values.Metavar(prefix='n'), [])
+    goal = SuspendedOperation(name, v1, v2, result, eval_value, unify)
+    for _ in goal.wait(v1, v2, result):
+        yield result
+
+class SuspendedOperation:
+    """An operation suspended on the metavariables it waits for. It is
+       called as a goal (see values.Metavar.suspend_goal)."""
+
+    def __init__(self, name, val1, val2, result, eval_value, unify):
+        self.name = name
+        self.val1 = val1
+        self.val2 = val2
+        self.result = result
+        self._eval_value = eval_value
+        self._unify = unify
+        # The metavariables the operation is suspended on.
+        self._symbols = set()
+
+    def __call__(self):
+        for v1 in decided(self.val1, self._eval_value):
+            for v2 in decided(self.val2, self._eval_value):
+                for result in decided(self.result, self._eval_value):
+                    yield from self.resume(v1, v2, result)
+
+    def resume(self, v1, v2, result):
+        if flex_symbol(v1, v2) is None:
+            if self.name in RELATIONS:
+                if RELATIONS[self.name](v1.value, v2.value):
+                    yield None
+                return
+            n = OPERATIONS[self.name](v1.value, v2.value)
+            if n is not None:
+                yield from self._unify([(result, values.IntegerConstant(n))])
+            return
+        if self.name in INVERSES and not result.is_flex_structure():
+            solutions = solve(self.name, v1, v2, result.value)
+            if solutions is not None:
+                unknown = v1 if v1.is_flex_structure() else v2
+                for n in solutions:
+                    yield from self._unify([(unknown,
+                                             values.IntegerConstant(n))])
+                return
+        yield from self.wait(v1, v2, result)
+
+    def wait(self, v1, v2, result):
+        "Suspends the operation on the metavariables it needs."
+        flex = [v.symbol for v in [v1, v2] if v.is_flex_structure()]
+        if self.name in INVERSES and len(flex) == 1 \
+           and result.is_flex_structure():
+            flex.append(result.symbol)
+        new = []
+        for symbol in flex:
+            if symbol not in self._symbols and symbol not in new:
+                new.append(symbol)
+        for symbol in new:
+            symbol.suspend_goal(self)
+            self._symbols.add(symbol)
+        yield None
+        for symbol in reversed(new):
+            self._symbols.remove(symbol)
+            symbol.unsuspend_goal()
+
+    def free_metavars(self):
+        return self.val1.free_metavars() | self.val2.free_metavars() \
+             | self.result.free_metavars()
+
+    def show(self):
+        operation = values.Primitive(self.name, [self.val1, self.val2])
+        if self.name in RELATIONS:
+            return operation.show()
+        return '{result} == {operation}'.format(result=self.result.show(),
+                                                operation=operation.show())
+
+# Inverse of each operation with respect to its first and its second
+# argument. Given the result and the known argument, they return the
+# list of the values of the unknown argument, or None if they cannot be
+# enumerated.
+INVERSES = {
+    common.OP_ADD: (lambda r, m: [r - m], lambda r, n: [r - n]),
+    common.OP_SUB: (lambda r, m: [r + m], lambda r, n: [n - r]),
+    common.OP_MUL: (lambda r, m: _quotient(r, m), lambda r, n: _quotient(r, n)),
+}
+
+def _quotient(r, m):
+    if m == 0:
+        return None if r == 0 else []
+    return [r // m] if r % m == 0 else []
+
+def solve(name, v1, v2, r):
+    """Solves the operation for its only unknown argument, given its
+       result r."""
+    if v1.is_flex_structure() and v2.is_flex_structure():
+        return None
+    if v1.is_flex_structure():
+        return INVERSES[name][0](r, v2.value)
+    return INVERSES[name][1](r, v1.value)
+
+def residual_answer(value):
+    """Returns a strongly evaluated answer, or a ResidualAnswer if it
+       depends on suspended operations."""
+    operations = []
+    visited = set()
+    pending = list(value.free_metavars())
+    while len(pending) > 0:
+        metavar = pending.pop()
+        if metavar in visited:
+            continue
+        visited.add(metavar)
+        for goal in metavar.suspended_goals():
+            if isinstance(goal, SuspendedOperation) \
+               and goal not in operations:
+                operations.append(goal)
+                pending.extend(goal.free_metavars())
+    if len(operations) == 0:
+        return value
+    return ResidualAnswer(value, operations)
+
+class ResidualAnswer:
+    "An answer shown with the suspended operations it depends on."
+
+    def __init__(self, value, operations):
+        self.value = value
+        self.operations = operations
+
+    def show(self):
+        return '{value} where {operations}'.format(
+                 value=self.value.show(),
+                 operations=', '.join([operation.show()
+                                         for operation in self.operations]))
+
+def flex_symbol(val1, val2):
+    """Returns the metavariable an operation on the given decided values
+       has to wait for, or None if both of them are integers."""
+    for value in [val1, val2]:
+        if value.is_flex_structure():
+            return value.symbol
+    return None
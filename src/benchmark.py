@@ -0,0 +1,240 @@
+import glob
+import os
+import re
+import subprocess
+import sys
+import time
+
+import environment
+import parsing
+import runtime
+import typechecker
+import values
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'examples')
+
+EVALUATORS = ['evaluator_dfs', 'evaluator_compiled']
+
+DEFAULT_SOLUTIONS = 1
+DEFAULT_TIMEOUT = 300
+DEFAULT_LENGTH = 100000
+DEFAULT_ITERATIONS = 1000000
+
+def load_program(filename):
+    with open(filename) as f:
+        source = f.read()
+    parser = parsing.Parser(source, filename=filename)
+    return typechecker.TypeChecker().check_program(parser.parse_program())
+
+def normalize(output):
+    "Renames metavariables so that outputs of different runs can be compared."
+    names = {}
+    def rename(match):
+        if match.group(0) not in names:
+            names[match.group(0)] = '?{n}'.format(n=len(names))
+        return names[match.group(0)]
+    return re.sub(r'\?[^\s()]+', rename, output)
+
+def run_one(evaluator_name, filename, solutions):
+    "Runs a single example and prints the elapsed time and its results."
+    sys.setrecursionlimit(1000000)
+    evaluator_module = __import__(evaluator_name)
+    program = load_program(filename)
+    start = time.perf_counter()
+    results = []
+    evaluator = evaluator_module.Evaluator()
+    for result in evaluator.eval_program(program, strategy='strong'):
+        results.append(normalize(result.show()))
+        if len(results) == solutions:
+            break
+    elapsed = time.perf_counter() - start
+    print(elapsed)
+    for result in results:
+        print(result)
+
+def measure(evaluator_name, filename, solutions, timeout):
+    # Each run uses a separate process, since some examples do not
+    # terminate or overflow the C stack.
+    try:
+        process = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--run',
+                     evaluator_name, filename, str(solutions)],
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout
+                  )
+    except subprocess.TimeoutExpired:
+        return 'timeout', None
+    if process.returncode != 0:
+        return 'failed', None
+    lines = process.stdout.split('\n')
+    return float(lines[0]), lines[1:]
+
+def show_time(t):
+    if isinstance(t, float):
+        return '{t:9.3f}s'.format(t=t)
+    return '{t:>10}'.format(t=t)
+
+def benchmark(solutions=DEFAULT_SOLUTIONS, timeout=DEFAULT_TIMEOUT):
+    print('{example:24}'.format(example='example') +
+          ''.join(['{name:>22}'.format(name=name) for name in EVALUATORS]) +
+          '  speedup  same results')
+    for filename in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.fa'))):
+        times = []
+        outputs = []
+        for evaluator_name in EVALUATORS:
+            t, output = measure(evaluator_name, filename, solutions, timeout)
+            times.append(t)
+            outputs.append(output)
+        if all([isinstance(t, float) for t in times]) and times[-1] > 0:
+            speedup = '{s:7.2f}x'.format(s=times[0] / times[-1])
+        else:
+            speedup = '{s:>8}'.format(s='-')
+        same = all([output == outputs[0] for output in outputs])
+        print('{example:24}'.format(example=os.path.basename(filename)) +
+              ''.join(['{t:>22}'.format(t=show_time(t)) for t in times]) +
+              ' ' + speedup + '  ' + ('yes' if same else 'NO'))
+
+# The unification benchmark unifies a list of `length` metavariables
+# with a list of integers, and then with a copy of that list, which goes
+# through the instantiated metavariables.
+
+def list_value(elements):
+    value = values.RigidStructure('[]', [])
+    for element in reversed(elements):
+        value = values.RigidStructure('_∷_', [element, value])
+    return value
+
+def unification_goals(length):
+    metavars = list_value([values.FlexStructure(values.Metavar(), [])
+                           for i in range(length)])
+    integers = [values.IntegerConstant(i) for i in range(length)]
+    return [(metavars, list_value(integers)),
+            (metavars, list_value(list(integers)))]
+
+def unifier(evaluator_name):
+    if evaluator_name == 'evaluator_compiled':
+        return __import__('runtime').unify
+    return __import__(evaluator_name).Evaluator().unify
+
+def run_unification(evaluator_name, length):
+    "Runs the unification benchmark and prints the elapsed time."
+    sys.setrecursionlimit(1000000)
+    unify = unifier(evaluator_name)
+    goals = unification_goals(length)
+    start = time.perf_counter()
+    solutions = len(list(unify(goals)))
+    elapsed = time.perf_counter() - start
+    print(elapsed)
+    print(solutions)
+
+def unification_benchmark(length=DEFAULT_LENGTH, timeout=DEFAULT_TIMEOUT):
+    print('{length:24}'.format(length='length') +
+          ''.join(['{name:>22}'.format(name=name) for name in EVALUATORS]))
+    times = []
+    for evaluator_name in EVALUATORS:
+        try:
+            process = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__),
+                         '--run-unification', evaluator_name, str(length)],
+                        capture_output=True,
+                        text=True,
+                        timeout=timeout
+                      )
+        except subprocess.TimeoutExpired:
+            times.append('timeout')
+            continue
+        lines = process.stdout.split('\n')
+        if process.returncode != 0 or lines[1] != '1':
+            times.append('failed')
+        else:
+            times.append(float(lines[0]))
+    print('{length:<24}'.format(length=length) +
+          ''.join(['{t:>22}'.format(t=show_time(t)) for t in times]))
+
+# The values benchmark prints the size of a value of each class, and the
+# cost of dispatching on the class of a value, through the kind tables of
+# the runtime and through the is_*() methods as evaluator_dfs does.
+
+def value_samples():
+    env = environment.PersistentEnvironment()
+    code = runtime.constant(values.IntegerConstant(0))
+    return [
+      values.Thunk(code, env),
+      values.IntegerConstant(0),
+      values.RigidStructure('_∷_', [values.IntegerConstant(0),
+                                    values.RigidStructure('[]', [])]),
+      values.FlexStructure(values.Metavar(), []),
+      values.Primitive('_+_', []),
+      values.Closure('x', code, env),
+      values.MultiClosure(['x', 'y'], code, env, []),
+    ]
+
+def value_size(value):
+    size = sys.getsizeof(value)
+    if hasattr(value, '__dict__'):
+        size += sys.getsizeof(value.__dict__)
+    return size
+
+def method_dispatch(value):
+    if value.is_thunk():
+        return 0
+    elif value.is_rigid_structure():
+        return 1
+    elif value.is_flex_structure():
+        return 2
+    elif value.is_closure():
+        return 3
+    elif value.is_primitive():
+        return 4
+    return 5
+
+def values_benchmark(iterations=DEFAULT_ITERATIONS):
+    samples = value_samples()
+    for value in samples:
+        print('{cls:24}{size:>8} bytes'.format(cls=type(value).__name__,
+                                               size=value_size(value)))
+    table = runtime.kind_table({}, lambda value: value)
+    rounds = range(iterations // len(samples))
+    start = time.perf_counter()
+    for _ in rounds:
+        for value in samples:
+            table[value.kind](value)
+    kind_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in rounds:
+        for value in samples:
+            method_dispatch(value)
+    method_time = time.perf_counter() - start
+    print('{name:24}{t}'.format(name='kind table dispatch',
+                                t=show_time(kind_time)))
+    print('{name:24}{t}'.format(name='is_*() dispatch',
+                                t=show_time(method_time)))
+
+def usage(program):
+    sys.stderr.write(
+      'Usage: {program} [solutions [timeout]]\n'
+      '       {program} --unification [length [timeout]]\n'
+      '       {program} --values [iterations]\n'.format(
+        program=program))
+    sys.exit()
+
+def main(argv):
+    if len(argv) == 5 and argv[1] == '--run':
+        run_one(argv[2], argv[3], int(argv[4]))
+    elif len(argv) == 4 and argv[1] == '--run-unification':
+        run_unification(argv[2], int(argv[3]))
+    elif 2 <= len(argv) <= 4 and argv[1] == '--unification' and \
+         all([arg.isdigit() for arg in argv[2:]]):
+        unification_benchmark(*[int(arg) for arg in argv[2:]])
+    elif 2 <= len(argv) <= 3 and argv[1] == '--values' and \
+         all([arg.isdigit() for arg in argv[2:]]):
+        values_benchmark(*[int(arg) for arg in argv[2:]])
+    elif len(argv) <= 3 and all([arg.isdigit() for arg in argv[1:]]):
+        benchmark(*[int(arg) for arg in argv[1:]])
+    else:
+        usage(argv[0])
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,213 @@
+import common
+import determinism
+
+# Closedness analysis.
+#
+# An expression is closed if its evaluation depends on no state created
+# outside of it: it refers to no metavariables and no variables whose
+# value may change while the expression is being used. Variables bound
+# outside of the expression are closed if they are bound to:
+#   - a function whose body is closed,
+#   - a closed expression that has exactly one value.
+# Other variables, such as parameters, fresh variables, or definitions
+# that may have more than one value, are not closed.
+#
+# The solutions of a closed expression are always the same, so in
+# (e1 >> e2), if e2 is closed, it has the same solutions for every
+# solution of e1. If e1 is closed, only its number of solutions matters
+# to the rest of the program, so it can be evaluated in parallel (see
+# parallel.py). The analysis marks the closed operands of sequences by
+# setting their `closed` attribute to True. It also marks the
+# definitions whose right-hand side is closed.
+#
+# The analysis relies on the marks of the determinism analysis, so
+# determinism.analyze_program should be run first.
+
+class Binding:
+
+    def __init__(self, closed, deterministic):
+        self.closed = closed
+        self.deterministic = deterministic
+
+# Names not in scope are global: constructors and primitives. All of
+# them are closed. The constructors and these primitives are total and
+# have exactly one value; the others may fail (unification, relations,
+# division by zero, constraints) or have many values (alternatives,
+# labeling).
+DETERMINISTIC_PRIMITIVES = [
+    common.OP_SEQUENCE,
+    common.OP_ADD,
+    common.OP_SUB,
+    common.OP_MUL,
+]
+
+def analyze_program(program, constructors):
+    "`constructors` is the set of names of the constructors of the program."
+    Analysis(constructors).annotate(program.body, {})
+
+class Analysis:
+
+    def __init__(self, constructors):
+        self._constructors = constructors
+
+    def annotate(self, expr, scope):
+        # `scope` maps the names in scope to their Binding.
+        if expr.is_variable() or expr.is_integer_constant():
+            return
+        elif expr.is_lambda() or expr.is_fresh():
+            self.annotate(expr.body,
+                          bind(scope, [expr.var], Binding(False, False)))
+        elif expr.is_application():
+            if self.is_sequence(expr, scope):
+                [arg1, arg2] = expr.application_args()
+                arg1.closed = self.is_closed(arg1, scope)
+                arg2.closed = self.is_closed(arg2, scope)
+            self.annotate(expr.fun, scope)
+            self.annotate(expr.arg, scope)
+        elif expr.is_let():
+            inner = self.let_bindings(expr.declarations, scope,
+                                      internal=False)
+            for decl in expr.declarations:
+                if decl.is_definition():
+                    decl.closed = self.is_closed(decl.rhs, inner)
+                    self.annotate(decl.rhs, inner)
+            self.annotate(expr.body, inner)
+        elif expr.is_index():
+            for alternative in index_alternatives(expr):
+                self.annotate(alternative, scope)
+        else:
+            raise Exception(
+                    'Closedness analysis not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+    def is_closed(self, expr, scope):
+        # The variables bound inside the expression are internal to
+        # its evaluation, so they are closed.
+        if expr.is_integer_constant():
+            return True
+        elif expr.is_variable():
+            return expr.name not in scope or scope[expr.name].closed
+        elif expr.is_lambda() or expr.is_fresh():
+            return self.is_closed(expr.body,
+                                  bind(scope, [expr.var], Binding(True, True)))
+        elif expr.is_application():
+            return self.is_closed(expr.fun, scope) and \
+                   self.is_closed(expr.arg, scope)
+        elif expr.is_let():
+            inner = self.let_bindings(expr.declarations, scope,
+                                      internal=True)
+            return self.is_closed(expr.body, inner)
+        elif expr.is_index():
+            return (expr.var not in scope or scope[expr.var].closed) and \
+                   all([self.is_closed(alternative, scope)
+                        for alternative in index_alternatives(expr)])
+        else:
+            raise Exception(
+                    'Closedness analysis not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+    def is_deterministic(self, expr, scope):
+        "Returns True if the expression has exactly one value."
+        if expr.is_integer_constant():
+            return True
+        elif expr.is_variable():
+            if expr.name in scope:
+                return scope[expr.name].deterministic
+            return expr.name in self._constructors or \
+                   expr.name in DETERMINISTIC_PRIMITIVES
+        elif expr.is_lambda():
+            return self.is_deterministic(
+                     expr.body,
+                     bind(scope, [expr.var], Binding(True, True)))
+        elif expr.is_fresh():
+            return False
+        elif expr.is_application():
+            return self.is_deterministic(expr.fun, scope) and \
+                   self.is_deterministic(expr.arg, scope)
+        elif expr.is_let():
+            inner = self.let_bindings(expr.declarations, scope,
+                                      internal=True)
+            return self.is_deterministic(expr.body, inner)
+        elif expr.is_index():
+            # The arguments are deterministic, so they are rigid and
+            # select at most one alternative.
+            return expr.deterministic and \
+                   all([self.is_deterministic_alternative(alternative, scope)
+                        for alternative in index_branches(expr)])
+        else:
+            raise Exception(
+                    'Determinism analysis not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+    def is_deterministic_alternative(self, expr, scope):
+        if expr.is_index():
+            return self.is_deterministic(expr, scope)
+        rule = determinism.rule_patterns(
+                 expr, set([name for name in self._constructors
+                                 if name not in scope]))
+        if rule is None:
+            return self.is_deterministic(expr, scope)
+        goals, body = rule
+        return self.is_deterministic(
+                 body,
+                 bind(scope, determinism.goal_variables(goals),
+                      Binding(True, True)))
+
+    def let_bindings(self, declarations, scope, internal):
+        """Returns `scope` extended with the names defined by the
+           declarations. If `internal` is false, the let is outside the
+           expression being analyzed, so a definition that is not a
+           function is only closed if it has exactly one value."""
+        definitions = [decl for decl in declarations if decl.is_definition()]
+        inner = dict(scope)
+        for decl in definitions:
+            inner[decl.lhs.name] = Binding(True, True)
+        # Greatest fixed point, for recursive definitions.
+        changed = True
+        while changed:
+            changed = False
+            for decl in definitions:
+                binding = inner[decl.lhs.name]
+                if binding.deterministic and \
+                   not self.is_deterministic(decl.rhs, inner):
+                    binding.deterministic = False
+                    changed = True
+                if binding.closed and \
+                   not self.is_closed_definition(decl.rhs, binding, inner,
+                                                 internal):
+                    binding.closed = False
+                    changed = True
+        return inner
+
+    def is_closed_definition(self, rhs, binding, scope, internal):
+        if not self.is_closed(rhs, scope):
+            return False
+        return internal or rhs.is_lambda() or binding.deterministic
+
+    def is_sequence(self, expr, scope):
+        head = expr.application_head()
+        return expr.is_application() and head.is_variable() \
+           and head.name == common.OP_SEQUENCE \
+           and head.name not in scope \
+           and len(expr.application_args()) == 2
+
+def bind(scope, names, binding):
+    extended = dict(scope)
+    for name in names:
+        extended[name] = binding
+    return extended
+
+def index_branches(expr):
+    alternatives = []
+    for branch in list(expr.table.values()) + [expr.default]:
+        alternatives.extend(branch)
+    return alternatives
+
+def index_alternatives(expr):
+    return list(expr.alternatives) + index_branches(expr)
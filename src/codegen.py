@@ -0,0 +1,534 @@
+import closedness
+import common
+import datatypes
+import determinism
+import lexer
+import runtime
+import specialization
+import syntax
+
+# Ahead-of-time compilation of a typechecked program into a Python module.
+#
+# Every lambda body and every suspended argument becomes a generator
+# function `def _fN(env)` that yields the values of the expression.
+# Sequences, unifications, lets and fresh variables are inlined as nested
+# loops, so the body of a definition like
+#   λ x1 . (x1 == []) >> [] <> ...
+# becomes a single generator function with its pattern unifications
+# inlined. The generated module only depends on runtime.py.
+
+MODULE_HEADER = '''\
+# Generated by falopa from {filename}. Do not edit.
+#
+# The directory containing runtime.py should be in the PYTHONPATH.
+
+import sys
+
+import environment
+import runtime as rt
+import values
+'''
+
+MODULE_FOOTER = '''\
+def main(strategy='strong'):
+    "Yields the results of the program."
+    assert strategy in ['weak', 'strong']
+    rt.declare_datatypes({datatypes})
+    for value in {main}(environment.PersistentEnvironment()):
+        if strategy == 'weak':
+            yield value
+        else:
+            for v in rt.strong_eval_value(value):
+                yield rt.residual_answer(v)
+
+if __name__ == '__main__':
+    sys.setrecursionlimit(1000000)
+    for result in main():
+        print(result.show())
+        input(" ; ")
+    print("done.")
+'''
+
+# Python does not allow more than 20 statically nested blocks.
+# Deeper expressions are moved to their own function.
+MAX_NESTING = 16
+
+class CodeGenerator:
+
+    def __init__(self, specialize=True):
+        self._constructors = runtime.primitive_constructors()
+        self._primitives = runtime.primitive_functions()
+        self._definitions = []
+        self._constants = {}
+        # Maps each pattern to the name of its matcher.
+        self._matchers = {}
+        self._next_index = 0
+        self._datatypes = {}
+        # If True, the program is rewritten by the specialization pass
+        # (see specialization.py) before it is compiled.
+        self._specialize = specialize
+
+    def generate_program(self, program, filename='...'):
+        for data_decl in program.data_declarations:
+            for constructor in data_decl.constructors:
+                self._constructors.add(constructor.name)
+        self._datatypes = datatypes.program_datatypes(
+                            program.data_declarations)
+        if self._specialize:
+            program = specialization.specialize_program(program,
+                                                        self._constructors)
+        determinism.analyze_program(program)
+        closedness.analyze_program(program, self._constructors)
+        main = self.generate_function(program.body, frozenset(),
+                                      name='main')
+        lines = [MODULE_HEADER.format(filename=filename)]
+        for definition in self._definitions:
+            lines.append('\n'.join(definition))
+            lines.append('')
+        # Constants are defined after the functions they may refer to.
+        for name, expression in self._constants.values():
+            lines.append('{name} = {expression}'.format(name=name,
+                                                        expression=expression))
+        lines.append('')
+        lines.append(MODULE_FOOTER.format(main=main,
+                                          datatypes=repr(self._datatypes)))
+        return '\n'.join(lines)
+
+    def fresh_name(self, prefix):
+        index = self._next_index
+        self._next_index += 1
+        return '{prefix}{index}'.format(prefix=prefix, index=index)
+
+    def constant(self, expression):
+        if expression not in self._constants:
+            self._constants[expression] = (self.fresh_name('_k'), expression)
+        return self._constants[expression][0]
+
+    def generate_function(self, expr, scope, name='', rule=None):
+        """Returns the name of a generator function for the expression.
+           If `rule` is given, the expression is an alternative described
+           by determinism.rule_patterns."""
+        function_name = self.fresh_name('_f') + identifier_suffix(name)
+        definition = ['def {name}(env):'.format(name=function_name)]
+        self._definitions.append(definition)
+        if rule is None:
+            body = self.generate_expression(expr, scope, 'env',
+                                            yield_value, 0)
+        else:
+            body = self.generate_rule(rule, scope, 'env', yield_value, 0)
+        definition.extend(indent_lines(body))
+        return function_name
+
+    def generate_code(self, expr, scope, name='', rule=None):
+        "Returns the name of a runtime.Code object for the expression."
+        if expr.is_variable() and expr.name in scope:
+            return self.constant('rt.variable({name})'.format(
+                                   name=repr(expr.name)))
+        function_name = self.generate_function(expr, scope, name=name,
+                                               rule=rule)
+        return self.constant(
+                 'rt.Code({function}, {source})'.format(
+                   function=function_name,
+                   source=repr(expr.show())))
+
+    def generate_expression(self, expr, scope, env, k, depth):
+        """Returns a list of lines that run `k` for each value of `expr`.
+           The continuation `k` receives a Python expression denoting the
+           value and the current number of nested blocks, and returns the
+           lines that consume the value."""
+        constant = self.generate_constant(expr, scope)
+        if constant is not None:
+            return k(constant, depth)
+        elif depth >= MAX_NESTING:
+            return self.generate_loop(
+                     '{f}({env})'.format(
+                       f=self.generate_function(expr, scope),
+                       env=env),
+                     k, depth)
+        elif expr.is_variable():
+            return self.generate_variable_or_primitive(expr, scope, env,
+                                                       k, depth)
+        elif expr.is_lambda():
+            return k(self.generate_closure(expr, scope, env), depth)
+        elif expr.is_application():
+            return self.generate_application(expr, scope, env, k, depth)
+        elif expr.is_let():
+            return self.generate_let(expr, scope, env, k, depth)
+        elif expr.is_fresh():
+            return self.generate_fresh(expr, scope, env, k, depth)
+        elif expr.is_index():
+            return self.generate_index(expr, scope, env, k, depth)
+        else:
+            raise Exception(
+                    'Code generation not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+    def generate_loop(self, iterable, k, depth):
+        var = self.fresh_name('v')
+        return ['for {var} in {iterable}:'.format(var=var, iterable=iterable)
+               ] + indent_lines(k(var, depth + 1))
+
+    def generate_constant(self, expr, scope):
+        "Returns the name of a constant for the expression, if it is one."
+        if expr.is_integer_constant():
+            return self.constant(
+                     'values.IntegerConstant({n})'.format(n=expr.value))
+        elif expr.is_variable() and expr.name not in scope \
+                                and expr.name in self._constructors:
+            return self.constant(
+                     'values.RigidStructure({name}, [])'.format(
+                       name=repr(expr.name)))
+        else:
+            return None
+
+    def generate_variable_or_primitive(self, expr, scope, env, k, depth):
+        if expr.name in scope:
+            return self.generate_loop(
+                     'rt.variable_values({env}, {name})'.format(
+                       env=env, name=repr(expr.name)),
+                     k, depth)
+        elif expr.name in self._primitives:
+            return k('values.Primitive({name}, [])'.format(
+                       name=repr(expr.name)),
+                     depth)
+        else:
+            return ['yield from rt.unbound_name({name})'.format(
+                      name=repr(expr.name))]
+
+    def generate_closure(self, expr, scope, env, name=''):
+        # Nested lambdas become a single closure.
+        params, body = syntax.lambda_params(expr)
+        body = self.generate_code(body, scope | set(params), name=name)
+        if len(params) == 1:
+            return 'values.Closure({var}, {body}, {env})'.format(
+                     var=repr(expr.var), body=body, env=env)
+        return 'values.MultiClosure({vars}, {body}, {env}, [])'.format(
+                 vars=repr(params), body=body, env=env)
+
+    def generate_argument(self, expr, scope, env):
+        "Returns a Python expression for the argument, suspended if needed."
+        constant = self.generate_constant(expr, scope)
+        if constant is not None:
+            return constant
+        elif expr.is_lambda():
+            return self.generate_closure(expr, scope, env)
+        else:
+            return 'values.Thunk({code}, {env})'.format(
+                     code=self.generate_code(expr, scope), env=env)
+
+    def generate_application(self, expr, scope, env, k, depth):
+        head = expr.application_head()
+        args = expr.application_args()
+        if head.is_variable() and head.name not in scope:
+            if head.name in self._constructors:
+                return k('values.RigidStructure({name}, [{args}])'.format(
+                           name=repr(head.name),
+                           args=', '.join([
+                             self.generate_argument(arg, scope, env)
+                             for arg in args])),
+                         depth)
+            elif len(args) == 2 and head.name == common.OP_SEQUENCE \
+                                and args[1].closed:
+                sequence = self.constant(
+                             ('rt.cached_sequence({code1}, {code2}, ' +
+                              'closed={closed})').format(
+                               code1=self.generate_code(args[0], scope),
+                               code2=self.generate_code(args[1], scope),
+                               closed=args[0].closed))
+                return self.generate_loop(
+                         '{sequence}.code({env})'.format(sequence=sequence,
+                                                         env=env),
+                         k, depth)
+            elif len(args) == 2 and head.name == common.OP_SEQUENCE:
+                return self.generate_expression(
+                         args[0], scope, env,
+                         lambda v, depth: self.generate_expression(
+                                            args[1], scope, env, k, depth),
+                         depth)
+            elif len(args) == 2 and head.name == common.OP_ALTERNATIVE \
+                                and k is yield_value:
+                return self.generate_expression(args[0], scope, env,
+                                                k, depth) + \
+                       self.generate_expression(args[1], scope, env,
+                                                k, depth)
+            elif len(args) == 2 and head.name == common.OP_UNIFY:
+                return self.generate_loop(
+                         'rt.unify([({arg1}, {arg2})])'.format(
+                           arg1=self.generate_argument(args[0], scope, env),
+                           arg2=self.generate_argument(args[1], scope, env)),
+                         k, depth)
+            elif head.name in self._primitives and \
+                 len(args) == self._primitives[head.name].arity:
+                return self.generate_loop(
+                         'rt.PRIMITIVES[{name}].function({args})'.format(
+                           name=repr(head.name),
+                           args=', '.join([
+                             self.generate_argument(arg, scope, env)
+                             for arg in args])),
+                         k, depth)
+        vargs = ', '.join([self.generate_argument(arg, scope, env)
+                           for arg in args])
+        return self.generate_expression(
+                 head, scope, env,
+                 lambda f, depth: self.generate_loop(
+                   'rt.apply_many({f}, [{vargs}])'.format(f=f, vargs=vargs),
+                   k, depth),
+                 depth)
+
+    def generate_let(self, expr, scope, env, k, depth):
+        names = [decl.lhs.name
+                   for decl in expr.declarations if decl.is_definition()]
+        tabled = set([decl.name for decl in expr.declarations
+                                if decl.is_tabling_declaration()])
+        inner_scope = scope | set(names)
+        extended_env = self.fresh_name('env')
+        lines = ['{env1} = {env}.extended()'.format(env1=extended_env,
+                                                    env=env)]
+        for decl in expr.declarations:
+            if not decl.is_definition():
+                continue
+            if decl.lhs.name in tabled:
+                value = self.generate_tabled_definition(decl, inner_scope,
+                                                        extended_env)
+            elif decl.rhs.is_lambda():
+                # Closures are already values, so they need not be
+                # suspended.
+                value = self.generate_closure(decl.rhs, inner_scope,
+                                              extended_env,
+                                              name=decl.lhs.name)
+            else:
+                value = 'values.Thunk({code}, {env})'.format(
+                          code=self.generate_code(decl.rhs, inner_scope,
+                                                  name=decl.lhs.name),
+                          env=extended_env)
+            lines.append('{env}.define({name}, {value})'.format(
+                           env=extended_env,
+                           name=repr(decl.lhs.name),
+                           value=value))
+        return lines + self.generate_expression(expr.body, inner_scope,
+                                                extended_env, k, depth)
+
+    def generate_tabled_definition(self, decl, scope, env):
+        if not decl.closed:
+            raise Exception(
+                    ('Tabled definition {name} depends on variables ' +
+                     'bound outside of it.').format(name=decl.lhs.name)
+                  )
+        params, body = syntax.lambda_params(decl.rhs)
+        body_code = self.generate_code(body, scope | set(params),
+                                       name=decl.lhs.name)
+        code = self.constant(
+                 'rt.lambda_many({params}, rt.tabled({params}, {body}))'
+                   .format(params=repr(params), body=body_code))
+        if len(params) == 0:
+            return 'values.Thunk({code}, {env})'.format(code=code, env=env)
+        return '{code}.closure({env})'.format(code=code, env=env)
+
+    def generate_fresh(self, expr, scope, env, k, depth):
+        if expr.sole_alternative:
+            rule = determinism.rule_patterns(expr, self._constructors - scope)
+            if rule is not None:
+                return self.generate_rule(rule, scope, env, k, depth)
+        extended_env = self.fresh_name('env')
+        return [
+          '{env1} = {env}.extended()'.format(env1=extended_env, env=env),
+          '{env}.define({var}, values.FlexStructure('
+          'values.Metavar(prefix={var}, type={type}), []))'.format(
+            env=extended_env,
+            var=repr(expr.var),
+            type=repr(datatypes.runtime_type(expr.type, self._datatypes))),
+        ] + self.generate_expression(expr.body, scope | set([expr.var]),
+                                     extended_env, k, depth)
+
+    def generate_index(self, expr, scope, env, k, depth):
+        # The alternatives are selected at run time, so each of them
+        # goes in its own function.
+        if expr.deterministic:
+            return self.generate_deterministic_index(expr, scope, env,
+                                                     k, depth)
+        def generate_all(alternatives):
+            return '[' + ', '.join([self.generate_alternative(alternative,
+                                                              scope)
+                                    for alternative in alternatives]) + ']'
+        table = ', '.join([
+                  '{key}: {branch}'.format(key=repr(key),
+                                           branch=generate_all(branch))
+                  for key, branch in expr.table.items()])
+        index = self.constant(
+                  'rt.index({var}, {{{table}}}, {default}, {all}{args})'.format(
+                    var=repr(expr.var),
+                    table=table,
+                    default=generate_all(expr.default),
+                    all=generate_all(expr.alternatives),
+                    args=index_arguments(expr)))
+        return self.generate_loop('{index}.code({env})'.format(index=index,
+                                                               env=env),
+                                  k, depth)
+
+    def generate_deterministic_index(self, expr, scope, env, k, depth):
+        def generate_branch(branch):
+            if len(branch) == 0:
+                return 'None'
+            [alternative] = branch
+            return self.generate_alternative(alternative, scope)
+        table = ', '.join([
+                  '{key}: {branch}'.format(key=repr(key),
+                                           branch=generate_branch(branch))
+                  for key, branch in expr.table.items()])
+        index = self.constant(
+                  'rt.deterministic_index({var}, {{{table}}}, {default}, '
+                  '[{all}]{args})'.format(
+                    var=repr(expr.var),
+                    table=table,
+                    default=generate_branch(expr.default),
+                    all=', '.join([self.generate_alternative(alternative,
+                                                             scope)
+                                   for alternative in expr.alternatives]),
+                    args=index_arguments(expr)))
+        return self.generate_loop('{index}.code({env})'.format(index=index,
+                                                               env=env),
+                                  k, depth)
+
+    def generate_alternative(self, expr, scope):
+        # The patterns of the alternative are matched rather than unified
+        # whenever possible, as in Evaluator.compile_alternative in
+        # evaluator_compiled.py.
+        rule = determinism.rule_patterns(expr, self._constructors - scope)
+        return self.generate_code(expr, scope, rule=rule)
+
+    def generate_rule(self, rule, scope, env, k, depth):
+        goals, body = rule
+        fvs = determinism.goal_variables(goals)
+        return self.generate_goals(goals, [], body, scope | fvs, env,
+                                   k, depth)
+
+    def generate_goals(self, goals, bindings, body, scope, env, k, depth):
+        # `bindings` is the list of the pattern variables matched so far,
+        # with Python expressions for their values.
+        if len(goals) == 0:
+            if len(bindings) == 0:
+                return self.generate_expression(body, scope, env, k, depth)
+            extended_env = self.fresh_name('env')
+            lines = ['{env1} = {env}.extended()'.format(env1=extended_env,
+                                                        env=env)]
+            for name, value in bindings:
+                lines.append('{env}.define({name}, {value})'.format(
+                               env=extended_env,
+                               name=repr(name),
+                               value=value))
+            return lines + self.generate_expression(body, scope,
+                                                    extended_env, k, depth)
+        (var, pattern) = goals[0]
+        value = self.fresh_name('v')
+        match = self.fresh_name('m')
+        names = pattern_variables(pattern)
+        rest = self.generate_goals(
+                 goals[1:],
+                 bindings + [(name, '{match}[{i}]'.format(match=match, i=i))
+                             for i, name in enumerate(names)],
+                 body, scope, env, k, depth + 2)
+        return [
+          'for {value} in rt.variable_values({env}, {var}):'.format(
+            value=value, env=env, var=repr(var)),
+          '    for {match} in rt.pattern_matches({value}, {matcher}, '
+          '{pattern}):'.format(
+            match=match,
+            value=value,
+            matcher=self.generate_matcher(pattern),
+            pattern=self.constant(repr(pattern))),
+        ] + indent_lines(indent_lines(rest))
+
+    def generate_matcher(self, pattern):
+        """Returns the name of a function that matches a value against the
+           pattern (see runtime.pattern_matches)."""
+        key = repr(pattern)
+        if key not in self._matchers:
+            name = self.fresh_name('_m')
+            bound = []
+            body = self.generate_match(pattern, 'v', bound)
+            body.append('return ({bound}{comma})'.format(
+                          bound=', '.join(bound),
+                          comma=',' if len(bound) == 1 else ''))
+            self._definitions.append(
+              ['def {name}(v):'.format(name=name)] + indent_lines(body))
+            self._matchers[key] = name
+        return self._matchers[key]
+
+    def generate_match(self, pattern, value, bound):
+        """Returns the lines that match the Python variable `value`
+           against the pattern, adding the variables holding the values
+           of the pattern variables to `bound`."""
+        kind = pattern[0]
+        if kind == 'any':
+            return ['rt.match_value({value})'.format(value=value)]
+        elif kind == 'var':
+            var = self.fresh_name('b')
+            bound.append(var)
+            return ['{var} = rt.match_value({value})'.format(var=var,
+                                                             value=value)]
+        elif kind == 'int':
+            cls = 'values.IntegerConstant'
+            mismatch = '{value}.value != {n}'.format(value=value,
+                                                     n=pattern[1])
+        else:
+            cls = 'values.RigidStructure'
+            mismatch = '{value}.constructor != {name} or ' \
+                       'len({value}.args) != {n}'.format(
+                         value=value,
+                         name=repr(pattern[1]),
+                         n=len(pattern[2]))
+        lines = [
+          'if type({value}) is not {cls}:'.format(value=value, cls=cls),
+          '    {value} = rt.match_value({value})'.format(value=value),
+          '    if type({value}) is not {cls}:'.format(value=value, cls=cls),
+          '        raise rt.Fallback()',
+          'if {mismatch}:'.format(mismatch=mismatch),
+          '    return None',
+        ]
+        if kind == 'con':
+            for i, subpattern in enumerate(pattern[2]):
+                arg = self.fresh_name('v')
+                lines.append('{arg} = {value}.args[{i}]'.format(arg=arg,
+                                                                value=value,
+                                                                i=i))
+                lines.extend(self.generate_match(subpattern, arg, bound))
+        return lines
+
+def yield_value(value, depth):
+    return ['yield {value}'.format(value=value)]
+
+def pattern_variables(pattern):
+    "Returns the variables of a pattern, from left to right."
+    if pattern[0] == 'var':
+        return [pattern[1]]
+    elif pattern[0] == 'con':
+        return [name for subpattern in pattern[2]
+                     for name in pattern_variables(subpattern)]
+    return []
+
+def index_arguments(expr):
+    "Returns the keyword arguments of rt.index for the index."
+    arguments = ''
+    if expr.residuating:
+        arguments += ', residuating=True'
+    if expr.enumerable:
+        arguments += ', enumerable=True'
+    return arguments
+
+def indent_lines(lines):
+    return [common.indent(line, 4) for line in lines]
+
+def identifier_suffix(name):
+    parts = [part for part in lexer.operator_to_parts(name) if part != ''] \
+            if name != '' else []
+    suffix = '_'.join([''.join([c for c in part if ('_' + c).isidentifier()])
+                       for part in parts])
+    if suffix == '':
+        return ''
+    return '_' + suffix
+
+def generate_module(program, filename='...'):
+    "Returns the source code of a Python module running the program."
+    return CodeGenerator().generate_program(program, filename=filename)
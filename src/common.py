@@ -3,6 +3,22 @@ OP_ARROW = '_→_'
 OP_UNIFY = '_==_'
 OP_ALTERNATIVE = '_<>_'
 OP_SEQUENCE = '_>>_'
+OP_ADD = '_+_'
+OP_SUB = '_-_'
+OP_MUL = '_*_'
+OP_DIV = 'div'
+OP_MOD = 'mod'
+OP_LT = '_<_'
+OP_LE = '_≤_'
+OP_DISEQUALITY = '_≠_'
+# Used by higher-order unification. Programs cannot refer to it.
+OP_EXTENSION = 'extension.'
+OP_FD_EQ = '_#=_'
+OP_FD_NE = '_#≠_'
+OP_FD_LT = '_#<_'
+OP_FD_DOMAIN = 'domain'
+OP_FD_ALL_DIFFERENT = 'allDifferent'
+OP_FD_LABELING = 'labeling'
 
 VALUE_UNIT = '()'
 
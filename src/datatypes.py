@@ -0,0 +1,134 @@
+import common
+import values
+
+# Types of metavariables.
+#
+# The typechecker records the type of each `fresh` variable, and the
+# evaluators attach it to the metavariable they create. If the index of
+# a definitional tree meets an uninstantiated metavariable of a data
+# type, it instantiates the metavariable with each of the constructors
+# of its branches, and runs the alternatives of that branch, instead of
+# unifying it with the patterns of every alternative (see
+# syntax.Index.enumerable). The arguments of the constructors are new
+# metavariables, typed with the types of the arguments.
+#
+# At run time, a type is:
+#   - a tuple (name, arg1, ..., argn) for a data type applied to the
+#     types arg1, ..., argn,
+#   - None, if it is not known or it is not a data type.
+# The data types of a program are described by a dictionary mapping the
+# name of each data type to a pair (params, constructors), where
+# constructors is a list of pairs (constructor, arg_types). The names of
+# the params occur in arg_types as strings. The dictionary maps a data
+# type to None if its constructors cannot be enumerated in this way.
+
+def program_datatypes(data_declarations):
+    "Returns the dictionary describing the given data types."
+    names = set([data_type_name(decl) for decl in data_declarations])
+    datatypes = {}
+    for decl in data_declarations:
+        datatypes[data_type_name(decl)] = data_type(decl, names)
+    return datatypes
+
+def data_type_name(decl):
+    return decl.lhs.application_head().name
+
+def data_type(decl, names):
+    params = [param.name for param in decl.lhs.application_args()]
+    constructors = []
+    for constructor in decl.constructors:
+        arg_types, result_type = split_function_type(constructor.type)
+        # The result type has to be the data type applied to distinct
+        # variables, which are renamed to the params.
+        renaming = {}
+        for param, arg in zip(params, result_type.application_args()):
+            if not arg.is_variable() or arg.name in renaming:
+                return None
+            renaming[arg.name] = param
+        constructors.append((constructor.name,
+                             [type_template(arg_type, renaming, names)
+                                for arg_type in arg_types]))
+    return (params, constructors)
+
+def constructor_arity(constructor):
+    "Returns the number of arguments of a constructor declaration."
+    arg_types, result_type = split_function_type(constructor.type)
+    return len(arg_types)
+
+def split_function_type(type):
+    arg_types = []
+    while type.is_forall():
+        type = type.body
+    while type.application_head().is_variable() \
+          and type.application_head().name == common.OP_ARROW \
+          and len(type.application_args()) == 2:
+        [arg_type, type] = type.application_args()
+        arg_types.append(arg_type)
+    return arg_types, type
+
+def type_template(type, params, names):
+    head = type.application_head()
+    if not head.is_variable():
+        return None
+    elif head.name in params and len(type.application_args()) == 0:
+        return params[head.name]
+    elif head.name in names:
+        return tuple([head.name] + [type_template(arg, params, names)
+                                    for arg in type.application_args()])
+    else:
+        return None
+
+def runtime_type(type, datatypes):
+    """Returns the run time type of a type inferred by the typechecker,
+       which may have metavariables."""
+    if type is None:
+        return None
+    type = type.representative()
+    if type.is_metavar():
+        return None
+    head = type.application_head().representative()
+    if not head.is_variable() or head.name not in datatypes:
+        return None
+    return tuple([head.name] + [runtime_type(arg, datatypes)
+                                for arg in type.application_args()])
+
+def constructors(value, keys, datatypes):
+    """If the value is an uninstantiated metavariable of a data type that
+       has the given keys as constructors, returns a dictionary mapping
+       each constructor to the types of its arguments. Otherwise returns
+       None."""
+    if not value.is_flex_structure() or len(value.args) > 0:
+        return None
+    type = value.symbol.type
+    if type is None or datatypes.get(type[0]) is None:
+        return None
+    params, data_constructors = datatypes[type[0]]
+    instance = dict(zip(params, type[1:]))
+    arg_types = dict([(constructor, [instantiate(arg_type, instance)
+                                       for arg_type in arg_types])
+                      for constructor, arg_types in data_constructors])
+    for key in keys:
+        if key not in arg_types:
+            return None
+    return arg_types
+
+def instantiate(template, instance):
+    if template is None:
+        return None
+    elif isinstance(template, str):
+        return instance.get(template)
+    else:
+        return tuple([template[0]] + [instantiate(arg, instance)
+                                      for arg in template[1:]])
+
+def instantiations(value, keys, arg_types, unify):
+    """Instantiates the metavariable `value` with each of the given
+       constructors, with new metavariables as arguments, and yields the
+       constructor while it is instantiated."""
+    for key in keys:
+        term = values.RigidStructure(
+                 key,
+                 [values.FlexStructure(values.Metavar(type=arg_type), [])
+                    for arg_type in arg_types[key]])
+        for _ in unify([(value, term)]):
+            yield key
@@ -0,0 +1,110 @@
+import syntax
+
+# Pattern matching compiled into definitional trees.
+#
+# The equations of a definition are split on the first parameter that
+# has a constructor pattern in some equation. Each branch of the split
+# holds the equations that may match a given constructor (the ones with
+# that constructor, plus the ones with a variable in that position), and
+# is split again on the next such parameter. Equations that overlap end
+# up in more than one branch, and the leaves of the tree try their
+# remaining equations in order.
+#
+# In a branch, the patterns that consist of just the constructor (or
+# integer) of the branch are already known to match, so they are not
+# unified again.
+
+class Rule:
+    "An equation of a definition, after typechecking it."
+
+    def __init__(self, fvs, params, patterns, keys, body):
+        # fvs are the variables bound by the patterns.
+        # keys[i] is the constructor (or integer) at the head of
+        # patterns[i], or None if the pattern may match anything.
+        # patterns[i] is None if it is already known to match.
+        self.fvs = fvs
+        self.params = params
+        self.patterns = patterns
+        self.keys = keys
+        self.body = body
+
+    def matched(self, i):
+        "Returns the rule, knowing that the head of patterns[i] matches."
+        patterns = list(self.patterns)
+        if len(self.patterns[i].application_args()) == 0:
+            patterns[i] = None
+        return Rule(self.fvs, self.params, patterns, self.keys, self.body)
+
+    def expression(self):
+        goals = [syntax.unify(param, pattern)
+                   for param, pattern in zip(self.params, self.patterns)
+                   if pattern is not None]
+        return syntax.fresh_many(self.fvs,
+                                 syntax.sequence_many1(goals, self.body))
+
+def definitional_tree(rules, position=None):
+    "Returns an expression that evaluates the rules of a definition."
+    positions = list(range(len(rules[0].params)))
+    return syntax.alternative_many(build_tree(rules, positions, position),
+                                   position=position)
+
+def build_tree(rules, positions, position):
+    "Returns a list of alternatives that evaluate the rules."
+    for i in positions:
+        keys = []
+        for rule in rules:
+            if rule.keys[i] is not None and rule.keys[i] not in keys:
+                keys.append(rule.keys[i])
+        if len(keys) == 0:
+            continue
+
+        remaining = [j for j in positions if j != i]
+        table = {}
+        for key in keys:
+            branch_rules = []
+            for rule in rules:
+                if rule.keys[i] == key:
+                    branch_rules.append(rule.matched(i))
+                elif rule.keys[i] is None:
+                    branch_rules.append(rule)
+            table[key] = build_tree(branch_rules, remaining, position)
+        default_rules = [rule for rule in rules if rule.keys[i] is None]
+        if len(default_rules) == 0:
+            default = []
+        else:
+            default = build_tree(default_rules, remaining, position)
+        index = syntax.Index(var=rules[0].params[i].name,
+                             table=table,
+                             default=default,
+                             alternatives=[rule.expression()
+                                             for rule in rules],
+                             position=position)
+        # Running the branches in order gives the solutions of the rules
+        # in order if each constructor occurs in consecutive rules.
+        index.enumerable = len(default_rules) == 0 and \
+                           is_grouped([rule.keys[i] for rule in rules])
+        return [index]
+    return [rule.expression() for rule in rules]
+
+def is_grouped(keys):
+    "Returns True if equal keys are consecutive."
+    seen = set()
+    for j in range(len(keys)):
+        if keys[j] in seen and keys[j] != keys[j - 1]:
+            return False
+        seen.add(keys[j])
+    return True
+
+def mark_residuating(rhs):
+    "Marks the indices of the tree of a residuating definition."
+    while rhs.is_lambda():
+        rhs = rhs.body
+    if rhs.is_index():
+        _mark_index(rhs)
+
+def _mark_index(expr):
+    expr.residuating = True
+    for branch in list(expr.table.values()) + [expr.default]:
+        for alternative in branch:
+            if alternative.is_index():
+                _mark_index(alternative)
@@ -0,0 +1,184 @@
+import common
+
+# Determinism analysis.
+#
+# A definition is functional if its equations do not overlap, that is, if
+# every node of its definitional tree selects at most one alternative for
+# each rigid value of the parameter it splits on. The analysis marks:
+#   - the syntax.Index nodes that have this property,
+#   - the definitions whose body is made of such nodes,
+#   - the call sites whose head is a variable bound to such a definition,
+# by setting their `deterministic` attribute to True.
+#
+# The leaves of a deterministic tree can be run by matching instead of
+# unifying (see `rule_patterns`), since no metavariable of the arguments
+# needs to be instantiated as long as the arguments are rigid.
+
+def analyze_program(program):
+    Analysis().analyze(program.body, {})
+
+class Analysis:
+
+    def analyze(self, expr, functional):
+        # `functional` maps each name in scope to True if it is bound
+        # to a functional definition.
+        if expr.is_variable() or expr.is_integer_constant():
+            return
+        elif expr.is_lambda() or expr.is_fresh():
+            self.analyze(expr.body, bind(functional, [expr.var], False))
+        elif expr.is_application():
+            head = expr.application_head()
+            if head.is_variable() and functional.get(head.name, False):
+                expr.deterministic = True
+            self.analyze(expr.fun, functional)
+            self.analyze(expr.arg, functional)
+        elif expr.is_let():
+            definitions = [decl for decl in expr.declarations
+                                if decl.is_definition()]
+            for decl in definitions:
+                decl.deterministic = is_functional(decl.rhs)
+            inner = dict(functional)
+            for decl in definitions:
+                inner[decl.lhs.name] = decl.deterministic
+            for decl in definitions:
+                self.analyze(decl.rhs, inner)
+            self.analyze(expr.body, inner)
+        elif expr.is_index():
+            expr.deterministic = is_deterministic_index(expr)
+            for alternative in expr.alternatives:
+                self.analyze(alternative, functional)
+            for branch in list(expr.table.values()) + [expr.default]:
+                for alternative in branch:
+                    self.analyze(alternative, functional)
+        else:
+            raise Exception(
+                    'Determinism analysis not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+def bind(functional, names, value):
+    extended = dict(functional)
+    for name in names:
+        extended[name] = value
+    return extended
+
+def is_deterministic_index(expr):
+    for branch in list(expr.table.values()) + [expr.default]:
+        if len(branch) > 1:
+            return False
+    return True
+
+def is_functional(expr):
+    if not expr.is_lambda():
+        return False
+    while expr.is_lambda():
+        expr = expr.body
+    return is_deterministic_tree(expr)
+
+def is_deterministic_tree(expr):
+    if not expr.is_index():
+        # A single rule.
+        return not is_alternative(expr)
+    if not is_deterministic_index(expr):
+        return False
+    for branch in list(expr.table.values()) + [expr.default]:
+        for alternative in branch:
+            if alternative.is_index() and \
+               not is_deterministic_tree(alternative):
+                return False
+    return True
+
+def is_alternative(expr):
+    head = expr.application_head()
+    return expr.is_application() and head.is_variable() \
+       and head.name == common.OP_ALTERNATIVE \
+       and len(expr.application_args()) == 2
+
+def rule_patterns(expr, constructors):
+    """If the expression is an alternative of the form
+         fresh x1 ... xn . (y1 == p1) >> ... >> (yk == pk) >> body
+       where the y_i are bound outside the alternative and the p_i are
+       linear patterns made of constructors, integers and the x_i,
+       returns the list of goals [(y1, q1), ..., (yk, qk)] and the body,
+       where each q_i describes the pattern p_i as:
+         ('any',)                 for "_",
+         ('var', x)               for a variable,
+         ('int', n)               for an integer,
+         ('con', c, [q1 ... qm])  for a constructor applied to patterns.
+       Otherwise returns None."""
+    fvs = set()
+    while expr.is_fresh():
+        fvs.add(expr.var)
+        expr = expr.body
+    goals = []
+    bound = set()
+    while is_sequence(expr):
+        [goal, rest] = expr.application_args()
+        if not is_unification(goal):
+            break
+        [lhs, pattern] = goal.application_args()
+        if not lhs.is_variable() or lhs.name in fvs:
+            break
+        description = pattern_description(pattern, fvs, bound, constructors)
+        if description is None:
+            break
+        goals.append((lhs.name, description))
+        expr = rest
+    if len(goals) == 0 or fvs != bound:
+        return None
+    return goals, expr
+
+def pattern_description(pattern, fvs, bound, constructors):
+    # Adds the variables of the pattern to `bound`.
+    if pattern.is_fresh() and pattern.body.is_variable() \
+                          and pattern.body.name == pattern.var:
+        return ('any',)
+    elif pattern.is_integer_constant():
+        return ('int', pattern.value)
+    elif pattern.is_variable() and pattern.name in fvs:
+        if pattern.name in bound:
+            return None # Non-linear pattern
+        bound.add(pattern.name)
+        return ('var', pattern.name)
+    head = pattern.application_head()
+    if head.is_variable() and head.name not in fvs \
+                          and head.name in constructors:
+        args = []
+        for arg in pattern.application_args():
+            description = pattern_description(arg, fvs, bound, constructors)
+            if description is None:
+                return None
+            args.append(description)
+        return ('con', head.name, args)
+    return None
+
+def goal_variables(goals):
+    "Returns the set of variables bound by the patterns of the goals."
+    fvs = set()
+    for _, pattern in goals:
+        fvs |= pattern_variables(pattern)
+    return fvs
+
+def pattern_variables(pattern):
+    if pattern[0] == 'var':
+        return set([pattern[1]])
+    elif pattern[0] == 'con':
+        fvs = set()
+        for arg in pattern[2]:
+            fvs |= pattern_variables(arg)
+        return fvs
+    else:
+        return set()
+
+def is_sequence(expr):
+    head = expr.application_head()
+    return expr.is_application() and head.is_variable() \
+       and head.name == common.OP_SEQUENCE \
+       and len(expr.application_args()) == 2
+
+def is_unification(expr):
+    head = expr.application_head()
+    return expr.is_application() and head.is_variable() \
+       and head.name == common.OP_UNIFY \
+       and len(expr.application_args()) == 2
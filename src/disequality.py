@@ -0,0 +1,98 @@
+import values
+
+# Disequality constraints.
+#
+# (x ≠ y) compares the strong values of x and y without instantiating
+# any metavariable:
+#   - if they cannot be unified, it succeeds,
+#   - if they are equal, it fails,
+#   - otherwise, they become equal only if some of the metavariables
+#     that unification would instantiate get instantiated. The
+#     constraint succeeds, and it is suspended on those metavariables
+#     (see values.Metavar.suspend_goal) to be checked again when one of
+#     them is instantiated.
+#
+# The functions are parameterized by the `strong_eval_value` function of
+# the evaluator that uses them.
+
+FUNCTIONS = [values.Closure, values.MultiClosure, values.Primitive]
+
+def disequality(val1, val2, strong_eval_value):
+    "Yields the unit value if the values may be different."
+    yield from _check(val1, val2, set(), strong_eval_value)
+
+def _check(val1, val2, suspended, strong_eval_value):
+    # `suspended` is the set of metavariables the constraint is already
+    # suspended on.
+    for v1 in strong_eval_value(val1):
+        for v2 in strong_eval_value(val2):
+            metavars = unifier_metavars(v1, v2)
+            if metavars is None:
+                yield values.unit()
+                continue
+            elif len(metavars) == 0:
+                continue
+            def goal():
+                return _check(v1, v2, suspended, strong_eval_value)
+            new = []
+            for metavar in metavars:
+                if metavar not in suspended and metavar not in new:
+                    new.append(metavar)
+            for metavar in new:
+                metavar.suspend_goal(goal)
+                suspended.add(metavar)
+            yield values.unit()
+            for metavar in reversed(new):
+                suspended.remove(metavar)
+                metavar.unsuspend_goal()
+
+def unifier_metavars(val1, val2):
+    """Returns None if the strongly evaluated values cannot be unified.
+       Otherwise returns the list of the metavariables that unifying
+       them would instantiate, which is empty if they are equal."""
+    bindings = {}
+    metavars = []
+    goals = [(val1, val2)]
+    while len(goals) > 0:
+        (v1, v2) = goals.pop()
+        v1 = _walk(v1, bindings)
+        v2 = _walk(v2, bindings)
+        cls1 = type(v1)
+        cls2 = type(v2)
+        if cls1 is values.IntegerConstant and cls2 is values.IntegerConstant:
+            if v1.value != v2.value:
+                return None
+        elif cls1 is values.RigidStructure and cls2 is values.RigidStructure:
+            if v1.tag is not v2.tag or \
+               len(v1.args) != len(v2.args):
+                return None
+            goals.extend(zip(v1.args, v2.args))
+        elif cls1 is values.FlexStructure and cls2 is values.FlexStructure \
+             and v1.symbol is v2.symbol and len(v1.args) == 0 \
+             and len(v2.args) == 0:
+            continue
+        elif cls1 is values.FlexStructure and len(v1.args) == 0:
+            bindings[v1.symbol] = v2
+            metavars.append(v1.symbol)
+            if cls2 is values.FlexStructure:
+                # Instantiating either of them makes them closer.
+                metavars.append(v2.symbol)
+        elif cls2 is values.FlexStructure and len(v2.args) == 0:
+            bindings[v2.symbol] = v1
+            metavars.append(v2.symbol)
+        elif cls1 is values.FlexStructure or cls2 is values.FlexStructure:
+            # Higher-order: wait until the heads are known.
+            for value in [v1, v2]:
+                if type(value) is values.FlexStructure:
+                    metavars.append(value.symbol)
+        elif cls1 in FUNCTIONS or cls2 in FUNCTIONS:
+            raise Exception('Disequality of functions is not supported.')
+        else:
+            return None
+    return metavars
+
+def _walk(value, bindings):
+    while type(value) is values.FlexStructure and len(value.args) == 0 \
+          and value.symbol in bindings:
+        value = bindings[value.symbol]
+    return value
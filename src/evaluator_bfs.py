@@ -1,6 +1,12 @@
+import arithmetic
 import common
+import datatypes
+import disequality
 import syntax
 import environment
+import fd
+import higher_order
+import residuation
 import values
 
 class PrimitiveDescriptor:
@@ -12,11 +18,18 @@ def primitive_constructors():
     return set([common.VALUE_UNIT])
 
 def primitive_functions():
-    return {
+    primitives = {
         common.OP_UNIFY: PrimitiveDescriptor(arity=2),
         common.OP_ALTERNATIVE: PrimitiveDescriptor(arity=2),
         common.OP_SEQUENCE: PrimitiveDescriptor(arity=2),
+        common.OP_DISEQUALITY: PrimitiveDescriptor(arity=2),
+        common.OP_EXTENSION: PrimitiveDescriptor(arity=4),
     }
+    for name in arithmetic.PRIMITIVES:
+        primitives[name] = PrimitiveDescriptor(arity=2)
+    for name, arity in fd.PRIMITIVES.items():
+        primitives[name] = PrimitiveDescriptor(arity=arity)
+    return primitives
 
 def exception_with(message):
     raise Exception(message)
@@ -25,40 +38,51 @@ def check_stragety(strategy):
     assert strategy in ['weak', 'strong']
 
 def is_weak_strategy(strategy):
-    strategy == 'weak'
+    return strategy == 'weak'
 
 class Evaluator:
 
     def __init__(self):
         self._constructors = primitive_constructors()
+        # Arities of the constructors, to build saturated applications of
+        # constructors in one step.
+        self._constructor_arities = {common.VALUE_UNIT: 0}
         self._primitives = primitive_functions()
+        self._datatypes = {}
+        self._store = fd.Store(self.eval_value, self.strong_eval_value,
+                               self.unify)
     
     def add_constructors(self, program_declarations):
         for declaration in program_declarations:
             for constructor in declaration.constructors:
                 self._constructors.add(constructor.name)
+                self._constructor_arities[constructor.name] = datatypes.constructor_arity(constructor)
+        self._datatypes = datatypes.program_datatypes(program_declarations)
 
     def eval_program(self, program, strategy='weak'):
         check_stragety(strategy)
         self.add_constructors(program.data_declarations)
         env = environment.PersistentEnvironment()
-        yield from (self.eval_expression(program.body, env) if is_weak_strategy(strategy) 
-                else self.strong_eval_expression(program.body, env))
+        if is_weak_strategy(strategy):
+            yield from self.eval_expression(program.body, env)
+            return
+        for value in self.strong_eval_expression(program.body, env):
+            yield arithmetic.residual_answer(value)
 
     def strong_eval_expression(self, expr, env):
         for value in self.eval_expression(expr, env):
             yield from self.strong_eval_value(value)
     
-    def strong_eval_values(self, values):
-        if len(values) == 0: yield [] ; return
-        for v0 in self.strong_eval_value(values[0]):
-            for vs in self.strong_eval_values(values[1:]):
-                # NOTE: the values may have lost their decidedness.
+    def strong_eval_values(self, vals):
+        if len(vals) == 0: yield [] ; return
+        for v0 in self.strong_eval_value(vals[0]):
+            instantiations = values.Metavar.instantiations
+            for vs in self.strong_eval_values(vals[1:]):
+                # The values vs are strongly decided, but evaluating them
+                # may have instantiated metavariables of v0.
                 result = [v0] + vs
-                if all([w.is_strongly_decided() for w in result]):
-                    yield result
-                else:
-                    yield from self.strong_eval_values(result)
+                yield from ([result] if values.Metavar.instantiations == instantiations or v0.is_strongly_decided()
+                    else self.strong_eval_values(result))
 
     def eval_expression(self, expr, env):
         yield from (
@@ -69,6 +93,7 @@ class Evaluator:
             else self.eval_application(expr, env) if expr.is_application()
             else self.eval_let(expr, env) if expr.is_let()
             else self.eval_fresh(expr, env) if expr.is_fresh()
+            else self.eval_index(expr, env) if expr.is_index()
             else exception_with('Evaluation not implemented for {cls}.'.format(cls=type(expr)))
         )
 
@@ -99,7 +124,7 @@ class Evaluator:
 
     def strong_eval_flex_structure(self, value):
         for vargs in self.strong_eval_values(value.args):
-            yield (values.FlexStructure(value.symbol, vargs) if value.is_decided()
+            yield from ([values.FlexStructure(value.symbol, vargs)] if value.is_decided()
                 else self.strong_eval_apply_many(value, vargs))
 
     def strong_eval_apply_many(self, value, vargs):
@@ -130,12 +155,29 @@ class Evaluator:
         yield values.Closure(expr.var, expr.body, env)
 
     def eval_application(self, expr, env):
+        args = self.saturated_constructor_args(expr, env)
+        yield from (
+            [values.RigidStructure(expr.application_head().name, [values.Thunk(arg, env) for arg in args])]
+            if args is not None
+            else self.eval_curried_application(expr, env)
+        )
+
+    def eval_curried_application(self, expr, env):
         for value in self.eval_expression(expr.fun, env):
             yield from self.apply(value, values.Thunk(expr.arg, env))
 
+    def saturated_constructor_args(self, expr, env):
+        head = expr.application_head()
+        is_constructor = head.is_variable() and head.name in self._constructor_arities and not env.is_defined(head.name)
+        args = expr.application_args() if is_constructor else None
+        return args if args is not None and len(args) == self._constructor_arities[head.name] else None
+
     def eval_let(self, expr, env):
         extended_env = env.extended()
         for decl in expr.declarations:
+            if decl.is_tabling_declaration():
+                exception_with(
+                  'Tabled definitions are only supported by evaluator_compiled.')
             if not decl.is_definition(): continue
             extended_env.define(decl.lhs.name, values.Thunk(decl.rhs, extended_env))
 
@@ -143,10 +185,37 @@ class Evaluator:
 
     def eval_fresh(self, expr, env):
         extended_env = env.extended()
-        symbol = values.Metavar(prefix=expr.var)
+        symbol = values.Metavar(prefix=expr.var, type=datatypes.runtime_type(expr.type, self._datatypes))
         env.define(expr.var, values.FlexStructure(symbol, []))
         yield from self.eval_expression(expr.body, extended_env)
 
+    def eval_index(self, expr, env):
+        value0 = env.value(expr.var)
+        for value in self.eval_value(value0):
+            env.set(expr.var, value)
+            symbol = residuation.waiting_symbol(value) if expr.residuating else None
+            yield from (
+                residuation.residuate(symbol, lambda: self.eval_index(expr, env), self.unify) if symbol is not None
+                else self.eval_enumeration(expr, value, env) if expr.enumerable and value.index_key() is None
+                else self.eval_alternatives(expr.candidates(value.index_key()), env)
+            )
+            env.set(expr.var, value0)
+
+    def eval_alternatives(self, alternatives, env):
+        for alternative in alternatives:
+            yield from self.eval_expression(alternative, env)
+
+    def eval_enumeration(self, expr, value, env):
+        arg_types = datatypes.constructors(value, expr.table.keys(), self._datatypes)
+        yield from (
+            self.eval_alternatives(expr.alternatives, env) if arg_types is None
+            else self.eval_instantiations(expr, value, arg_types, env)
+        )
+
+    def eval_instantiations(self, expr, value, arg_types, env):
+        for key in datatypes.instantiations(value, expr.table.keys(), arg_types, self.unify):
+            yield from self.eval_alternatives(expr.table[key], env)
+
     def eval_value(self, value):
         yield from (
             self.yield_value(value) if value.is_decided()
@@ -162,6 +231,7 @@ class Evaluator:
     def apply_many(self, value, vargs):
         yield from (
             self.yield_value(value) if not vargs
+            else self.yield_value(values.RigidStructure(value.constructor, value.args + vargs)) if value.is_rigid_structure()
             else self.apply_many_aux(value, vargs)
         )
     
@@ -206,6 +276,10 @@ class Evaluator:
             self.primitive_sequence(*vargs) if value.name == common.OP_SEQUENCE
             else self.primitive_alternative(*vargs) if value.name == common.OP_ALTERNATIVE
             else self.primitive_unify(*vargs) if value.name == common.OP_UNIFY
+            else disequality.disequality(*vargs, self.strong_eval_value) if value.name == common.OP_DISEQUALITY
+            else higher_order.extension(*vargs, self.eval_value, self.strong_eval_value, self.unify) if value.name == common.OP_EXTENSION
+            else self.primitive_arithmetic(value.name, *vargs) if value.name in arithmetic.PRIMITIVES
+            else self._store.primitive(value.name, vargs) if value.name in fd.PRIMITIVES
             else exception_with('Primitive "{name}" not implemented.'.format(name=value.name))
         )
 
@@ -220,6 +294,64 @@ class Evaluator:
     def primitive_unify(self, val1, val2):
         yield from self.unify([(val1, val2)])
 
+    def primitive_arithmetic(self, name, val1, val2):
+        yield from arithmetic.apply_primitive(name, val1, val2, self.eval_value, self.unify)
+
+    def unify_flex_application(self, value1, value2, goals):
+        # See higher_order.py.
+        vargs = higher_order.ground_arguments(value1.args, self.known_value)
+        same_head = vargs is not None and value2.is_flex_structure() and value2.symbol == value1.symbol
+        vargs2 = higher_order.ground_arguments(value2.args, self.known_value) if same_head else None
+        yield from (
+            self.unify(goals)
+                if vargs2 is not None and higher_order.same_pattern(vargs, vargs2) # x a1 ... an == x a1 ... an
+            else self.instantiate_flex(value1.symbol, self.flex_function(value1.args, vargs, value2), goals)
+        )
+
+    def known_value(self, value):
+        # The value of a thunk that can be computed without running any code.
+        if value.is_flex_structure() and not value.args and value.symbol.is_instantiated():
+            return self.known_value(value.symbol.representative())
+        if not value.is_thunk() or isinstance(value.expr, values.Value): return value
+        (expr, env) = (value.expr, value.env)
+        args = self.saturated_constructor_args(expr, env)
+        return (
+            values.IntegerConstant(expr.value)
+                if expr.is_integer_constant()
+            else self.known_value(env.value(expr.name))
+                if expr.is_variable() and env.is_defined(expr.name)
+            else values.RigidStructure(expr.application_head().name, [values.Thunk(arg, env) for arg in args])
+                if args is not None
+            else value
+        )
+
+    def instantiate_flex(self, symbol, function, goals):
+        # TODO: occurs check
+        symbol.instantiate(function)
+        for _ in symbol.resume_goals():
+            yield from self.unify(goals)
+        symbol.uninstantiate()
+
+    def flex_function(self, args, vargs, value):
+        # The extension for the ground arguments vargs, or the imitation of args if vargs is None.
+        new_var = syntax.fresh_variable()
+        params = [syntax.fresh_variable() for arg in args]
+        body = (
+            syntax.application_many(
+              syntax.Variable(name=common.OP_EXTENSION),
+              [syntax.application_many(syntax.Variable(name=common.VALUE_UNIT), params),
+               higher_order.tuple_value(vargs),
+               value,
+               syntax.application_many(new_var, params)])
+                if vargs is not None
+            else syntax.alternative(
+              syntax.sequence_many1([syntax.unify(p, a) for p, a in zip(params, args)], value),
+              syntax.application_many(new_var, params))
+        )
+        env = environment.PersistentEnvironment()
+        env.define(new_var.name, values.FlexStructure(values.Metavar(prefix='F'), []))
+        return values.Thunk(syntax.lambda_many([p.name for p in params], body), env)
+
     def unify(self, goals):
         if not goals: yield values.unit() ; return
 
@@ -240,54 +372,20 @@ class Evaluator:
             if value1.value == value2.value: yield from self.unify(goals)
 
         elif value1.is_rigid_structure() and value2.is_rigid_structure():
-            if value1.constructor == value2.constructor and \
+            if value1.tag is value2.tag and \
                len(value1.args) == len(value2.args):
                 subgoals = list(zip(value1.args, value2.args))
                 yield from self.unify(subgoals + goals)
 
-        # Same head:
-        #    x t1 ... tn == x s1 ... sn
-        #elif val1.is_flex_structure() \
-        #         and val2.is_flex_structure() \
-        #         and val1.symbol == val2.symbol \
-        #         and len(val1.args) == len(val2.args):
-        #     subgoals = list(zip(val1.args, val2.args))
-        #     yield from self.unify(subgoals + goals)
         elif value1.is_flex_structure() and len(value1.args) == 0:
             # TODO: occurs check
             assert not value1.symbol.is_instantiated() # decided
             value1.symbol.instantiate(value2)
-            yield from self.unify(goals)
+            for _ in value1.symbol.resume_goals():
+                yield from self.unify(goals)
             value1.symbol.uninstantiate()
         elif value1.is_flex_structure() and len(value1.args) > 0:
-            # TODO: occurs check
-            assert not value1.symbol.is_instantiated() # decided
-            new_var = syntax.fresh_variable()
-            params = [syntax.fresh_variable() for arg in value1.args]
-            term = syntax.lambda_many(
-                     [p.name for p in params],
-                     syntax.alternative(
-                       syntax.sequence_many1(
-                         [syntax.unify(p, a)
-                            for p, a in zip(params, value1.args)],
-                         value2 # body
-                       ),
-                       syntax.application_many(new_var, params)
-                     )
-                   )
-            env = environment.PersistentEnvironment()
-            env.define(new_var.name, 
-                       values.FlexStructure(
-                         values.Metavar(prefix='F'),
-                         []))
-            value1.symbol.instantiate(
-                values.Thunk(
-                    term,
-                    env
-                )
-            )
-            yield from self.unify(goals)
-            value1.symbol.uninstantiate()
+            yield from self.unify_flex_application(value1, value2, goals)
         elif value2.is_flex_structure():
             yield from self.unify([(value2, value1)] + goals)
         else:
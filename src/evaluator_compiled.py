@@ -0,0 +1,223 @@
+import arithmetic
+import closedness
+import common
+import datatypes
+import determinism
+import environment
+import runtime
+import specialization
+import syntax
+import tail_calls
+import values
+
+class Evaluator:
+    """Evaluates a program by first compiling each node of its syntax
+       tree into a Python closure (see runtime.py)."""
+
+    def __init__(self, specialize=True):
+        self._constructors = runtime.primitive_constructors()
+        self._primitives = runtime.primitive_functions()
+        self._datatypes = {}
+        # If True, the program is rewritten by the specialization pass
+        # (see specialization.py) before it is compiled.
+        self._specialize = specialize
+
+    def eval_program(self, program, strategy='weak'):
+        assert strategy in ['weak', 'strong']
+        code = self.compile_program(program)
+        env = environment.PersistentEnvironment()
+        if strategy == 'weak':
+            yield from code.code(env)
+        else:
+            for value in code.code(env):
+                for v in runtime.strong_eval_value(value):
+                    yield arithmetic.residual_answer(v)
+
+    def compile_program(self, program):
+        for data_decl in program.data_declarations:
+            for constructor in data_decl.constructors:
+                self._constructors.add(constructor.name)
+        self._datatypes = datatypes.program_datatypes(
+                            program.data_declarations)
+        runtime.declare_datatypes(self._datatypes)
+        if self._specialize:
+            program = specialization.specialize_program(program,
+                                                        self._constructors)
+        determinism.analyze_program(program)
+        closedness.analyze_program(program, self._constructors)
+        tail_calls.analyze_program(program)
+        return self.compile_expression(program.body, frozenset())
+
+    def compile_expression(self, expr, scope):
+        # `scope` is the set of names that are lexically bound.
+        if expr.is_integer_constant():
+            return runtime.constant(values.IntegerConstant(expr.value),
+                                    source=expr)
+        elif expr.is_variable():
+            return self.compile_variable_or_constructor(expr, scope)
+        elif expr.is_lambda():
+            return self.compile_lambda(expr, scope)
+        elif expr.is_application():
+            return self.compile_application(expr, scope)
+        elif expr.is_let():
+            return self.compile_let(expr, scope)
+        elif expr.is_fresh():
+            return self.compile_fresh(expr, scope)
+        elif expr.is_index():
+            return self.compile_index(expr, scope)
+        else:
+            raise Exception(
+                    'Compilation not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+    def compile_variable_or_constructor(self, expr, scope):
+        if expr.name in scope:
+            return runtime.variable(expr.name)
+        elif expr.name in self._constructors:
+            return runtime.constructor(expr.name)
+        elif expr.name in self._primitives:
+            return runtime.primitive(expr.name)
+        else:
+            return runtime.unbound(expr.name)
+
+    def compile_lambda(self, expr, scope):
+        # Nested lambdas are compiled into a single closure that binds all
+        # their parameters at once when it is applied to enough arguments.
+        params, body = syntax.lambda_params(expr)
+        body = self.compile_expression(body, scope | set(params))
+        if len(params) == 1:
+            return runtime.lambda_(expr.var, body, source=expr)
+        return runtime.lambda_many(params, body, source=expr)
+
+    def compile_application(self, expr, scope):
+        head = expr.application_head()
+        args = [self.compile_expression(arg, scope)
+                  for arg in expr.application_args()]
+        if head.is_variable() and head.name not in scope:
+            if head.name in self._constructors:
+                return runtime.constructor_application(head.name, args,
+                                                       source=expr)
+            elif len(args) == 2 and head.name == common.OP_SEQUENCE:
+                [arg1, arg2] = expr.application_args()
+                if arg2.closed:
+                    return runtime.cached_sequence(*args, source=expr,
+                                                   closed=arg1.closed)
+                return runtime.sequence(*args, source=expr,
+                                        closed=arg1.closed)
+            elif len(args) == 2 and head.name == common.OP_ALTERNATIVE:
+                return runtime.alternative(*args, source=expr)
+            elif len(args) == 2 and head.name == common.OP_UNIFY:
+                return runtime.unification(*args, source=expr)
+        if head.is_variable() and expr.deterministic:
+            code = runtime.call(head.name, args, source=expr)
+        else:
+            fun = self.compile_expression(head, scope)
+            code = runtime.application(fun, args, source=expr)
+        if expr.tail_call:
+            return runtime.tail(code)
+        return code
+
+    def compile_let(self, expr, scope):
+        names = [decl.lhs.name
+                   for decl in expr.declarations if decl.is_definition()]
+        tabled = set([decl.name for decl in expr.declarations
+                                if decl.is_tabling_declaration()])
+        inner_scope = scope | set(names)
+        definitions = []
+        for decl in expr.declarations:
+            if not decl.is_definition():
+                continue
+            if decl.lhs.name in tabled:
+                rhs = self.compile_tabled_definition(decl, inner_scope)
+            elif decl.deterministic:
+                rhs = self.compile_deterministic_definition(decl,
+                                                            inner_scope)
+            else:
+                rhs = self.compile_expression(decl.rhs, inner_scope)
+            definitions.append((decl.lhs.name, rhs))
+        body = self.compile_expression(expr.body, inner_scope)
+        return runtime.let(definitions, body, source=expr)
+
+    def compile_deterministic_definition(self, decl, scope):
+        # A deterministic definition made of a single equation has no
+        # index, and its equation is run as the only alternative.
+        params, body = syntax.lambda_params(decl.rhs)
+        if body.is_index():
+            return self.compile_expression(decl.rhs, scope)
+        body = self.compile_alternative(body, scope | set(params))
+        return runtime.lambda_many(params, body, source=decl.rhs)
+
+    def compile_tabled_definition(self, decl, scope):
+        if not decl.closed:
+            raise Exception(
+                    ('Tabled definition {name} depends on variables ' +
+                     'bound outside of it.').format(name=decl.lhs.name)
+                  )
+        params, body = syntax.lambda_params(decl.rhs)
+        body = self.compile_expression(body, scope | set(params))
+        return runtime.lambda_many(params,
+                                   runtime.tabled(params, body))
+
+    def compile_fresh(self, expr, scope):
+        if expr.sole_alternative:
+            rule = determinism.rule_patterns(expr,
+                                             self._constructors - scope)
+            if rule is not None:
+                return self.compile_rule(expr, rule, scope)
+        body = self.compile_expression(expr.body, scope | set([expr.var]))
+        return runtime.fresh(expr.var, body, source=expr,
+                             type=datatypes.runtime_type(expr.type,
+                                                         self._datatypes))
+
+    def compile_index(self, expr, scope):
+        def compile_all(alternatives):
+            return [self.compile_expression(alternative, scope)
+                      for alternative in alternatives]
+        if expr.deterministic:
+            return self.compile_deterministic_index(expr, scope)
+        table = {}
+        for key, branch in expr.table.items():
+            table[key] = compile_all(branch)
+        return runtime.index(expr.var,
+                             table,
+                             compile_all(expr.default),
+                             compile_all(expr.alternatives),
+                             source=expr,
+                             residuating=expr.residuating,
+                             enumerable=expr.enumerable)
+
+    def compile_deterministic_index(self, expr, scope):
+        def compile_branch(branch):
+            if len(branch) == 0:
+                return None
+            [alternative] = branch
+            return self.compile_alternative(alternative, scope)
+        table = {}
+        for key, branch in expr.table.items():
+            table[key] = compile_branch(branch)
+        return runtime.deterministic_index(
+                 expr.var,
+                 table,
+                 compile_branch(expr.default),
+                 [self.compile_expression(alternative, scope)
+                    for alternative in expr.alternatives],
+                 source=expr,
+                 residuating=expr.residuating,
+                 enumerable=expr.enumerable)
+
+    def compile_alternative(self, expr, scope):
+        # The alternative is the only one that may match, so its patterns
+        # are matched rather than unified whenever possible.
+        rule = determinism.rule_patterns(expr, self._constructors - scope)
+        if rule is None:
+            return self.compile_expression(expr, scope)
+        return self.compile_rule(expr, rule, scope)
+
+    def compile_rule(self, expr, rule, scope):
+        goals, body = rule
+        fvs = determinism.goal_variables(goals)
+        return runtime.rule(goals,
+                            self.compile_expression(body, scope | fvs),
+                            source=expr)
@@ -1,6 +1,12 @@
+import arithmetic
 import common
+import datatypes
+import disequality
 import syntax
 import environment
+import fd
+import higher_order
+import residuation
 import values
 
 class PrimitiveDescriptor:
@@ -12,28 +18,46 @@ def primitive_constructors():
     return set([common.VALUE_UNIT])
 
 def primitive_functions():
-    return {
+    primitives = {
         common.OP_UNIFY: PrimitiveDescriptor(arity=2),
         common.OP_ALTERNATIVE: PrimitiveDescriptor(arity=2),
         common.OP_SEQUENCE: PrimitiveDescriptor(arity=2),
+        common.OP_DISEQUALITY: PrimitiveDescriptor(arity=2),
+        common.OP_EXTENSION: PrimitiveDescriptor(arity=4),
     }
+    for name in arithmetic.PRIMITIVES:
+        primitives[name] = PrimitiveDescriptor(arity=2)
+    for name, arity in fd.PRIMITIVES.items():
+        primitives[name] = PrimitiveDescriptor(arity=arity)
+    return primitives
 
 class Evaluator:
 
     def __init__(self):
         self._constructors = primitive_constructors()
+        # Arities of the constructors, to build saturated applications of
+        # constructors in one step.
+        self._constructor_arities = {common.VALUE_UNIT: 0}
         self._primitives = primitive_functions()
+        self._datatypes = {}
+        self._store = fd.Store(self.eval_value, self.strong_eval_value,
+                               self.unify)
 
     def eval_program(self, program, strategy='weak'):
         assert strategy in ['weak', 'strong']
         for data_decl in program.data_declarations:
             for constructor in data_decl.constructors:
                 self._constructors.add(constructor.name)
+                self._constructor_arities[constructor.name] = \
+                  datatypes.constructor_arity(constructor)
+        self._datatypes = datatypes.program_datatypes(
+                            program.data_declarations)
         env = environment.PersistentEnvironment()
         if strategy == 'weak':
             yield from self.eval_expression(program.body, env)
         else:
-            yield from self.strong_eval_expression(program.body, env)
+            for value in self.strong_eval_expression(program.body, env):
+                yield arithmetic.residual_answer(value)
 
     def strong_eval_expression(self, expr, env):
         for value in self.eval_expression(expr, env):
@@ -68,15 +92,18 @@ class Evaluator:
                     )
                   )
 
-    def strong_eval_values(self, values):
-        if len(values) == 0:
+    def strong_eval_values(self, vals):
+        if len(vals) == 0:
             yield []
             return
-        for v0 in self.strong_eval_value(values[0]):
-            for vs in self.strong_eval_values(values[1:]):
-                # NOTE: the values may have lost their decidedness.
+        for v0 in self.strong_eval_value(vals[0]):
+            instantiations = values.Metavar.instantiations
+            for vs in self.strong_eval_values(vals[1:]):
+                # The values vs are strongly decided, but evaluating them
+                # may have instantiated metavariables of v0.
                 result = [v0] + vs
-                if all([w.is_strongly_decided() for w in result]):
+                if values.Metavar.instantiations == instantiations or \
+                   v0.is_strongly_decided():
                     yield result
                 else:
                     yield from self.strong_eval_values(result)
@@ -96,6 +123,8 @@ class Evaluator:
             yield from self.eval_let(expr, env)
         elif expr.is_fresh():
             yield from self.eval_fresh(expr, env)
+        elif expr.is_index():
+            yield from self.eval_index(expr, env)
         else:
             raise Exception(
                     'Evaluation not implemented for {cls}.'.format(
@@ -128,13 +157,37 @@ class Evaluator:
         yield values.Closure(expr.var, expr.body, env)
 
     def eval_application(self, expr, env):
+        args = self.saturated_constructor_args(expr, env)
+        if args is not None:
+            yield values.RigidStructure(expr.application_head().name,
+                                        [values.Thunk(arg, env)
+                                         for arg in args])
+            return
         for value in self.eval_expression(expr.fun, env):
             yield from self.apply(value, values.Thunk(expr.arg, env))
 
+    def saturated_constructor_args(self, expr, env):
+        """If the expression is a constructor applied to as many arguments
+           as its arity, returns the arguments. Otherwise returns None."""
+        head = expr.application_head()
+        if not head.is_variable() or \
+           head.name not in self._constructor_arities or \
+           env.is_defined(head.name):
+            return None
+        args = expr.application_args()
+        if len(args) != self._constructor_arities[head.name]:
+            return None
+        return args
+
     def eval_let(self, expr, env):
         extended_env = env.extended()
         exprs = []
         for decl in expr.declarations:
+            if decl.is_tabling_declaration():
+                raise Exception(
+                        'Tabled definitions are only supported by ' +
+                        'evaluator_compiled.'
+                      )
             if not decl.is_definition():
                 continue
             extended_env.define(decl.lhs.name,
@@ -143,10 +196,42 @@ class Evaluator:
 
     def eval_fresh(self, expr, env):
         extended_env = env.extended()
-        symbol = values.Metavar(prefix=expr.var)
+        symbol = values.Metavar(prefix=expr.var,
+                                type=datatypes.runtime_type(expr.type,
+                                                            self._datatypes))
         env.define(expr.var, values.FlexStructure(symbol, []))
         yield from self.eval_expression(expr.body, extended_env)
 
+    def eval_index(self, expr, env):
+        value0 = env.value(expr.var)
+        for value in self.eval_value(value0):
+            env.set(expr.var, value)
+            symbol = residuation.waiting_symbol(value) \
+                       if expr.residuating else None
+            if symbol is not None:
+                yield from residuation.residuate(
+                             symbol,
+                             lambda: self.eval_index(expr, env),
+                             self.unify)
+            elif expr.enumerable and value.index_key() is None:
+                yield from self.eval_enumeration(expr, value, env)
+            else:
+                for alternative in expr.candidates(value.index_key()):
+                    yield from self.eval_expression(alternative, env)
+            env.set(expr.var, value0)
+
+    def eval_enumeration(self, expr, value, env):
+        arg_types = datatypes.constructors(value, expr.table.keys(),
+                                           self._datatypes)
+        if arg_types is None:
+            for alternative in expr.alternatives:
+                yield from self.eval_expression(alternative, env)
+            return
+        for key in datatypes.instantiations(value, expr.table.keys(),
+                                            arg_types, self.unify):
+            for alternative in expr.table[key]:
+                yield from self.eval_expression(alternative, env)
+
     def eval_value(self, value):
         if value.is_decided():
             yield value
@@ -167,6 +252,8 @@ class Evaluator:
     def apply_many(self, value, vargs):
         if len(vargs) == 0:
             yield value
+        elif value.is_rigid_structure():
+            yield values.RigidStructure(value.constructor, value.args + vargs)
         else:
             for v in self.apply(value, vargs[0]):
                 yield from self.apply_many(v, vargs[1:])
@@ -213,6 +300,17 @@ class Evaluator:
             yield from self.primitive_alternative(*vargs)
         elif value.name == common.OP_UNIFY:
             yield from self.primitive_unify(*vargs)
+        elif value.name == common.OP_DISEQUALITY:
+            yield from disequality.disequality(*vargs, self.strong_eval_value)
+        elif value.name == common.OP_EXTENSION:
+            yield from higher_order.extension(*vargs, self.eval_value,
+                                              self.strong_eval_value,
+                                              self.unify)
+        elif value.name in arithmetic.PRIMITIVES:
+            yield from arithmetic.apply_primitive(value.name, *vargs,
+                                                  self.eval_value, self.unify)
+        elif value.name in fd.PRIMITIVES:
+            yield from self._store.primitive(value.name, vargs)
         else:
             raise Exception(
                     'Primitive "{name}" not implemented.'.format(
@@ -234,6 +332,83 @@ class Evaluator:
     def primitive_unify(self, val1, val2):
         yield from self.unify([(val1, val2)])
 
+    def unify_flex_application(self, val1, val2, goals):
+        # See higher_order.py.
+        vargs = higher_order.ground_arguments(val1.args, self.known_value)
+        if vargs is not None and val2.is_flex_structure() \
+           and val2.symbol == val1.symbol:
+            # Same head: x a1 ... an == x b1 ... bn
+            vargs2 = higher_order.ground_arguments(val2.args,
+                                                   self.known_value)
+            if vargs2 is not None and \
+               higher_order.same_pattern(vargs, vargs2):
+                yield from self.unify(goals)
+                return
+        yield from self.instantiate_flex(
+                     val1.symbol,
+                     self.flex_function(val1.args, vargs, val2),
+                     goals)
+
+    def known_value(self, value):
+        """Returns the value of a thunk if it can be computed without
+           running any code: an integer constant, a saturated constructor
+           application, or a variable or an instantiated metavariable bound
+           to a value of these kinds. Any other value is returned as it
+           is."""
+        if value.is_flex_structure() and len(value.args) == 0 \
+           and value.symbol.is_instantiated():
+            return self.known_value(value.symbol.representative())
+        elif not value.is_thunk() or isinstance(value.expr, values.Value):
+            return value
+        expr = value.expr
+        env = value.env
+        if expr.is_integer_constant():
+            return values.IntegerConstant(expr.value)
+        elif expr.is_variable() and env.is_defined(expr.name):
+            return self.known_value(env.value(expr.name))
+        args = self.saturated_constructor_args(expr, env)
+        if args is not None:
+            return values.RigidStructure(expr.application_head().name,
+                                         [values.Thunk(arg, env)
+                                          for arg in args])
+        return value
+
+    def instantiate_flex(self, symbol, function, goals):
+        # TODO: occurs check
+        symbol.instantiate(function)
+        for _ in symbol.resume_goals():
+            yield from self.unify(goals)
+        symbol.uninstantiate()
+
+    def flex_function(self, args, vargs, value):
+        """Returns the extension for the ground arguments `vargs`, or the
+           imitation of the arguments `args` if `vargs` is None."""
+        new_var = syntax.fresh_variable()
+        params = [syntax.fresh_variable() for arg in args]
+        if vargs is not None:
+            body = syntax.application_many(
+                     syntax.Variable(name=common.OP_EXTENSION),
+                     [syntax.application_many(
+                        syntax.Variable(name=common.VALUE_UNIT), params),
+                      higher_order.tuple_value(vargs),
+                      value,
+                      syntax.application_many(new_var, params)])
+        else:
+            body = syntax.alternative(
+                     syntax.sequence_many1(
+                       [syntax.unify(p, a) for p, a in zip(params, args)],
+                       value # body
+                     ),
+                     syntax.application_many(new_var, params)
+                   )
+        env = environment.PersistentEnvironment()
+        env.define(new_var.name,
+                   values.FlexStructure(
+                     values.Metavar(prefix='F'),
+                     []))
+        return values.Thunk(syntax.lambda_many([p.name for p in params], body),
+                            env)
+
     def unify(self, goals):
         if len(goals) == 0:
             yield values.unit()
@@ -255,54 +430,20 @@ class Evaluator:
             if val1.value == val2.value:
                 yield from self.unify(goals)
         elif val1.is_rigid_structure() and val2.is_rigid_structure():
-            if val1.constructor == val2.constructor and \
+            if val1.tag is val2.tag and \
                len(val1.args) == len(val2.args):
                 subgoals = list(zip(val1.args, val2.args))
                 yield from self.unify(subgoals + goals)
 
-        # Same head:
-        #    x t1 ... tn == x s1 ... sn
-        #elif val1.is_flex_structure() \
-        #         and val2.is_flex_structure() \
-        #         and val1.symbol == val2.symbol \
-        #         and len(val1.args) == len(val2.args):
-        #     subgoals = list(zip(val1.args, val2.args))
-        #     yield from self.unify(subgoals + goals)
         elif val1.is_flex_structure() and len(val1.args) == 0:
             # TODO: occurs check
             assert not val1.symbol.is_instantiated() # decided
             val1.symbol.instantiate(val2)
-            yield from self.unify(goals)
+            for _ in val1.symbol.resume_goals():
+                yield from self.unify(goals)
             val1.symbol.uninstantiate()
         elif val1.is_flex_structure() and len(val1.args) > 0:
-            # TODO: occurs check
-            assert not val1.symbol.is_instantiated() # decided
-            new_var = syntax.fresh_variable()
-            params = [syntax.fresh_variable() for arg in val1.args]
-            term = syntax.lambda_many(
-                     [p.name for p in params],
-                     syntax.alternative(
-                       syntax.sequence_many1(
-                         [syntax.unify(p, a)
-                            for p, a in zip(params, val1.args)],
-                         val2 # body
-                       ),
-                       syntax.application_many(new_var, params)
-                     )
-                   )
-            env = environment.PersistentEnvironment()
-            env.define(new_var.name, 
-                       values.FlexStructure(
-                         values.Metavar(prefix='F'),
-                         []))
-            val1.symbol.instantiate(
-                values.Thunk(
-                    term,
-                    env
-                )
-            )
-            yield from self.unify(goals)
-            val1.symbol.uninstantiate()
+            yield from self.unify_flex_application(val1, val2, goals)
         elif val2.is_flex_structure():
             yield from self.unify([(val2, val1)] + goals)
         else:
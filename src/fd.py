@@ -0,0 +1,444 @@
+import functools
+
+import common
+import values
+
+# Finite domain constraints on integers.
+#
+# A Store keeps a domain for some of the uninstantiated metavariables
+# of type Int, and a list of the constraints that watch each of them.
+# Posting a constraint prunes the domains of its metavariables, and
+# every time a domain changes the constraints watching it are run again,
+# until nothing changes (propagation). A metavariable whose domain has a
+# single value is instantiated to it.
+#
+# The changes made to the store are recorded in a trail, so that they
+# can be undone when backtracking. Each metavariable known to the store
+# has a goal suspended on it (see values.Metavar.suspend_goal) that
+# checks its domain and propagates its constraints when the
+# metavariable is instantiated.
+#
+# Metavariables without a domain are unbounded. Their constraints are
+# checked once they are instantiated.
+#
+# The functions are parameterized by the `eval_value`,
+# `strong_eval_value` and `unify` functions of the evaluator that uses
+# the store. Labeling runs its alternatives through a `choose` function,
+# so that the evaluator can make them choice points of its search (see
+# parallel.py).
+
+PRIMITIVES = {
+    common.OP_FD_EQ: 2,
+    common.OP_FD_NE: 2,
+    common.OP_FD_LT: 2,
+    common.OP_FD_DOMAIN: 3,
+    common.OP_FD_ALL_DIFFERENT: 1,
+    common.OP_FD_LABELING: 1,
+}
+
+class Domain:
+    "A finite set of integers, as a bitset relative to an offset."
+
+    def __init__(self, offset, bits):
+        if bits != 0:
+            # Normalize, so that equal sets have the same representation.
+            shift = (bits & -bits).bit_length() - 1
+            offset += shift
+            bits >>= shift
+        self.offset = offset
+        self.bits = bits
+
+    @staticmethod
+    def interval(lo, hi):
+        if lo > hi:
+            return Domain(0, 0)
+        return Domain(lo, (1 << (hi - lo + 1)) - 1)
+
+    def is_empty(self):
+        return self.bits == 0
+
+    def size(self):
+        return bin(self.bits).count('1')
+
+    def min(self):
+        return self.offset
+
+    def max(self):
+        return self.offset + self.bits.bit_length() - 1
+
+    def contains(self, n):
+        return n >= self.offset and (self.bits >> (n - self.offset)) & 1 == 1
+
+    def remove(self, n):
+        if not self.contains(n):
+            return self
+        return Domain(self.offset, self.bits & ~(1 << (n - self.offset)))
+
+    def intersect(self, other):
+        offset = min(self.offset, other.offset)
+        bits = (self.bits << (self.offset - offset)) & \
+               (other.bits << (other.offset - offset))
+        return Domain(offset, bits)
+
+    def values(self):
+        result = []
+        bits = self.bits
+        n = self.offset
+        while bits != 0:
+            if bits & 1:
+                result.append(n)
+            bits >>= 1
+            n += 1
+        return result
+
+class Constraint:
+
+    def __init__(self, terms):
+        # Each term is an integer value or a metavariable.
+        self.terms = terms
+
+class Equal(Constraint):
+
+    def propagate(self, store):
+        [x, y] = [store.resolve(term) for term in self.terms]
+        if type(x) is int and type(y) is int:
+            return x == y
+        elif type(x) is int:
+            return store.restrict(y, x, x)
+        elif type(y) is int:
+            return store.restrict(x, y, y)
+        dx = store.domain(x)
+        dy = store.domain(y)
+        if dx is None:
+            return dy is None or store.set_domain(x, dy)
+        elif dy is None:
+            return store.set_domain(y, dx)
+        d = dx.intersect(dy)
+        return store.set_domain(x, d) and store.set_domain(y, d)
+
+class NotEqual(Constraint):
+
+    def propagate(self, store):
+        [x, y] = [store.resolve(term) for term in self.terms]
+        if type(x) is int and type(y) is int:
+            return x != y
+        elif type(x) is int:
+            return store.remove(y, x)
+        elif type(y) is int:
+            return store.remove(x, y)
+        return x is not y
+
+class LessThan(Constraint):
+
+    def propagate(self, store):
+        [x, y] = [store.resolve(term) for term in self.terms]
+        if type(x) is int and type(y) is int:
+            return x < y
+        elif x is y:
+            return False
+        hi = store.max(y)
+        if hi is not None and not store.restrict(x, None, hi - 1):
+            return False
+        lo = store.min(x)
+        if lo is not None and not store.restrict(y, lo + 1, None):
+            return False
+        return True
+
+class AllDifferent(Constraint):
+
+    def propagate(self, store):
+        terms = [store.resolve(term) for term in self.terms]
+        ground = [term for term in terms if type(term) is int]
+        if len(set(ground)) < len(ground):
+            return False
+        unbound = [term for term in terms if type(term) is not int]
+        for var in unbound:
+            for n in ground:
+                if not store.remove(var, n):
+                    return False
+        if len(set(unbound)) < len(unbound):
+            return False
+        # Pigeonhole principle.
+        union = Domain(0, 0)
+        for var in unbound:
+            domain = store.domain(var)
+            if domain is None:
+                return True
+            offset = min(union.offset, domain.offset)
+            union = Domain(offset,
+                           (union.bits << (union.offset - offset)) |
+                           (domain.bits << (domain.offset - offset)))
+        return union.size() >= len(unbound)
+
+class Store:
+
+    def __init__(self, eval_value, strong_eval_value, unify,
+                 choose=None):
+        self._eval_value = eval_value
+        self._strong_eval_value = strong_eval_value
+        self._unify = unify
+        if choose is None:
+            choose = run_alternatives
+        self._choose = choose
+        self._domains = {}
+        self._watchers = {}
+        self._trail = []
+        # Metavariables whose domain changed since the last propagation.
+        self._changed = []
+        # Metavariables whose domain has been reduced to a single value.
+        self._fixed = []
+
+    #### Domains
+
+    def resolve(self, value):
+        """Returns the integer a term is instantiated to, or its
+           metavariable if it is not instantiated."""
+        while True:
+            if type(value) is values.IntegerConstant:
+                return value.value
+            elif type(value) is values.FlexStructure and \
+                 len(value.args) == 0:
+                if not value.symbol.is_instantiated():
+                    return value.symbol
+                value = value.symbol.representative()
+            else:
+                raise Exception(
+                        ('Finite domain constraint on a value that is ' +
+                         'not an integer: {value}').format(
+                           value=value.show()
+                        ))
+
+    def domain(self, var):
+        return self._domains.get(var)
+
+    def min(self, term):
+        if type(term) is int:
+            return term
+        domain = self.domain(term)
+        return None if domain is None else domain.min()
+
+    def max(self, term):
+        if type(term) is int:
+            return term
+        domain = self.domain(term)
+        return None if domain is None else domain.max()
+
+    def set_domain(self, var, domain):
+        "Returns False if the domain is empty."
+        if domain.is_empty():
+            return False
+        old = self._domains.get(var)
+        if old is not None and old.bits == domain.bits and \
+           old.offset == domain.offset:
+            return True
+        self.register(var)
+        self._trail.append(('domain', var, old))
+        self._domains[var] = domain
+        self._changed.append(var)
+        if domain.bits & (domain.bits - 1) == 0:
+            self._fixed.append(var)
+        return True
+
+    def restrict(self, var, lo, hi):
+        "Restricts the domain of var to [lo, hi], where None is unbounded."
+        domain = self.domain(var)
+        if domain is None:
+            if lo is None or hi is None:
+                return True
+            return self.set_domain(var, Domain.interval(lo, hi))
+        if lo is None:
+            lo = domain.min()
+        if hi is None:
+            hi = domain.max()
+        return self.set_domain(var, domain.intersect(Domain.interval(lo, hi)))
+
+    def remove(self, var, n):
+        domain = self.domain(var)
+        if domain is None:
+            return True
+        return self.set_domain(var, domain.remove(n))
+
+    #### Constraints
+
+    def register(self, var):
+        if var in self._watchers:
+            return
+        self._watchers[var] = []
+        self._trail.append(('register', var))
+        var.suspend_goal(lambda: self.instantiated(var))
+
+    def watch(self, var, constraint):
+        self.register(var)
+        self._watchers[var].append(constraint)
+        self._trail.append(('watch', var))
+
+    def post(self, constraint):
+        "Adds a constraint to the store. Returns False if it fails."
+        for term in constraint.terms:
+            var = self.resolve(term)
+            if type(var) is not int:
+                self.watch(var, constraint)
+        return self.propagate([constraint])
+
+    def propagate(self, constraints):
+        queue = list(constraints)
+        self._changed = []
+        while len(queue) > 0:
+            constraint = queue.pop()
+            if not constraint.propagate(self):
+                return False
+            for var in self._changed:
+                for watcher in self._watchers.get(var, []):
+                    if watcher is not constraint and watcher not in queue:
+                        queue.append(watcher)
+            self._changed = []
+        return True
+
+    def instantiated(self, var):
+        "Goal run when a metavariable known to the store is instantiated."
+        mark = len(self._trail)
+        self._fixed = []
+        value = self.resolve(values.FlexStructure(var, []))
+        domain = self.domain(var)
+        if type(value) is int:
+            ok = domain is None or domain.contains(value)
+        else:
+            # Bound to another metavariable.
+            ok = domain is None or self.set_domain(
+                   value,
+                   domain if self.domain(value) is None
+                          else domain.intersect(self.domain(value)))
+            for constraint in self._watchers[var]:
+                self.watch(value, constraint)
+        if ok and self.propagate(self._watchers[var]):
+            yield from self.commit()
+        self.undo(mark)
+
+    def commit(self):
+        """Instantiates the metavariables that have a single value left.
+           Yields once for each solution."""
+        goals = []
+        for var in self._fixed:
+            domain = self.domain(var)
+            if not var.is_instantiated() and domain is not None and \
+               domain.size() == 1:
+                goals.append((values.FlexStructure(var, []),
+                              values.IntegerConstant(domain.min())))
+        self._fixed = []
+        if len(goals) == 0:
+            return (None,)
+        return self._unify(goals)
+
+    def undo(self, mark):
+        while len(self._trail) > mark:
+            entry = self._trail.pop()
+            if entry[0] == 'domain':
+                _, var, old = entry
+                if old is None:
+                    del self._domains[var]
+                else:
+                    self._domains[var] = old
+            elif entry[0] == 'watch':
+                self._watchers[entry[1]].pop()
+            elif entry[0] == 'register':
+                var = entry[1]
+                del self._watchers[var]
+                var.unsuspend_goal()
+
+    #### Primitives
+
+    def primitive(self, name, vargs):
+        "Yields the unit value once for each solution of the primitive."
+        if name == common.OP_FD_EQ:
+            yield from self.post_constraint(Equal, vargs)
+        elif name == common.OP_FD_NE:
+            yield from self.post_constraint(NotEqual, vargs)
+        elif name == common.OP_FD_LT:
+            yield from self.post_constraint(LessThan, vargs)
+        elif name == common.OP_FD_DOMAIN:
+            yield from self.post_domain(*vargs)
+        elif name == common.OP_FD_ALL_DIFFERENT:
+            for value in self._strong_eval_value(vargs[0]):
+                yield from self.post_constraint(AllDifferent,
+                                                data_terms(value))
+        elif name == common.OP_FD_LABELING:
+            for value in self._strong_eval_value(vargs[0]):
+                for _ in self.labeling(data_terms(value)):
+                    yield values.unit()
+
+    def post_constraint(self, cls, vargs):
+        for terms in self.eval_values(vargs):
+            mark = len(self._trail)
+            self._fixed = []
+            if self.post(cls(terms)):
+                for _ in self.commit():
+                    yield values.unit()
+            self.undo(mark)
+
+    def post_domain(self, var, lo, hi):
+        for [x, lo, hi] in self.eval_values([var, lo, hi]):
+            lo = self.resolve(lo)
+            hi = self.resolve(hi)
+            if type(lo) is not int or type(hi) is not int:
+                raise Exception('The bounds of a domain should be integers.')
+            x = self.resolve(x)
+            if type(x) is int:
+                if lo <= x <= hi:
+                    yield values.unit()
+                continue
+            mark = len(self._trail)
+            self._fixed = []
+            if self.restrict(x, lo, hi) and \
+               self.propagate(self._watchers.get(x, [])):
+                for _ in self.commit():
+                    yield values.unit()
+            self.undo(mark)
+
+    def labeling(self, terms):
+        "Instantiates the metavariables, smallest domain first."
+        unbound = [var for var in [self.resolve(term) for term in terms]
+                       if type(var) is not int]
+        if len(unbound) == 0:
+            yield None
+            return
+        for var in unbound:
+            if self.domain(var) is None:
+                raise Exception(
+                        'Cannot label {var}, which has no finite domain.'
+                          .format(var=var.show()))
+        var = min(unbound, key=lambda var: self.domain(var).size())
+        yield from self._choose([functools.partial(self.label, var, n, terms)
+                                   for n in self.domain(var).values()])
+
+    def label(self, var, n, terms):
+        for _ in self._unify([(values.FlexStructure(var, []),
+                               values.IntegerConstant(n))]):
+            yield from self.labeling(terms)
+
+    def eval_values(self, vals):
+        if len(vals) == 0:
+            yield []
+            return
+        for v0 in self._eval_value(vals[0]):
+            for vs in self.eval_values(vals[1:]):
+                yield [v0] + vs
+
+def run_alternatives(alternatives):
+    """Runs each alternative, a function returning an iterator, one after
+       the other."""
+    for alternative in alternatives:
+        yield from alternative()
+
+def data_terms(value):
+    """Returns the integers and the metavariables in a strongly
+       evaluated data structure."""
+    if type(value) is values.IntegerConstant:
+        return [value]
+    elif type(value) is values.FlexStructure and len(value.args) == 0:
+        return [value]
+    elif type(value) is values.RigidStructure:
+        terms = []
+        for arg in value.args:
+            terms.extend(data_terms(arg))
+        return terms
+    return []
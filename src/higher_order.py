@@ -0,0 +1,78 @@
+import common
+import disequality
+import values
+
+# Higher-order unification.
+#
+# To unify a flex structure F a1 ... an with a value v, the metavariable
+# F is instantiated with a function that returns v when applied to
+# a1 ... an, and behaves as a fresh metavariable G on other arguments.
+#
+# If the arguments a1 ... an are ground data, which plays the role of
+# the pattern fragment of higher-order unification, the function is:
+#     λ x1 ... xn . extension (x1, ..., xn) (a1, ..., an) v (G x1 ... xn)
+# where `extension` (common.OP_EXTENSION) compares the tuple of its
+# arguments with (a1, ..., an). It selects v or (G x1 ... xn) without a
+# choice point if they are known to be equal or different, and only
+# branches if they may still become equal.
+#
+# Otherwise the function is the imitation:
+#     λ x1 ... xn . (x1 == a1 >> ... >> xn == an >> v) <> G x1 ... xn
+#
+# The arguments are not evaluated to tell the two cases apart, since the
+# function may never use them: only arguments whose value can be computed
+# without running any code (such as constants and constructor
+# applications) count as ground data. The imitation receives the
+# arguments as they are.
+#
+# Tuples are represented by the unit constructor applied to their
+# components.
+#
+# The functions are parameterized by the `eval_value`,
+# `strong_eval_value` and `unify` functions of the evaluator that uses
+# them.
+
+def ground_arguments(args, known_value):
+    """Returns the values of the arguments if they are ground data, or None
+       otherwise. `known_value` returns the value of an argument if it can
+       be computed without running any code, or the argument itself."""
+    vargs = [ground_data(arg, known_value) for arg in args]
+    if any([varg is None for varg in vargs]):
+        return None
+    return vargs
+
+def ground_data(value, known_value):
+    value = known_value(value)
+    cls = type(value)
+    if cls is values.IntegerConstant:
+        return value
+    elif cls is values.RigidStructure:
+        vargs = ground_arguments(value.args, known_value)
+        if vargs is None:
+            return None
+        return values.RigidStructure(value.constructor, vargs)
+    return None
+
+def tuple_value(vargs):
+    return values.RigidStructure(common.VALUE_UNIT, vargs)
+
+def same_pattern(vargs1, vargs2):
+    "Returns True if the ground arguments are equal."
+    return disequality.unifier_metavars(tuple_value(vargs1),
+                                        tuple_value(vargs2)) == []
+
+def extension(actual, expected, value, default,
+              eval_value, strong_eval_value, unify):
+    for varg in strong_eval_value(actual):
+        for vexpected in strong_eval_value(expected):
+            metavars = disequality.unifier_metavars(varg, vexpected)
+            if metavars is None:
+                yield from eval_value(default)
+            elif len(metavars) == 0:
+                yield from eval_value(value)
+            else:
+                for _ in unify([(varg, vexpected)]):
+                    yield from eval_value(value)
+                for _ in disequality.disequality(varg, vexpected,
+                                                 strong_eval_value):
+                    yield from eval_value(default)
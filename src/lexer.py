@@ -14,6 +14,8 @@ KEYWORDS = {
     'infix': token.INFIX,
     'infixl': token.INFIXL,
     'infixr': token.INFIXR,
+    'residuating': token.RESIDUATING,
+    'tabled': token.TABLED,
     'where': token.WHERE,
     ':': token.COLON,
     '=': token.EQ,
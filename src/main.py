@@ -5,8 +5,13 @@ import syntax
 import parsing
 import typechecker
 import evaluator_bfs
+import evaluator_compiled
+import codegen
+import parallel
+import runtime
+import rendering
 
-def run(filename):
+def check_file(filename):
     with open(filename) as f:
         source = f.read()
 
@@ -17,21 +22,110 @@ def run(filename):
     typechecker_ = typechecker.TypeChecker()
     checked_ast = typechecker_.check_program(ast)
     #print(checked_ast.show())
+    return checked_ast
 
-    evaluator = evaluator_bfs.Evaluator()
-    results = evaluator.eval_program(checked_ast, strategy='strong')
-    for result in results:
+def uses_tabling(program):
+    """True if the program has tabled definitions. Only evaluator_compiled
+       supports tabling."""
+    expr = program.body
+    while expr.is_let():
+        if any(decl.is_tabling_declaration() for decl in expr.declarations):
+            return True
+        expr = expr.body
+    return False
+
+def run(filename, jobs=None, ordered=True):
+    checked_ast = check_file(filename)
+    if jobs is not None and uses_tabling(checked_ast):
+        # A worker only explores part of the search, so it cannot tell
+        # when a table is complete.
+        sys.stderr.write('Tabled programs are not run in parallel.\n')
+        jobs = None
+    if jobs is None and uses_tabling(checked_ast):
+        evaluator = evaluator_compiled.Evaluator()
+        results = evaluator.eval_program(checked_ast, strategy='strong')
+        shown_results = (result.show() for result in results)
+    elif jobs is None:
+        evaluator = evaluator_bfs.Evaluator()
+        results = evaluator.eval_program(checked_ast, strategy='strong')
+        shown_results = (result.show() for result in results)
+    else:
+        def run_worker():
+            evaluator = evaluator_compiled.Evaluator()
+            return evaluator.eval_program(checked_ast, strategy='strong')
+        shown_results = parallel.solutions(run_worker, jobs=jobs,
+                                           ordered=ordered)
+    for shown_result in shown_results:
+        print(shown_result)
+        input(" ; ")
+    print("done.")
+
+def run_lazy(filename, depth=rendering.DEFAULT_DEPTH,
+             width=rendering.DEFAULT_WIDTH):
+    checked_ast = check_file(filename)
+    if uses_tabling(checked_ast):
+        evaluator = evaluator_compiled.Evaluator()
+        eval_value = runtime.eval_value
+    else:
+        evaluator = evaluator_bfs.Evaluator()
+        eval_value = evaluator.eval_value
+    for result in evaluator.eval_program(checked_ast, strategy='weak'):
+        for rendered in rendering.render(result, eval_value, depth, width):
+            print(rendered.show())
+            input(" ; ")
+    print("done.")
+
+def run_and_parallel(filename, jobs):
+    checked_ast = check_file(filename)
+    if uses_tabling(checked_ast):
+        # The conjuncts run by the workers cannot tell when a table of
+        # the main process is complete.
+        sys.stderr.write('Tabled programs are not run in parallel.\n')
+    else:
+        runtime.CONJUNCTIONS = parallel.Conjunctions(jobs)
+    evaluator = evaluator_compiled.Evaluator()
+    for result in evaluator.eval_program(checked_ast, strategy='strong'):
         print(result.show())
         input(" ; ")
     print("done.")
 
+def compile_file(filename, output_filename):
+    checked_ast = check_file(filename)
+    module = codegen.generate_module(checked_ast, filename=filename)
+    with open(output_filename, 'w') as f:
+        f.write(module)
+
 def usage(program):
     sys.stderr.write('Usage: {program} input.fa\n'.format(program=program))
+    sys.stderr.write(
+      '       {program} compile input.fa output.py\n'.format(program=program))
+    sys.stderr.write(
+      '       {program} parallel jobs input.fa\n'.format(program=program))
+    sys.stderr.write(
+      '       {program} parallel-unordered jobs input.fa\n'.format(
+        program=program))
+    sys.stderr.write(
+      '       {program} and-parallel jobs input.fa\n'.format(program=program))
+    sys.stderr.write(
+      '       {program} lazy [depth width] input.fa\n'.format(
+        program=program))
     sys.exit()
 
 def main(argv):
     if len(argv) == 2:
         run(argv[1])
+    elif len(argv) == 4 and argv[1] == 'compile':
+        compile_file(argv[2], argv[3])
+    elif len(argv) == 4 and argv[1] == 'parallel':
+        run(argv[3], jobs=int(argv[2]))
+    elif len(argv) == 4 and argv[1] == 'parallel-unordered':
+        run(argv[3], jobs=int(argv[2]), ordered=False)
+    elif len(argv) == 4 and argv[1] == 'and-parallel':
+        run_and_parallel(argv[3], int(argv[2]))
+    elif len(argv) == 3 and argv[1] == 'lazy':
+        run_lazy(argv[2])
+    elif len(argv) == 5 and argv[1] == 'lazy':
+        run_lazy(argv[4], depth=int(argv[2]), width=int(argv[3]))
     else:
         usage(argv[0])
 
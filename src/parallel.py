@@ -0,0 +1,262 @@
+import heapq
+import multiprocessing
+import os
+import signal
+
+import runtime
+
+# Or-parallel search.
+#
+# The state of a search is represented by its path: the list of the
+# alternatives taken at each choice point, from the root of the search
+# tree. Since evaluation is deterministic, a worker process can resume
+# the search at any node by running the program again and following a
+# given path (its "prefix") at the first choice points. Paths are lists
+# of integers, so they are easily sent between processes.
+#
+# Every worker runs its own task (a prefix) to completion. When some
+# worker is idle, a busy worker gives away the untried alternatives of
+# its shallowest choice point, each of them as a new task, and skips
+# them itself.
+#
+# Some parts of the runtime enumerate several solutions without going
+# through Search.choose (for instance, unifications with more than one
+# solution). Such a hidden choice point runs the choice points after it
+# once for each of its solutions, so they do not have a single path. A
+# choice point that has been reached more than once with the same path
+# is not given away, nor is any choice point below it. A worker only
+# reports the solutions found under the choice point of its prefix, and
+# stops when that choice point is exhausted, since anything else belongs
+# to the worker that gave the task away.
+#
+# Paths compare in the same order as their solutions are found by a
+# sequential search, so the solutions can be merged back in order.
+#
+# And-parallel evaluation of conjunctions.
+#
+# In a conjunction (e1 >> e2), if e1 is closed (see closedness.py), its
+# solutions have no effect on the rest of the program, so only their
+# number matters. Such an e1 is evaluated in a forked process, which
+# reports each of its solutions through a pipe, while the parent
+# evaluates e2 once for each reported solution. If e2 is closed too,
+# the conjuncts are independent: the parent computes the solutions of
+# e2 once, while the child is still searching for the solutions of e1,
+# and joins them with each solution of e1 (see runtime.cached_sequence).
+# Solutions are produced in the same order as in a sequential search.
+
+class Search:
+    "Controls the choice points of the runtime in a worker process."
+
+    # Number of choice points between checks for idle workers.
+    SHARE_INTERVAL = 64
+
+    def __init__(self, prefix, demand, share):
+        self.prefix = prefix
+        self.path = []
+        # For each choice point in the path, its pair
+        # [next alternative, number of alternatives], or None if the
+        # choice point belongs to the prefix.
+        self._frames = []
+        # For each depth up to the length of the path, the number of
+        # times a choice point at that depth has been reached since the
+        # current alternative of the previous choice point was taken.
+        self._arrivals = [0]
+        self._demand = demand
+        self._share = share
+        self._countdown = Search.SHARE_INTERVAL
+
+    def choose(self, codes, env):
+        depth = len(self.path)
+        self._arrivals[depth] += 1
+        if depth < len(self.prefix):
+            if self._arrivals[depth] > 1:
+                # The prefix has already been followed (see above).
+                raise TaskDone()
+            i = self.prefix[depth]
+            self.path.append(i)
+            self._frames.append(None)
+            self._arrivals.append(0)
+            yield from codes[i](env)
+            if depth == len(self.prefix) - 1:
+                raise TaskDone()
+            self.path.pop()
+            self._frames.pop()
+            self._arrivals.pop()
+            return
+        frame = [0, len(codes)]
+        self.path.append(0)
+        self._frames.append(frame)
+        self._arrivals.append(0)
+        while frame[0] < frame[1]:
+            i = frame[0]
+            frame[0] += 1
+            self.path[depth] = i
+            self._arrivals[depth + 1] = 0
+            self._countdown -= 1
+            if self._countdown == 0:
+                self._countdown = Search.SHARE_INTERVAL
+                if self._demand.value > 0:
+                    self.give_away()
+            yield from codes[i](env)
+        self.path.pop()
+        self._frames.pop()
+        self._arrivals.pop()
+
+    def in_task(self):
+        "Returns True if the current path is under the prefix of the task."
+        return len(self.path) >= len(self.prefix)
+
+    def give_away(self):
+        for depth, frame in enumerate(self._frames):
+            if self._arrivals[depth] > 1:
+                return
+            if frame is None or frame[0] == frame[1]:
+                continue
+            prefixes = [self.path[:depth] + [i]
+                          for i in range(frame[0], frame[1])]
+            frame[1] = frame[0]
+            with self._demand.get_lock():
+                self._demand.value -= len(prefixes)
+            self._share(prefixes)
+            return
+
+class TaskDone(Exception):
+    "Raised when a worker has explored all the choice points of its task."
+
+class Conjunctions:
+    "Runs the conjunctions of the runtime, in parallel when possible."
+
+    def __init__(self, jobs=None):
+        if jobs is None:
+            jobs = os.cpu_count()
+        self._jobs = jobs
+        self._active = 0
+
+    def sequence(self, val1, rest):
+        "Runs (val1 >> rest()), where val1 is closed."
+        if self._active >= self._jobs:
+            for _ in runtime.eval_value(val1):
+                yield from rest()
+            return
+        yield from self.parallel_sequence(val1, rest)
+
+    def parallel_sequence(self, val1, rest):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            runtime.CONJUNCTIONS = None
+            status = 0
+            try:
+                with os.fdopen(write_fd, 'wb', buffering=0) as output:
+                    for _ in runtime.eval_value(val1):
+                        output.write(b'.')
+            except BaseException:
+                status = 1
+            os._exit(status)
+        os.close(write_fd)
+        self._active += 1
+        finished = False
+        try:
+            with os.fdopen(read_fd, 'rb', buffering=0) as input_:
+                while len(input_.read(1)) > 0:
+                    yield from rest()
+            finished = True
+        finally:
+            self._active -= 1
+            if not finished:
+                os.kill(pid, signal.SIGKILL)
+            _, status = os.waitpid(pid, 0)
+        if status != 0:
+            raise Exception('Worker failed evaluating a conjunction.')
+
+def solutions(run, jobs=None, ordered=True):
+    """Yields the solutions of a search, as strings, running it in `jobs`
+       worker processes. The function `run` is called in each worker and
+       should return an iterator over the values of the program, evaluated
+       with evaluator_compiled. If `ordered` is true, the solutions are
+       yielded in the same order as a sequential search would find them."""
+    if jobs is None:
+        jobs = os.cpu_count()
+    context = multiprocessing.get_context('fork')
+    tasks = context.Queue()
+    messages = context.Queue()
+    # Number of idle workers minus the number of tasks waiting for them.
+    demand = context.Value('i', 0)
+
+    workers = [context.Process(target=worker,
+                               args=(run, tasks, messages, demand),
+                               daemon=True)
+               for _ in range(jobs)]
+    # Maps each task that is not done to a lower bound for the paths of
+    # its next solutions, as a pair (path, strict).
+    outstanding = {}
+    next_task = 0
+    pending = []
+    sequence = 0
+
+    def add_task(prefix):
+        nonlocal next_task
+        outstanding[next_task] = (prefix, False)
+        tasks.put((next_task, prefix))
+        next_task += 1
+
+    def can_yield(path):
+        for bound, strict in outstanding.values():
+            if path > bound or (path == bound and not strict):
+                return False
+        return True
+
+    with demand.get_lock():
+        demand.value -= 1
+    add_task([])
+    for process in workers:
+        process.start()
+    try:
+        while len(outstanding) > 0:
+            message = messages.get()
+            if message[0] == 'tasks':
+                for prefix in message[1]:
+                    add_task(prefix)
+            elif message[0] == 'solution':
+                _, task, path, text = message
+                if ordered:
+                    outstanding[task] = (path, True)
+                    heapq.heappush(pending, (path, sequence, text))
+                    sequence += 1
+                else:
+                    yield text
+            elif message[0] == 'done':
+                del outstanding[message[1]]
+            elif message[0] == 'error':
+                raise Exception(
+                        'Worker failed: {error}'.format(error=message[1]))
+            while len(pending) > 0 and can_yield(pending[0][0]):
+                yield heapq.heappop(pending)[2]
+    finally:
+        for process in workers:
+            process.terminate()
+
+def worker(run, tasks, messages, demand):
+    def share(prefixes):
+        messages.put(('tasks', prefixes))
+    while True:
+        with demand.get_lock():
+            demand.value += 1
+        task = tasks.get()
+        task_id, prefix = task
+        search = Search(prefix, demand, share)
+        runtime.SEARCH = search
+        try:
+            for result in run():
+                if search.in_task():
+                    messages.put(('solution', task_id, list(search.path),
+                                  result.show()))
+        except TaskDone:
+            pass
+        except Exception as e:
+            messages.put(('error', repr(e)))
+            return
+        finally:
+            runtime.SEARCH = None
+        messages.put(('done', task_id))
@@ -24,6 +24,21 @@ class Parser:
         self.declare_operator(token.INFIXR, 150, common.OP_SEQUENCE)
         self.declare_operator(token.INFIXR, 200, common.OP_UNIFY)
 
+        # Built-in operators, whose fixity the program may declare again
+        # for its own definitions.
+        for fixity, level, name in [
+              (token.INFIX, 200, common.OP_DISEQUALITY),
+              (token.INFIX, 200, common.OP_LT),
+              (token.INFIX, 200, common.OP_LE),
+              (token.INFIX, 200, common.OP_FD_EQ),
+              (token.INFIX, 200, common.OP_FD_NE),
+              (token.INFIX, 200, common.OP_FD_LT),
+              (token.INFIXL, 500, common.OP_ADD),
+              (token.INFIXL, 500, common.OP_SUB),
+              (token.INFIXL, 600, common.OP_MUL),
+            ]:
+            self.declare_operator(fixity, level, name, overridable=True)
+
     def parse_program(self):
         position = self.current_position()
         self.match(token.BEGIN)
@@ -88,6 +103,10 @@ class Parser:
         return declarations
 
     def parse_value_declaration(self):
+        if self._token.type() == token.TABLED:
+            return self.parse_tabling_declaration()
+        if self._token.type() == token.RESIDUATING:
+            return self.parse_residuation_declaration()
         if self._token.type() == token.ID:
             tok = self._token
             self.next_token()
@@ -112,6 +131,20 @@ class Parser:
         type = self.parse_expression()
         return syntax.TypeDeclaration(name=name, type=type, position=position)
 
+    def parse_tabling_declaration(self):
+        position = self.current_position()
+        self.match(token.TABLED)
+        name = self._token.value() # Do not use self.parse_id() here.
+        self.match(token.ID)
+        return syntax.TablingDeclaration(name=name, position=position)
+
+    def parse_residuation_declaration(self):
+        position = self.current_position()
+        self.match(token.RESIDUATING)
+        name = self._token.value() # Do not use self.parse_id() here.
+        self.match(token.ID)
+        return syntax.ResiduationDeclaration(name=name, position=position)
+
     def parse_declaration(self):
         position = self.current_position()
         lhs = self.parse_expression()
@@ -301,11 +334,13 @@ class Parser:
 
     ##
 
-    def declare_operator(self, fixity, precedence, name, position=None):
+    def declare_operator(self, fixity, precedence, name, position=None,
+                         overridable=False):
         if position is None:
             position = self._token.position()
         self._prectable.declare_operator(fixity, precedence, name,
-                                         position=position)
+                                         position=position,
+                                         overridable=overridable)
 
     def is_declared_operator(self, name):
         return self._prectable.is_declared_operator(name)
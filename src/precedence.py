@@ -21,6 +21,9 @@ class PrecedenceLevel:
     def declare_operator(self, name):
         self._operators.add(name)
 
+    def remove_operator(self, name):
+        self._operators.discard(name)
+
     def operators(self):
         return self._operators
 
@@ -37,12 +40,19 @@ class PrecedenceTable:
         self._table_keys = []
         self._operators = set([])
         self._parts = set([])
+        # Operators whose fixity may be declared again by the program.
+        self._overridable = set([])
 
-    def declare_operator(self, fixity, precedence, name, position=None):
+    def declare_operator(self, fixity, precedence, name, position=None,
+                         overridable=False):
         if not common.is_operator(name):
             self.fail('not-an-operator', name=name, position=position)
+        if name in self._overridable:
+            self.remove_operator(name)
         if name in self._operators:
             self.fail('operator-already-exists', name=name, position=position)
+        if overridable:
+            self._overridable.add(name)
 
         for part in lexer.operator_to_parts(name):
             if part != '':
@@ -56,6 +66,15 @@ class PrecedenceTable:
             self._table_keys = sorted(self._table.keys())
         self._table[key].declare_operator(name)
 
+    def remove_operator(self, name):
+        self._operators.remove(name)
+        self._overridable.discard(name)
+        for key, level in list(self._table.items()):
+            level.remove_operator(name)
+            if len(level.operators()) == 0:
+                del self._table[key]
+        self._table_keys = sorted(self._table.keys())
+
     def fixity(self, key):
         return self._table[key].fixity()
 
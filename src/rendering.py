@@ -0,0 +1,86 @@
+import values
+
+# Demand-driven rendering of results.
+#
+# With the weak strategy a result is only evaluated to weak head normal
+# form. Rendering it forces its subterms as they are reached, up to a
+# given depth and width, and replaces the rest with values.Elision, shown
+# as "...". Huge or infinite results are then shown without evaluating
+# them completely.
+#
+# The depth limits the nesting of arguments. The width limits the length
+# of a chain of applications of the same constructor through its last
+# argument, such as the elements of a list x1 ∷ x2 ∷ ... ∷ xn, which do
+# not count as nesting.
+#
+# The functions are parameterized by the `eval_value` function of the
+# evaluator that uses them.
+
+DEFAULT_DEPTH = 20
+DEFAULT_WIDTH = 50
+
+def render(value, eval_value, depth=DEFAULT_DEPTH, width=DEFAULT_WIDTH):
+    """Yields the value evaluated up to the given depth and width, for
+       each of its values."""
+    yield from _render(value, eval_value, depth, width, width, None)
+
+def _render(value, eval_value, depth, width, remaining, constructor):
+    # The value may have `depth` levels of nesting. If it is the last
+    # argument of `constructor`, `remaining` more applications of the
+    # same constructor may follow.
+    for v in eval_value(value):
+        if not (v.is_rigid_structure() or v.is_flex_structure() or
+                v.is_primitive()):
+            yield v
+            continue
+        head = v.constructor if v.is_rigid_structure() else None
+        if head is not None and head == constructor:
+            if remaining == 0:
+                yield values.Elision()
+                continue
+            inner_depth = depth
+            inner_remaining = remaining - 1
+        else:
+            if depth == 0:
+                yield values.Elision()
+                continue
+            inner_depth = depth - 1
+            inner_remaining = width - 1
+        for vargs in _render_args(v.args, eval_value, inner_depth, width,
+                                  inner_remaining, head):
+            yield _with_args(v, vargs)
+
+def _render_args(args, eval_value, depth, width, remaining, constructor):
+    if len(args) == 0:
+        yield []
+        return
+    if len(args) == 1:
+        # The last argument may continue a chain.
+        if remaining == 0:
+            arg_values = [values.Elision()]
+        else:
+            arg_values = _render(args[0], eval_value, depth, width,
+                                 remaining, constructor)
+    elif depth == 0:
+        arg_values = [values.Elision()]
+    else:
+        arg_values = _render(args[0], eval_value, depth, width, width, None)
+    for v0 in arg_values:
+        instantiations = values.Metavar.instantiations
+        for vs in _render_args(args[1:], eval_value, depth, width,
+                               remaining, constructor):
+            if values.Metavar.instantiations == instantiations:
+                yield [v0] + vs
+            else:
+                # Rendering the other arguments instantiated some
+                # metavariable, which may occur in v0.
+                yield from _render_args([v0] + vs, eval_value, depth, width,
+                                        remaining, constructor)
+
+def _with_args(value, vargs):
+    if value.is_rigid_structure():
+        return values.RigidStructure(value.constructor, vargs)
+    elif value.is_flex_structure():
+        return values.FlexStructure(value.symbol, vargs)
+    else:
+        return values.Primitive(value.name, vargs)
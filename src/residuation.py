@@ -0,0 +1,35 @@
+import values
+
+# Residuation.
+#
+# The calls to a definition declared `residuating f` do not narrow. If
+# a parameter its definitional tree selects on is bound to a
+# metavariable that is not instantiated yet, the call is suspended on
+# the metavariable (see values.Metavar.suspend_goal) instead of trying
+# every alternative. The call evaluates to a fresh metavariable, which
+# is unified with the values of the call when it is resumed.
+#
+# Patterns nested inside the arguments are still unified as usual.
+# A call whose arguments never get instantiated is never resumed.
+#
+# The functions are parameterized by the `unify` function of the
+# evaluator that uses them.
+
+def waiting_symbol(value):
+    """Returns the metavariable a residuating index on the given decided
+       value has to wait for, or None if it can select its alternatives."""
+    if value.is_flex_structure():
+        return value.symbol
+    return None
+
+def residuate(symbol, call, unify):
+    """Suspends a call on the metavariable `symbol`. `call` is a function
+       with no parameters that returns an iterable over the values of
+       the call."""
+    result = values.FlexStructure(values.Metavar(prefix='r'), [])
+    def goal():
+        for value in call():
+            yield from unify([(result, value)])
+    symbol.suspend_goal(goal)
+    yield result
+    symbol.unsuspend_goal()
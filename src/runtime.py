@@ -0,0 +1,1395 @@
+import collections
+import weakref
+
+import arithmetic
+import common
+import datatypes
+import disequality
+import environment
+import fd
+import higher_order
+import residuation
+import values
+
+# Run-time support for compiled programs.
+#
+# A compiled expression is a Python function that receives a
+# PersistentEnvironment and returns an iterable over the values the
+# expression evaluates to. Compiled functions are built once, by the
+# combinators at the end of this module, so that evaluation does not
+# have to inspect the syntax tree at every step.
+
+# If not None, an object that runs the choice points of the program,
+# with a method `choose(codes, env)` (see parallel.py).
+SEARCH = None
+
+# If not None, an object that runs the conjunctions of the program
+# whose first conjunct is closed (see closedness.py), with a method
+# `sequence(val1, rest)` (see parallel.py).
+CONJUNCTIONS = None
+
+class Code:
+    "Compiled code, together with the source it was compiled from."
+
+    def __init__(self, code, source, value=None, pure=False, variable=None):
+        self.code = code
+        self.source = source
+        # If the code denotes a constant (decided) value, `value` holds it
+        # so that it can be passed around without suspending it.
+        self.value = value
+        # If the code denotes a variable, its name.
+        self.variable = variable
+        # The code is pure if it always evaluates to exactly one value
+        # without instantiating any metavariable.
+        self.pure = pure or value is not None
+
+    def show(self):
+        if isinstance(self.source, str):
+            return self.source
+        return self.source.show()
+
+class LambdaCode(Code):
+    """Compiled code for a lambda of one or more parameters, which
+       evaluates to a closure."""
+
+    def __init__(self, vars, body, source):
+        self.vars = vars
+        self.body = body
+        closure = self.closure
+        def code(env):
+            return (closure(env),)
+        super().__init__(code, source, pure=True)
+
+    def closure(self, env):
+        if len(self.vars) == 1:
+            return values.Closure(self.vars[0], self.body, env)
+        return values.MultiClosure(self.vars, self.body, env, [])
+
+class PrimitiveDescriptor:
+
+    def __init__(self, arity, function):
+        self.arity = arity
+        self.function = function
+
+def primitive_constructors():
+    return set([common.VALUE_UNIT])
+
+def primitive_functions():
+    primitives = {
+        common.OP_UNIFY: PrimitiveDescriptor(arity=2,
+                                             function=primitive_unify),
+        common.OP_ALTERNATIVE: PrimitiveDescriptor(
+                                 arity=2,
+                                 function=primitive_alternative),
+        common.OP_SEQUENCE: PrimitiveDescriptor(arity=2,
+                                                function=primitive_sequence),
+        common.OP_DISEQUALITY: PrimitiveDescriptor(
+                                 arity=2,
+                                 function=primitive_disequality),
+        common.OP_EXTENSION: PrimitiveDescriptor(
+                               arity=4,
+                               function=primitive_extension),
+    }
+    for name in arithmetic.PRIMITIVES:
+        primitives[name] = PrimitiveDescriptor(
+                             arity=2,
+                             function=primitive_arithmetic(name))
+    for name, arity in fd.PRIMITIVES.items():
+        primitives[name] = PrimitiveDescriptor(
+                             arity=arity,
+                             function=primitive_constraint(name))
+    return primitives
+
+def not_implemented(operation, value):
+    raise Exception(
+            '{operation} not implemented for {cls}.'.format(
+              operation=operation,
+              cls=type(value)
+            )
+          )
+
+#### Evaluation
+
+def kind_table(functions, default):
+    """Returns a table, indexed by the kind of a value (see values.py),
+       with the function for each class of values or the default."""
+    table = [default] * values.NUM_KINDS
+    for cls, function in functions.items():
+        table[cls.kind] = function
+    return table
+
+def eval_value(value):
+    return _EVAL_VALUE[value.kind](value)
+
+def _eval_decided(value):
+    return (value,)
+
+def _eval_thunk(value):
+    return value.expr.code(value.env)
+
+def _eval_flex(value):
+    if not value.symbol.is_instantiated():
+        return (value,)
+    return apply_many(value.symbol.representative(), value.args)
+
+_EVAL_VALUE = kind_table({
+    values.Thunk: _eval_thunk,
+    values.FlexStructure: _eval_flex,
+}, _eval_decided)
+
+def apply(value, varg):
+    return _APPLY[value.kind](value, varg)
+
+def apply_many(value, vargs):
+    if len(vargs) == 0:
+        return (value,)
+    elif len(vargs) == 1:
+        return apply(value, vargs[0])
+    elif type(value) is values.RigidStructure:
+        return (values.RigidStructure(value.constructor, value.args + vargs),)
+    elif type(value) is values.MultiClosure:
+        return _apply_many_closure(value, vargs)
+    return _apply_many(value, vargs, 0)
+
+def _apply_many(value, vargs, i):
+    if i == len(vargs):
+        yield value
+        return
+    for v in apply(value, vargs[i]):
+        yield from _apply_many(v, vargs, i + 1)
+
+def _apply_thunk(value, varg):
+    for v in value.expr.code(value.env):
+        yield from apply(v, varg)
+
+def _apply_rigid(value, varg):
+    return (values.RigidStructure(value.constructor, value.args + [varg]),)
+
+def _apply_flex(value, varg):
+    return (values.FlexStructure(value.symbol, value.args + [varg]),)
+
+def _apply_closure(value, varg):
+    extended_env = value.env.extended()
+    extended_env.define(value.var, varg)
+    return value.body.code(extended_env)
+
+def _apply_multi_closure(value, varg):
+    args = value.args + [varg]
+    if len(args) < len(value.vars):
+        return (values.MultiClosure(value.vars, value.body, value.env, args),)
+    return _enter_closure(value, args)
+
+def _apply_many_closure(value, vargs):
+    missing = len(value.vars) - len(value.args)
+    if len(vargs) < missing:
+        return (values.MultiClosure(value.vars, value.body, value.env,
+                                    value.args + vargs),)
+    elif len(vargs) == missing:
+        return _enter_closure(value, value.args + vargs)
+    return _apply_many_results(_enter_closure(value,
+                                              value.args + vargs[:missing]),
+                               vargs[missing:])
+
+def _apply_many_results(results, vargs):
+    for v in results:
+        yield from apply_many(v, vargs)
+
+def _enter_closure(value, args):
+    "Evaluates the body of a closure, with all its parameters bound."
+    extended_env = value.env.extended()
+    for var, arg in zip(value.vars, args):
+        extended_env.define(var, arg)
+    return value.body.code(extended_env)
+
+def _apply_primitive(value, varg):
+    descriptor = PRIMITIVES[value.name]
+    vargs = value.args + [varg]
+    if len(vargs) < descriptor.arity:
+        return (values.Primitive(value.name, vargs),)
+    return descriptor.function(*vargs)
+
+def _apply_unknown(value, varg):
+    not_implemented('Application', value)
+
+_APPLY = kind_table({
+    values.Thunk: _apply_thunk,
+    values.RigidStructure: _apply_rigid,
+    values.FlexStructure: _apply_flex,
+    values.Closure: _apply_closure,
+    values.MultiClosure: _apply_multi_closure,
+    values.Primitive: _apply_primitive,
+}, _apply_unknown)
+
+#### Strong evaluation
+
+def strong_eval_value(value):
+    return _STRONG_EVAL_VALUE[value.kind](value)
+
+def _strong_eval_thunk(value):
+    for v in value.expr.code(value.env):
+        yield from strong_eval_value(v)
+
+def _strong_eval_integer(value):
+    return (hashcons(value) if HASH_CONSING else value,)
+
+def _strong_eval_primitive(value):
+    for vargs in strong_eval_values(value.args):
+        yield values.Primitive(value.name, vargs)
+
+def _strong_eval_rigid(value):
+    if value.stable:
+        yield hashcons(value) if HASH_CONSING else value
+        return
+    for vargs in strong_eval_values(value.args):
+        if HASH_CONSING:
+            yield hashcons_structure(value.constructor, vargs)
+        else:
+            yield values.RigidStructure(value.constructor, vargs)
+
+def _strong_eval_flex(value):
+    for vargs in strong_eval_values(value.args):
+        if value.is_decided():
+            yield values.FlexStructure(value.symbol, vargs)
+        else:
+            for v in apply_many(value.symbol.representative(), vargs):
+                yield from strong_eval_value(v)
+
+def _strong_eval_unknown(value):
+    not_implemented('Strong evaluation', value)
+
+_STRONG_EVAL_VALUE = kind_table({
+    values.Thunk: _strong_eval_thunk,
+    values.IntegerConstant: _strong_eval_integer,
+    values.Closure: _eval_decided,
+    values.MultiClosure: _eval_decided,
+    values.Primitive: _strong_eval_primitive,
+    values.RigidStructure: _strong_eval_rigid,
+    values.FlexStructure: _strong_eval_flex,
+}, _strong_eval_unknown)
+
+def strong_eval_values(vals):
+    if len(vals) == 0:
+        yield []
+        return
+    for v0 in strong_eval_value(vals[0]):
+        instantiations = values.Metavar.instantiations
+        for vs in strong_eval_values(vals[1:]):
+            # The values vs are strongly decided, but evaluating them may
+            # have instantiated metavariables of v0. Only then v0 has to
+            # be checked, and evaluated again if it lost its decidedness.
+            result = [v0] + vs
+            if values.Metavar.instantiations == instantiations or \
+               v0.is_strongly_decided():
+                yield result
+            else:
+                yield from strong_eval_values(result)
+
+#### Primitives
+
+def primitive_sequence(val1, val2):
+    for _ in eval_value(val1):
+        yield from eval_value(val2)
+
+def primitive_alternative(val1, val2):
+    if SEARCH is not None:
+        yield from SEARCH.choose([lambda env: eval_value(val1),
+                                  lambda env: eval_value(val2)], None)
+        return
+    yield from eval_value(val1)
+    yield from eval_value(val2)
+
+def primitive_unify(val1, val2):
+    return unify([(val1, val2)])
+
+def primitive_disequality(val1, val2):
+    return disequality.disequality(val1, val2, strong_eval_value)
+
+def primitive_extension(actual, expected, value, default):
+    return higher_order.extension(actual, expected, value, default,
+                                  eval_value, strong_eval_value, unify)
+
+def primitive_arithmetic(name):
+    def function(val1, val2):
+        return arithmetic.apply_primitive(name, val1, val2, eval_value, unify)
+    return function
+
+def residual_answer(value):
+    "Used by the generated modules (see arithmetic.residual_answer)."
+    return arithmetic.residual_answer(value)
+
+def primitive_constraint(name):
+    def function(*vargs):
+        return STORE.primitive(name, vargs)
+    return function
+
+PRIMITIVES = primitive_functions()
+
+#### Hash-consing
+
+# If True, ground rigid structures and integer constants are shared: the
+# constructor constants of the program and the results of strong
+# evaluation are a single object for equal ground values, so unifying
+# them reduces to an identity check. The table holds weak references to
+# the shared values, so it does not keep them alive. A structure is keyed
+# by its constructor and the identities of its arguments, and it is only
+# added to the table once its arguments are shared.
+HASH_CONSING = False
+
+_HASH_CONS = weakref.WeakValueDictionary()
+
+def hashcons(value):
+    "Returns the shared copy of a ground value, or the value itself."
+    cls = type(value)
+    if cls is values.IntegerConstant:
+        key = value.value
+    elif cls is values.RigidStructure and \
+         (value.stable or value.is_strongly_decided() and value.stable):
+        key = (value.tag,) + tuple([id(arg) for arg in value.args])
+    else:
+        return value
+    shared = _HASH_CONS.get(key)
+    if shared is not None:
+        return shared
+    if cls is values.RigidStructure:
+        vargs = [hashcons(arg) for arg in value.args]
+        if any([varg is not arg for varg, arg in zip(vargs, value.args)]):
+            return hashcons_structure(value.constructor, vargs)
+    _HASH_CONS[key] = value
+    return value
+
+def hashcons_structure(constructor, vargs):
+    "Builds a rigid structure, shared if it is ground."
+    vargs = [hashcons(varg) for varg in vargs]
+    value = values.RigidStructure(constructor, vargs)
+    value.stable = all([varg.stable for varg in vargs])
+    return hashcons(value)
+
+#### Unification
+
+# Unification works on a stack of pending goals, represented by nested
+# pairs (goal, rest), so that the branches of a choice point share it
+# without copying it. The goals are solved in a loop. Only evaluating an
+# undecided value, resuming the goals suspended on a metavariable and
+# higher-order unification may have many solutions, and only they start
+# a new generator for the rest of the stack. The metavariables
+# instantiated by the loop are recorded in a trail, and uninstantiated
+# in reverse order when backtracking.
+
+# If True, a metavariable is not instantiated with a value where it
+# occurs, which would make the value infinite. Only the decided parts of
+# the value are inspected.
+OCCURS_CHECK = False
+
+def unify(goals):
+    stack = None
+    for goal in reversed(goals):
+        stack = (goal, stack)
+    return unify_stack(stack)
+
+def unify_stack(stack):
+    trail = []
+    while stack is not None:
+        (val1, val2), stack = stack
+        val1 = dereference(val1)
+        val2 = dereference(val2)
+        if val1 is val2 and val1.stable:
+            # In particular, equal hash-consed values.
+            continue
+
+        if not val1.is_decided():
+            for v1 in eval_value(val1):
+                yield from unify_stack(((v1, val2), stack))
+            break
+        elif not val2.is_decided():
+            for v2 in eval_value(val2):
+                yield from unify_stack(((val1, v2), stack))
+            break
+
+        cls1 = type(val1)
+        cls2 = type(val2)
+        if cls1 is values.IntegerConstant and cls2 is values.IntegerConstant:
+            if val1.value != val2.value:
+                break
+        elif cls1 is values.RigidStructure and cls2 is values.RigidStructure:
+            if val1.tag is not val2.tag or \
+               len(val1.args) != len(val2.args):
+                break
+            for arg1, arg2 in zip(reversed(val1.args), reversed(val2.args)):
+                stack = ((arg1, arg2), stack)
+        elif cls1 is values.FlexStructure and len(val1.args) == 0:
+            if cls2 is values.FlexStructure and val2.symbol is val1.symbol \
+               and len(val2.args) == 0:
+                continue
+            if OCCURS_CHECK and occurs(val1.symbol, val2):
+                break
+            val1.symbol.instantiate(val2)
+            trail.append(val1.symbol)
+            if val1.symbol.has_suspended_goals():
+                for _ in val1.symbol.resume_goals():
+                    yield from unify_stack(stack)
+                break
+        elif cls1 is values.FlexStructure:
+            yield from unify_flex_application(val1, val2, stack)
+            break
+        elif cls2 is values.FlexStructure:
+            stack = ((val2, val1), stack)
+        else:
+            break
+    else:
+        yield values.unit()
+    for symbol in reversed(trail):
+        symbol.uninstantiate()
+
+def dereference(value):
+    "Follows the instantiated metavariables that are not applied."
+    while type(value) is values.FlexStructure and len(value.args) == 0 \
+          and value.symbol.is_instantiated():
+        value = value.symbol.representative()
+    return value
+
+def occurs(symbol, value):
+    "Returns True if the metavariable occurs in the decided parts of value."
+    pending = [value]
+    while len(pending) > 0:
+        value = pending.pop()
+        cls = type(value)
+        if cls is values.FlexStructure:
+            if value.symbol is symbol:
+                return True
+            elif value.symbol.is_instantiated():
+                pending.append(value.symbol.representative())
+            pending.extend(value.args)
+        elif cls is values.RigidStructure:
+            pending.extend(value.args)
+    return False
+
+def unify_flex_application(val1, val2, stack):
+    # See higher_order.py.
+    vargs = higher_order.ground_arguments(val1.args, pure_value)
+    if vargs is None:
+        yield from instantiate_flex(val1.symbol, imitation(val1.args, val2),
+                                    stack)
+        return
+    if type(val2) is values.FlexStructure and val2.symbol is val1.symbol:
+        # Same head: x a1 ... an == x b1 ... bn
+        vargs2 = higher_order.ground_arguments(val2.args, pure_value)
+        if vargs2 is not None and higher_order.same_pattern(vargs, vargs2):
+            yield from unify_stack(stack)
+            return
+    yield from instantiate_flex(val1.symbol, extension(vargs, val2), stack)
+
+def instantiate_flex(symbol, function, stack):
+    # The function is a thunk, so there is nothing to check for occurrences
+    # of the symbol.
+    symbol.instantiate(function)
+    for _ in symbol.resume_goals():
+        yield from unify_stack(stack)
+    symbol.uninstantiate()
+
+def imitation(vargs, value):
+    """Returns a thunk for the function:
+         λ x1 ... xn . (x1 == a1 >> ... >> xn == an >> value)
+                       <> F x1 ... xn
+       where a1 ... an are the given arguments and F is fresh."""
+    new_var = fresh_name()
+    params = [fresh_name() for varg in vargs]
+    body = alternative(
+             sequence_many1(
+               [unification(variable(param), suspended_value(varg))
+                 for param, varg in zip(params, vargs)],
+               suspended_value(value)
+             ),
+             application(variable(new_var),
+                         [variable(param) for param in params])
+           )
+    env = environment.PersistentEnvironment()
+    env.define(new_var,
+               values.FlexStructure(values.Metavar(prefix='F'), []))
+    return values.Thunk(lambda_many(params, body), env)
+
+def extension(vargs, value):
+    """Returns a thunk for the function:
+         λ x1 ... xn . extension (x1, ..., xn) (a1, ..., an) value
+                                 (F x1 ... xn)
+       where a1 ... an are the given arguments, which are ground, and F
+       is fresh."""
+    new_var = fresh_name()
+    params = [fresh_name() for varg in vargs]
+    body = application(
+             primitive(common.OP_EXTENSION),
+             [constructor_application(common.VALUE_UNIT,
+                                      [variable(param) for param in params]),
+              constant(higher_order.tuple_value(vargs)),
+              suspended_value(value),
+              application(variable(new_var),
+                          [variable(param) for param in params])])
+    env = environment.PersistentEnvironment()
+    env.define(new_var,
+               values.FlexStructure(values.Metavar(prefix='F'), []))
+    return values.Thunk(lambda_many(params, body), env)
+
+def fresh_name(prefix='x'):
+    return '{prefix}{index}.'.format(prefix=prefix,
+                                     index=common.fresh_index())
+
+def search_alternatives(alternatives):
+    """Runs each alternative, a function returning an iterator, as a
+       choice point of the search if there is one."""
+    if SEARCH is not None:
+        return SEARCH.choose([lambda env, alternative=alternative:
+                                alternative()
+                              for alternative in alternatives], None)
+    return fd.run_alternatives(alternatives)
+
+# The finite domain constraints of the program.
+STORE = fd.Store(eval_value, strong_eval_value, unify,
+                 choose=search_alternatives)
+
+# The data types of the running program (see datatypes.py).
+DATATYPES = {}
+
+def declare_datatypes(program_datatypes):
+    DATATYPES.clear()
+    DATATYPES.update(program_datatypes)
+
+#### Tail calls
+#
+# Code whose last step is to run some other code can return it as a tail
+# call instead of running it inside its own generator. Such code returns
+# a Tail, an iterable over the values of a generator that ends by
+# returning the iterable of the values that remain. Iterating the Tail
+# runs the generator and then the returned iterable in the same loop,
+# unwrapping any Tail it returns in turn, so that a chain of tail calls
+# does not nest generators.
+#
+# A generator may only return a tail call once nothing else can follow
+# it, that is, when no choice points remain: the code it has run so far
+# returned a tuple, whose values are all known.
+#
+# Otherwise it may return a Then, whose first iterable is run in the same
+# loop before its second one, a generator that continues the search.
+# Such a step keeps its generator, which undoes its choices when
+# resumed, but it does not nest generators either.
+
+class Tail:
+    "The values of a generator that may end with a tail call."
+
+    __slots__ = ('generator',)
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def __iter__(self):
+        return _run_tail(self.generator)
+
+class Then:
+    "The values of an iterable followed by those of a generator."
+
+    __slots__ = ('first', 'rest')
+
+    def __init__(self, first, rest):
+        self.first = first
+        self.rest = rest
+
+def _run_tail(iterable):
+    rests = []
+    while True:
+        while iterable is not None:
+            if type(iterable) is Tail:
+                iterable = iterable.generator
+            elif type(iterable) is Then:
+                rests.append(iterable.rest)
+                iterable = iterable.first
+            else:
+                iterable = yield from iterable
+        if len(rests) == 0:
+            return
+        iterable = rests.pop()
+
+def tail(body):
+    """Code for a call in tail position (see tail_calls.py). The call is
+       not run right away but returned as a tail call, so that a loop
+       runs in the frame of its first iteration."""
+    body_code = body.code
+    def code(env):
+        return Tail(_tail_call(body_code, env))
+    return Code(code, body.source)
+
+def _tail_call(code, env):
+    return code(env)
+    yield
+
+#### Combinators
+
+def constant(value, source=None):
+    if source is None:
+        source = value
+    def code(env):
+        return (value,)
+    return Code(code, source, value=value)
+
+def suspended_value(value):
+    def code(env):
+        return eval_value(value)
+    return Code(code, value)
+
+def variable_values(env, name):
+    value0 = env.value(name)
+    if value0.is_decided():
+        return (value0,)
+    value = dereference(value0)
+    if value.is_decided():
+        return (value,)
+    return _force_variable(env, name, value0)
+
+def _force_variable(env, name, value0):
+    # Bind the variable to its value while it is being used,
+    # so that every occurrence of the variable shares it.
+    for value in eval_value(value0):
+        env.set(name, value)
+        yield value
+        env.set(name, value0)
+
+def unbound_name(name):
+    raise Exception(
+            'Name {name} is not a variable nor a constructor.'.format(
+              name=name
+            )
+          )
+
+def variable(name):
+    def code(env):
+        return variable_values(env, name)
+    return Code(code, name, variable=name)
+
+def constructor(name):
+    value = values.RigidStructure(name, [])
+    if HASH_CONSING:
+        value = hashcons(value)
+    return constant(value, source=name)
+
+def primitive(name):
+    def code(env):
+        return (values.Primitive(name, []),)
+    return Code(code, name)
+
+def unbound(name):
+    def code(env):
+        unbound_name(name)
+    return Code(code, name)
+
+def lambda_(var, body, source=None):
+    if source is None:
+        source = 'λ {var} . {body}'.format(var=var, body=body.show())
+    return LambdaCode([var], body, source)
+
+def lambda_many(vars, body, source=None):
+    "A lambda of several parameters, which binds them in a single frame."
+    if len(vars) == 0:
+        return body
+    if source is None:
+        source = 'λ {vars} . {body}'.format(vars=' '.join(vars),
+                                            body=body.show())
+    return LambdaCode(vars, body, source)
+
+def suspend(arg, env):
+    if arg.value is not None:
+        return arg.value
+    elif arg.variable is not None:
+        # A variable that is bound to a value is passed as it is. Only
+        # a variable bound to a thunk has to be suspended, so that its
+        # value is shared (see variable_values).
+        value = env.value(arg.variable)
+        if type(value) is not values.Thunk:
+            return value
+    return values.Thunk(arg, env)
+
+def application(fun, args, source=None):
+    if source is None:
+        source = ' '.join([fun.show()] + [arg.show() for arg in args])
+    fun_code = fun.code
+    def code(env):
+        funs = fun_code(env)
+        if type(funs) is tuple and len(funs) == 1:
+            # The function has a single value, so the application is
+            # the application of that value.
+            return apply_many(funs[0], [suspend(arg, env) for arg in args])
+        return _apply_each(funs, args, env)
+    return Code(code, source)
+
+def _apply_each(funs, args, env):
+    for value in funs:
+        yield from apply_many(value, [suspend(arg, env) for arg in args])
+
+def call(name, args, source=None):
+    """Application of a variable bound to a deterministic definition.
+       If the variable is already bound to a closure, it is applied
+       directly, without a choice point for the head."""
+    if source is None:
+        source = ' '.join([name] + [arg.show() for arg in args])
+    def code(env):
+        value0 = env.value(name)
+        vargs = [suspend(arg, env) for arg in args]
+        if value0.is_decided():
+            return apply_many(value0, vargs)
+        return _call_forced(env, name, value0, vargs)
+    return Code(code, source)
+
+def _call_forced(env, name, value0, vargs):
+    for value in _force_variable(env, name, value0):
+        yield from apply_many(value, vargs)
+
+def constructor_application(name, args, source=None):
+    if source is None:
+        source = ' '.join([name] + [arg.show() for arg in args])
+    def code(env):
+        return (values.RigidStructure(name,
+                                      [suspend(arg, env) for arg in args]),)
+    return Code(code, source, pure=True)
+
+def sequence(arg1, arg2, source=None, closed=False):
+    """Code for (arg1 >> arg2). If `closed` is true, arg1 is closed (see
+       closedness.py), so it may be evaluated in parallel."""
+    if source is None:
+        source = '{e1} >> {e2}'.format(e1=arg1.show(), e2=arg2.show())
+    code1 = arg1.code
+    code2 = arg2.code
+    def code(env):
+        if closed and CONJUNCTIONS is not None:
+            return CONJUNCTIONS.sequence(suspend(arg1, env),
+                                         lambda: code2(env))
+        return Tail(_sequence(code1, code2, env))
+    return Code(code, source)
+
+def _sequence(code1, code2, env):
+    results = code1(env)
+    if type(results) is not tuple:
+        for _ in results:
+            yield from code2(env)
+        return None
+    elif len(results) == 0:
+        return None
+    # All the solutions of code1 are known, so code2 is a tail call for
+    # the last one.
+    for _ in results[:-1]:
+        yield from code2(env)
+    return code2(env)
+
+def cached_sequence(arg1, arg2, source=None, closed=False):
+    """Like `sequence`, for a closed arg2 (see closedness.py), which has
+       the same solutions for every solution of arg1. The solutions of
+       arg2 are computed once and then reused (see ReusedSolutions).
+       If arg1 is closed too, the conjuncts are independent, and their
+       solutions are joined: in parallel mode, arg1 is evaluated in
+       parallel with arg2."""
+    if source is None:
+        source = '{e1} >> {e2}'.format(e1=arg1.show(), e2=arg2.show())
+    code1 = arg1.code
+    code2 = arg2.code
+    uncached_code = sequence(arg1, arg2, source=source).code
+    def code(env):
+        if SEARCH is not None:
+            # The choice points of arg2 must be run every time.
+            yield from uncached_code(env)
+            return
+        solutions = ReusedSolutions(code2, env)
+        if closed and CONJUNCTIONS is not None:
+            yield from CONJUNCTIONS.sequence(suspend(arg1, env), solutions)
+            return
+        for _ in code1(env):
+            yield from solutions()
+            if solutions.always_fail():
+                # arg2 fails for every solution of arg1.
+                return
+    return Code(code, source)
+
+class ReusedSolutions:
+    """The solutions of closed code, computed the first time they are
+       needed and then reused, provided that they are ground data, which
+       cannot change when backtracking."""
+
+    def __init__(self, code, env):
+        self._code = code
+        self._env = env
+        # None if the solutions are not known yet,
+        # False if they cannot be reused.
+        self._solutions = None
+
+    def __call__(self):
+        if self._solutions is False:
+            yield from self._code(self._env)
+            return
+        elif self._solutions is not None:
+            yield from self._solutions
+            return
+        solutions = []
+        for value in self._code(self._env):
+            if solutions is not False:
+                if is_ground_data(value):
+                    solutions.append(value)
+                else:
+                    solutions = False
+            yield value
+        self._solutions = solutions
+
+    def always_fail(self):
+        "Returns True if the code is known to have no solutions."
+        return self._solutions == []
+
+def is_ground_data(value):
+    "Returns True if the value is made only of constructors and integers."
+    cls = type(value)
+    if cls is values.IntegerConstant:
+        return True
+    elif cls is values.RigidStructure:
+        return all([is_ground_data(arg) for arg in value.args])
+    return False
+
+def sequence_many1(args, body):
+    for arg in reversed(args):
+        body = sequence(arg, body)
+    return body
+
+def alternative(arg1, arg2, source=None):
+    if source is None:
+        source = '{e1} <> {e2}'.format(e1=arg1.show(), e2=arg2.show())
+    code1 = arg1.code
+    code2 = arg2.code
+    def code(env):
+        if SEARCH is not None:
+            return SEARCH.choose([code1, code2], env)
+        return Tail(_alternative(code1, code2, env))
+    return Code(code, source)
+
+def _alternative(code1, code2, env):
+    yield from code1(env)
+    return code2(env)
+
+def unification(arg1, arg2, source=None):
+    if source is None:
+        source = '{e1} == {e2}'.format(e1=arg1.show(), e2=arg2.show())
+    def code(env):
+        return unify([(suspend(arg1, env), suspend(arg2, env))])
+    return Code(code, source)
+
+def let(definitions, body, source=None):
+    if source is None:
+        source = body
+    body_code = body.code
+    def code(env):
+        extended_env = env.extended()
+        for name, rhs in definitions:
+            if isinstance(rhs, LambdaCode):
+                # Closures are already values, so they need not be
+                # suspended.
+                extended_env.define(name, rhs.closure(extended_env))
+            else:
+                extended_env.define(name, values.Thunk(rhs, extended_env))
+        return body_code(extended_env)
+    return Code(code, source)
+
+def fresh(var, body, source=None, type=None):
+    if source is None:
+        source = '? {var} . {body}'.format(var=var, body=body.show())
+    body_code = body.code
+    def code(env):
+        extended_env = env.extended()
+        extended_env.define(var,
+                            values.FlexStructure(values.Metavar(prefix=var,
+                                                                type=type),
+                                                 []))
+        return body_code(extended_env)
+    return Code(code, source)
+
+def index(var, table, default, alternatives, source=None,
+          residuating=False, enumerable=False):
+    if source is None:
+        source = 'index {var} . {body}'.format(
+                   var=var,
+                   body=' <> '.join([alt.show() for alt in alternatives]))
+    table = dict([(key, [alternative.code for alternative in branch])
+                  for key, branch in table.items()])
+    default = [alternative.code for alternative in default]
+    alternatives = [alternative.code for alternative in alternatives]
+    def code(env):
+        return Tail(run(env))
+    def run(env):
+        values0 = variable_values(env, var)
+        for value in values0:
+            symbol = residuation.waiting_symbol(value) \
+                       if residuating else None
+            if symbol is not None:
+                yield from residuation.residuate(symbol, lambda: code(env),
+                                                 unify)
+                continue
+            key = value.index_key()
+            arg_types = datatypes.constructors(value, table.keys(), DATATYPES) \
+                          if enumerable and key is None and SEARCH is None \
+                          else None
+            if arg_types is not None:
+                for key in datatypes.instantiations(value, table.keys(),
+                                                    arg_types, unify):
+                    for alternative in table[key]:
+                        yield from alternative(env)
+                continue
+            candidates = alternatives if key is None \
+                                      else table.get(key, default)
+            if SEARCH is not None and len(candidates) > 1:
+                yield from SEARCH.choose(candidates, env)
+                continue
+            if type(values0) is tuple and len(values0) == 1 and \
+               len(candidates) > 0:
+                # The last alternative is a tail call.
+                for alternative in candidates[:-1]:
+                    yield from alternative(env)
+                return candidates[-1](env)
+            for alternative in candidates:
+                yield from alternative(env)
+    return Code(code, source)
+
+def deterministic_index(var, table, default, alternatives, source=None,
+                        residuating=False, enumerable=False):
+    """Like `index`, for a node that selects at most one alternative for
+       each key. Each branch of the table and the default branch hold a
+       single alternative (or None). If the variable is already bound to
+       a rigid value, the alternative is run without a choice point."""
+    generic = index(var,
+                    dict([(key, [] if alternative is None else [alternative])
+                          for key, alternative in table.items()]),
+                    [] if default is None else [default],
+                    alternatives,
+                    source=source,
+                    residuating=residuating,
+                    enumerable=enumerable)
+    generic_code = generic.code
+    table = dict([(key, None if alternative is None else alternative.code)
+                  for key, alternative in table.items()])
+    default = None if default is None else default.code
+    def code(env):
+        value = dereference(env.value(var))
+        if value.is_decided():
+            key = value.index_key()
+            if key is not None:
+                alternative = table.get(key, default)
+                if alternative is None:
+                    return ()
+                return alternative(env)
+        return generic_code(env)
+    return Code(code, generic.source)
+
+#### Matching
+
+class Fallback(Exception):
+    "Raised when a pattern cannot be matched without evaluating."
+
+def rule(goals, body, source=None):
+    """Code for an alternative of the form
+         fresh x1 ... xn . (y1 == p1) >> ... >> (yk == pk) >> body
+       given the goals [(y1, p1), ..., (yk, pk)] as described by
+       determinism.rule_patterns. The patterns are matched against the
+       values of the y_i, binding the x_i, and the body is evaluated.
+       If a pattern reaches a value that is not evaluated yet, or a
+       metavariable that has to be instantiated, matching proceeds as
+       unification would."""
+    if source is None:
+        source = 'match {goals} . {body}'.format(goals=goals, body=body.show())
+    matchers = [(var, matcher(pattern)) for var, pattern in goals]
+    body_code = body.code
+    def code(env):
+        bindings = []
+        try:
+            for var, match in matchers:
+                if not match(env.value(var), bindings):
+                    return ()
+        except Fallback:
+            pending = [(pattern, env.value(var), var)
+                         for var, pattern in goals]
+            return Tail(_rule_eval(env, _match_eval(env, pending, []),
+                                   body_code))
+        extended_env = env.extended()
+        for name, value in bindings:
+            extended_env.define(name, value)
+        return body_code(extended_env)
+    return Code(code, source)
+
+def _rule_eval(env, matches, body_code):
+    # The body is run for each way of matching, in the loop of the
+    # enclosing Tail, so that a recursion over values that have to be
+    # evaluated to be matched does not nest generators.
+    for bindings in matches:
+        extended_env = env.extended()
+        for name, value in bindings:
+            extended_env.define(name, value)
+        return Then(body_code(extended_env),
+                    _rule_eval(env, matches, body_code))
+    return None
+    yield
+
+def _match_eval(env, pending, bindings):
+    # Each element of `pending` is a (pattern, value, var) triple, where
+    # var is the name of the variable holding the value, if any.
+    while len(pending) > 0:
+        (pattern, value, var) = pending[0]
+        pending = pending[1:]
+        if not value.is_decided():
+            if var is None:
+                values0 = eval_value(value)
+            else:
+                values0 = _force_variable(env, var, value)
+            for v in values0:
+                yield from _match_eval(env, [(pattern, v, None)] + pending,
+                                       bindings)
+            return
+        kind = pattern[0]
+        if kind == 'any':
+            continue
+        elif kind == 'var':
+            bindings = bindings + [(pattern[1], value)]
+            continue
+        elif type(value) is values.FlexStructure:
+            # Narrowing: unify the value with the pattern.
+            pattern_bindings = []
+            term = pattern_term(pattern, pattern_bindings)
+            for _ in unify([(value, term)]):
+                yield from _match_eval(env, pending,
+                                       bindings + pattern_bindings)
+            return
+        elif kind == 'int':
+            if type(value) is not values.IntegerConstant or \
+               value.value != pattern[1]:
+                return
+        else:
+            if type(value) is not values.RigidStructure or \
+               value.constructor != pattern[1] or \
+               len(value.args) != len(pattern[2]):
+                return
+            pending = [(subpattern, arg, None)
+                         for subpattern, arg in zip(pattern[2], value.args)
+                      ] + pending
+    yield bindings
+
+def pattern_matches(value, matcher, pattern):
+    """Returns the tuples of the values of the variables of a pattern
+       (see determinism.rule_patterns) for each way of matching it against
+       a decided value, with the variables from left to right. `matcher`
+       is the function generated for the pattern (see codegen.py). It
+       returns such a tuple, or None if the pattern does not match, and
+       raises Fallback if the value has to be evaluated first."""
+    try:
+        match = matcher(value)
+    except Fallback:
+        return _pattern_matches_eval(value, pattern)
+    if match is None:
+        return ()
+    return (match,)
+
+def _pattern_matches_eval(value, pattern):
+    for bindings in _match_eval(None, [(pattern, value, None)], []):
+        yield tuple([value for _, value in bindings])
+
+def pattern_term(pattern, bindings):
+    """Returns a value for the pattern, with fresh metavariables for its
+       variables, adding their bindings to the list."""
+    if pattern[0] == 'any':
+        return values.FlexStructure(values.Metavar(), [])
+    elif pattern[0] == 'var':
+        value = values.FlexStructure(values.Metavar(prefix=pattern[1]), [])
+        bindings.append((pattern[1], value))
+        return value
+    elif pattern[0] == 'int':
+        return values.IntegerConstant(pattern[1])
+    else:
+        return values.RigidStructure(pattern[1],
+                                     [pattern_term(arg, bindings)
+                                        for arg in pattern[2]])
+
+def matcher(pattern):
+    """Returns a function that matches a value against the pattern,
+       adding the bindings of the pattern variables to a list. It raises
+       Fallback if the value has to be evaluated first."""
+    if pattern[0] == 'any':
+        def match(value, bindings):
+            match_value(value)
+            return True
+    elif pattern[0] == 'var':
+        name = pattern[1]
+        def match(value, bindings):
+            bindings.append((name, match_value(value)))
+            return True
+    elif pattern[0] == 'int':
+        n = pattern[1]
+        def match(value, bindings):
+            value = match_value(value)
+            if type(value) is values.FlexStructure:
+                raise Fallback()
+            return type(value) is values.IntegerConstant and value.value == n
+    elif pattern[0] == 'con':
+        tag = values.constructor_tag(pattern[1])
+        matchers = [matcher(arg) for arg in pattern[2]]
+        arity = len(matchers)
+        def match(value, bindings):
+            value = match_value(value)
+            if type(value) is values.FlexStructure:
+                raise Fallback()
+            if type(value) is not values.RigidStructure or \
+               value.tag is not tag or len(value.args) != arity:
+                return False
+            for match_arg, arg in zip(matchers, value.args):
+                if not match_arg(arg, bindings):
+                    return False
+            return True
+    else:
+        raise Exception('Invalid pattern {pattern}.'.format(pattern=pattern))
+    return match
+
+def match_value(value):
+    """Returns the decided value to match a pattern against, or raises
+       Fallback if the value has to be evaluated first."""
+    value = pure_value(value)
+    if not value.is_decided():
+        raise Fallback()
+    return value
+
+def pure_value(value):
+    """Returns the value of a thunk of pure code, which can be evaluated
+       right away, or of a thunk of a variable bound to such a value. Any
+       other value is returned as it is."""
+    # Anything else may have more than one value, or instantiate
+    # metavariables.
+    value = dereference(value)
+    while type(value) is values.Thunk and value.expr.variable is not None:
+        value = dereference(value.env.value(value.expr.variable))
+    if type(value) is values.Thunk and value.expr.pure:
+        for v in value.expr.code(value.env):
+            value = v
+    return value
+
+#### Tabling
+#
+# The answers of a call to a tabled definition are stored in a table,
+# keyed by the strong values of its arguments up to renaming of their
+# metavariables (a variant of the call). Each answer records the strong
+# values of the arguments and of the result, so that a call with the
+# same key can reuse it by unifying its arguments with the recorded ones.
+#
+# A variant call made while its table is still being computed, as in
+# (f () = f ()), consumes the answers found so far instead of running the
+# definition again. The call that created the table then runs the
+# definition again until no new answers are found, and marks the table
+# as complete. A table whose answers were computed using the answers of
+# an older incomplete table is discarded instead. A call whose table is
+# suspended, because its leader has yielded an answer, completes the
+# answers in a new table that replaces it.
+
+# Maximum number of answers kept in complete tables. Beyond it, the
+# least recently used tables are discarded.
+MAX_TABLED_ANSWERS = 100000
+
+class NotTablable(Exception):
+    "Raised when a value cannot be part of a table key."
+
+class Table:
+    "The answers of a tabled call."
+
+    ACTIVE = 'active'         # The call is running.
+    SUSPENDED = 'suspended'   # The call has yielded an answer.
+    COMPLETE = 'complete'     # All the answers are known.
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.state = Table.ACTIVE
+        # List of (number of metavariables, terms, same arguments)
+        # triples. See `canonical_terms`.
+        self.answers = []
+        self._known = set()
+        # True if a variant call consumed its answers while incomplete.
+        self.consumed = False
+        # True if it consumed the answers of an older incomplete table.
+        self.dependent = False
+
+    def add(self, nvars, terms):
+        if terms in self._known:
+            return False
+        self._known.add(terms)
+        self.answers.append((nvars, terms, terms[:-1] == self.key))
+        return True
+
+class Tables:
+    "Keeps track of the running and the complete tables."
+
+    def __init__(self):
+        self._active = []
+        self._complete = collections.OrderedDict()
+        self._size = 0
+
+    def activate(self, table):
+        table.state = Table.ACTIVE
+        self._active.append(table)
+
+    def suspend(self, table):
+        table.state = Table.SUSPENDED
+        if table in self._active:
+            self._active.remove(table)
+
+    def consume(self, table):
+        table.consumed = True
+        for other in self._active[self._active.index(table) + 1:]:
+            other.dependent = True
+
+    def complete(self, table):
+        table.state = Table.COMPLETE
+        self._complete[table] = None
+        self._size += len(table.answers)
+        while self._size > MAX_TABLED_ANSWERS and len(self._complete) > 1:
+            evicted, _ = self._complete.popitem(last=False)
+            self._size -= len(evicted.answers)
+            discard_table(evicted)
+
+    def touch(self, table):
+        self._complete.move_to_end(table)
+
+TABLES = Tables()
+
+def discard_table(table):
+    if table.store.get(table.key) is table:
+        del table.store[table.key]
+
+def tabled(params, body, source=None):
+    """Code for the body of a tabled definition (λ params . body).
+       The definition must be closed (see closedness.py), so that its
+       answers depend only on its arguments."""
+    if source is None:
+        source = body.source
+    body_code = body.code
+    # The tables of each instance of the definition, indexed by the
+    # environment where it is defined.
+    stores = weakref.WeakKeyDictionary()
+    def code(env):
+        if SEARCH is not None:
+            # A worker only explores part of the choice points, so it
+            # cannot tell when a table is complete.
+            yield from body_code(env)
+            return
+        # The parameters are bound in a single frame (see lambda_many).
+        definition_env = env.parent() if len(params) > 0 else env
+        store = stores.get(definition_env)
+        if store is None:
+            store = stores[definition_env] = {}
+        vargs0 = [env.value(param) for param in params]
+        for vargs in strong_eval_values(vargs0):
+            for param, varg in zip(params, vargs):
+                env.set(param, varg)
+            yield from _tabled_call(store, vargs, lambda: body_code(env))
+            for param, varg0 in zip(params, vargs0):
+                env.set(param, varg0)
+    return Code(code, source)
+
+def _tabled_call(store, vargs, run):
+    metavars = {}
+    try:
+        key = tuple([canonical_term(varg, metavars) for varg in vargs])
+    except NotTablable:
+        yield from run()
+        return
+    table = store.get(key)
+    if table is None:
+        yield from _tabled_leader(store, key, vargs, run)
+    elif table.state == Table.COMPLETE:
+        TABLES.touch(table)
+        yield from _tabled_answers(table, vargs, list(metavars))
+    elif table.state == Table.ACTIVE:
+        TABLES.consume(table)
+        yield from _tabled_answers(table, vargs, list(metavars))
+    else:
+        # The leader of the table is waiting for its answer to be used,
+        # so the call is not recursive and cannot wait for the table to
+        # be complete. It completes the answers in a new table, which
+        # the recursive calls that it makes consume.
+        yield from _tabled_leader(store, key, vargs, run)
+
+def _tabled_leader(store, key, vargs, run):
+    table = Table(store, key)
+    store[key] = table
+    finished = False
+    try:
+        while True:
+            table.consumed = False
+            new_answers = False
+            TABLES.activate(table)
+            for value in run():
+                for answer in strong_eval_values(vargs + [value]):
+                    metavars = {}
+                    try:
+                        terms = tuple([canonical_term(v, metavars)
+                                         for v in answer])
+                    except NotTablable:
+                        raise Exception(
+                                ('Tabled definition has an answer ' +
+                                 'that is not data: {value}').format(
+                                   value=answer[-1].show()
+                                ))
+                    if table.add(len(metavars), terms):
+                        new_answers = True
+                        TABLES.suspend(table)
+                        yield answer[-1]
+                        TABLES.activate(table)
+            TABLES.suspend(table)
+            if not (new_answers and table.consumed):
+                break
+        finished = True
+    finally:
+        TABLES.suspend(table)
+        if finished and not table.dependent and store.get(key) is table:
+            TABLES.complete(table)
+        else:
+            discard_table(table)
+
+def _tabled_answers(table, vargs, call_metavars):
+    i = 0
+    # The list of answers may grow while it is being consumed.
+    while i < len(table.answers):
+        nvars, terms, same_args = table.answers[i]
+        i += 1
+        if same_args:
+            # The first metavariables of the answer are those of the call.
+            symbols = call_metavars + [values.Metavar(prefix='t')
+                                         for _ in range(nvars -
+                                                        len(call_metavars))]
+            yield term_value(terms[-1], symbols)
+            continue
+        symbols = [values.Metavar(prefix='t') for _ in range(nvars)]
+        answer = [term_value(term, symbols) for term in terms]
+        for _ in unify(list(zip(vargs, answer[:-1]))):
+            yield answer[-1]
+
+def canonical_term(value, metavars):
+    """Returns a hashable term for a strongly evaluated value, numbering
+       its metavariables in the order they are found, as recorded in the
+       dictionary `metavars`:
+         n                 for an integer n,
+         (c, (t1 ... tm))  for a constructor c applied to arguments,
+         (i, (t1 ... tm))  for the i-th metavariable applied to arguments.
+       Raises NotTablable if the value is not data."""
+    cls = type(value)
+    if cls is values.IntegerConstant:
+        return value.value
+    elif cls is values.RigidStructure:
+        return (value.constructor,
+                tuple([canonical_term(arg, metavars) for arg in value.args]))
+    elif cls is values.FlexStructure and value.is_decided():
+        if value.symbol not in metavars:
+            metavars[value.symbol] = len(metavars)
+        return (metavars[value.symbol],
+                tuple([canonical_term(arg, metavars) for arg in value.args]))
+    raise NotTablable()
+
+def term_value(term, symbols):
+    "Inverse of canonical_term, for the given list of metavariables."
+    if type(term) is int:
+        return values.IntegerConstant(term)
+    head, args = term
+    vargs = [term_value(arg, symbols) for arg in args]
+    if type(head) is str:
+        return values.RigidStructure(head, vargs)
+    return values.FlexStructure(symbols[head], vargs)
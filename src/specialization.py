@@ -0,0 +1,644 @@
+import common
+import determinism
+import syntax
+
+# Specialization.
+#
+# Offline partial evaluation of the typechecked program, run before the
+# other analyses of the compiled evaluators. It rewrites the program
+# with three transformations:
+#   - Inlining. A call to a small definition that is not recursive,
+#     such as car, cdr, or _∘_, is replaced by a copy of its body.
+#     The arguments that are variables in scope are substituted for the
+#     parameters, and the other ones are bound to the parameters by a
+#     let, so that they are still evaluated lazily and at most once.
+#     An inlined equation is marked as the `sole_alternative`, so that
+#     its patterns are still matched rather than unified (see
+#     evaluator_compiled.Evaluator.compile_alternative).
+#   - Specialization. A call g a1 ... an to a definition g, such that
+#     some ai is a variable bound to a definition of a function, is
+#     replaced by a call to a copy of g where the parameter is replaced
+#     by that function, e.g.:
+#         map colorVecino xs  ~~>  let map1. = λ ys . ... in map1. xs
+#     The copy is placed at the call site, where the function is in
+#     scope. The recursive calls of the copy that pass the same function
+#     call the copy itself.
+#   - Folding. The alternatives of an index on a variable whose value
+#     is known statically are selected at compile time, and a
+#     unification (v == pattern) of the first goal of an alternative is
+#     decided at compile time if the value of v is known statically.
+#     The variables of the pattern are replaced by the parts of the
+#     value, and an alternative whose pattern does not match the value
+#     is dropped.
+# Patterns are strict, so a unification that would be folded forces the
+# value of v. It is only folded if the value is known to be safe, that
+# is, if forcing it cannot fail, diverge, or have more than one result:
+# constants, functions, and constructors applied to safe values.
+#
+# All the nodes of the resulting program are new, so that the analyses
+# that mark the nodes do not see a subtree shared by two places.
+
+# Maximum number of nodes of the body of a definition to be inlined.
+MAX_INLINE_SIZE = 32
+
+def specialize_program(program, constructors):
+    "`constructors` is the set of names of the constructors of the program."
+    return syntax.Program(
+             data_declarations=program.data_declarations,
+             body=Specializer(constructors).transform(program.body, {}),
+             position=program.position
+           )
+
+class Binding:
+    "What is known statically about the value of a name in scope."
+
+    def __init__(self):
+        # The value of the name, if it is known and safe (see Static).
+        self.value = None
+        # For a definition of a function, the names of its parameters,
+        # its body, and the scope of its body.
+        self.params = None
+        self.body = None
+        self.scope = None
+        # The names free in the body, but for the parameters.
+        self.free = None
+        # True if the definition may call itself.
+        self.recursive = False
+        # True if the calls to the definition should not be rewritten,
+        # since it is tabled or residuating.
+        self.fixed = False
+
+    def is_function(self):
+        return self.params is not None
+
+class Static:
+    "A safe value known statically."
+
+    def __init__(self, expr, key=None, args=()):
+        # An expression denoting the value.
+        self.expr = expr
+        # The constructor or integer at its head, or None for a function.
+        self.key = key
+        self.args = args
+
+class Specializer:
+
+    def __init__(self, constructors):
+        self._constructors = constructors
+        # Maps the key of each specialization (see `specialization_key`)
+        # to the name of the copy and its binding.
+        self._copies = {}
+        # Bindings of the definitions being specialized.
+        self._specializing = set()
+
+    def transform(self, expr, scope, may_fail=False):
+        """Returns a copy of the expression, rewritten. `scope` maps each
+           name in scope to its Binding. If `may_fail` is True, the result
+           may be None if the expression statically has no solutions."""
+        if expr.is_integer_constant():
+            return syntax.IntegerConstant(value=expr.value,
+                                          position=expr.position)
+        elif expr.is_variable():
+            return syntax.Variable(name=expr.name, position=expr.position)
+        elif expr.is_lambda():
+            return syntax.Lambda(
+                     var=expr.var,
+                     body=self.transform(expr.body,
+                                         bind(scope, [expr.var])),
+                     position=expr.position
+                   )
+        elif expr.is_fresh():
+            return self.transform_rule(expr, scope, may_fail)
+        elif expr.is_application():
+            return self.transform_application(expr, scope, may_fail)
+        elif expr.is_let():
+            return self.transform_let(expr, scope, may_fail)
+        elif expr.is_index():
+            return self.transform_index(expr, scope, may_fail)
+        else:
+            raise Exception(
+                    'Specialization not implemented for {cls}.'.format(
+                      cls=type(expr)
+                    )
+                  )
+
+    def transform_application(self, expr, scope, may_fail):
+        head = expr.application_head()
+        args = expr.application_args()
+        if self.is_operator(head, common.OP_ALTERNATIVE, scope) \
+           and len(args) == 2:
+            return self.transform_alternative(expr, scope, may_fail)
+        elif self.is_operator(head, common.OP_SEQUENCE, scope) \
+             and len(args) == 2:
+            return self.transform_rule(expr, scope, may_fail)
+        args = [self.transform(arg, scope) for arg in args]
+        if head.is_variable() and head.name in scope \
+           and scope[head.name].is_function():
+            result = self.transform_call(head, args, scope)
+            if result is not None:
+                return result
+        return syntax.application_many(self.transform(head, scope), args,
+                                       position=expr.position)
+
+    def transform_alternative(self, expr, scope, may_fail):
+        [expr1, expr2] = expr.application_args()
+        result1 = self.transform(expr1, scope, True)
+        result2 = self.transform(expr2, scope, True)
+        if result1 is None and result2 is None:
+            return self.failure(expr, scope, may_fail)
+        elif result1 is None:
+            return result2
+        elif result2 is None:
+            return result1
+        return syntax.alternative(result1, result2, position=expr.position)
+
+    def transform_let(self, expr, scope, may_fail):
+        definitions = [decl for decl in expr.declarations
+                            if decl.is_definition()]
+        fixed = set([decl.name for decl in expr.declarations
+                               if decl.is_tabling_declaration() or
+                                  decl.is_residuation_declaration()])
+        names = set([decl.lhs.name for decl in definitions])
+        recursive = names & syntax.free_variables_list(
+                              [decl.rhs for decl in definitions])
+        inner = dict(scope)
+        for name in names:
+            inner[name] = Binding()
+        declarations = []
+        for decl in expr.declarations:
+            if not decl.is_definition():
+                declarations.append(decl)
+                continue
+            rhs = self.transform(decl.rhs, inner)
+            binding = inner[decl.lhs.name]
+            params, body = syntax.lambda_params(rhs)
+            binding.recursive = len(recursive) > 0
+            binding.fixed = decl.lhs.name in fixed
+            if len(params) > 0:
+                binding.params = params
+                binding.body = body
+                binding.scope = inner
+                binding.free = body.free_variables() - set(params)
+            elif not binding.recursive:
+                self.bind_value(binding, decl.lhs.name, rhs, inner)
+            declarations.append(
+              syntax.Definition(
+                lhs=syntax.Variable(name=decl.lhs.name,
+                                    position=decl.lhs.position),
+                rhs=rhs,
+                where=[],
+                position=decl.position
+              )
+            )
+        body = self.transform(expr.body, inner, may_fail)
+        if body is None:
+            return None
+        return syntax.Let(declarations=declarations, body=body,
+                          position=expr.position)
+
+    def bind_value(self, binding, name, rhs, scope):
+        "Records the value of a name let-bound to the expression, if known."
+        value = self.static_value(rhs, scope)
+        if value is not None:
+            binding.value = Static(syntax.Variable(name=name),
+                                   key=value.key, args=value.args)
+            binding.scope = scope
+
+    def transform_index(self, expr, scope, may_fail):
+        binding = scope.get(expr.var)
+        if binding is not None and binding.value is not None \
+           and binding.value.key is not None \
+           and common.OP_ALTERNATIVE not in scope:
+            # The alternatives are selected statically.
+            alternatives = []
+            for alternative in expr.candidates(binding.value.key):
+                alternative = self.transform(alternative, scope, True)
+                if alternative is not None:
+                    alternatives.append(alternative)
+            if len(alternatives) > 0:
+                return syntax.alternative_many(alternatives,
+                                               position=expr.position)
+            return self.failure(expr, scope, may_fail)
+        # The same alternative may occur in several branches.
+        transformed = {}
+        def transform_branch(branch):
+            result = []
+            for alternative in branch:
+                if id(alternative) not in transformed:
+                    transformed[id(alternative)] = \
+                      self.transform(alternative, scope, True)
+                if transformed[id(alternative)] is not None:
+                    result.append(transformed[id(alternative)])
+            return result
+        index = copy_index(expr, expr.var, transform_branch)
+        if len(index.alternatives) == 0:
+            return self.failure(expr, scope, may_fail)
+        return index
+
+    def failure(self, expr, scope, may_fail):
+        """Returns an expression with no solutions in place of the
+           expression, which statically has none, or None if `may_fail`."""
+        if may_fail:
+            return None
+        elif common.OP_UNIFY in scope:
+            return rename(expr, {})
+        return syntax.unify(
+                 syntax.IntegerConstant(value=0, position=expr.position),
+                 syntax.IntegerConstant(value=1, position=expr.position),
+                 position=expr.position)
+
+    def transform_rule(self, expr, scope, may_fail):
+        """Rewrites an alternative (? x1 ... xn . goals >> body), folding
+           its first goal if it is a unification decided statically."""
+        binders = []
+        body = expr
+        while body.is_fresh():
+            binders.append(body)
+            body = body.body
+        inner = bind(scope, [binder.var for binder in binders])
+        goals = []
+        while body.is_application() \
+              and self.is_operator(body.application_head(),
+                                   common.OP_SEQUENCE, inner) \
+              and len(body.application_args()) == 2:
+            goals.append(body.application_args()[0])
+            body = body.application_args()[1]
+        if len(goals) > 0 and self.is_unification(goals[0], inner):
+            [lhs, rhs] = goals[0].application_args()
+            folded = self.fold_unification(
+                       lhs, rhs, [binder.var for binder in binders], inner)
+            if folded is False:
+                if may_fail:
+                    return None
+            elif folded is not None:
+                return self.transform(
+                         self.folded_rule(binders, folded, goals[1:], body),
+                         scope, may_fail)
+        result = self.transform(body, inner, may_fail)
+        if result is None:
+            return None
+        for goal in reversed(goals):
+            result = syntax.sequence(self.transform(goal, inner), result,
+                                     position=expr.position)
+        for binder in reversed(binders):
+            result = copy_fresh(binder, binder.var, result)
+        return result
+
+    def folded_rule(self, binders, bindings, goals, body):
+        """Returns the alternative (? x1 ... xn . goals >> body) where the
+           fresh variables are bound as given by `bindings`, a list of
+           pairs (var, static value)."""
+        values = dict(bindings)
+        substitution = {}
+        definitions = []
+        for var, value in bindings:
+            if value.expr.is_variable() and \
+               value.expr.name not in self._constructors:
+                substitution[var] = value.expr.name
+            else:
+                substitution[var] = \
+                  syntax.fresh_variable(prefix=prefix(var)).name
+                definitions.append(
+                  syntax.Definition(lhs=syntax.Variable(
+                                          name=substitution[var]),
+                                    rhs=rename(value.expr, {}),
+                                    where=[])
+                )
+        result = rename(syntax.sequence_many1(goals, body), substitution)
+        remaining = [binder for binder in binders if binder.var not in values]
+        for binder in reversed(remaining):
+            result = copy_fresh(binder, binder.var, result)
+        if len(remaining) > 0:
+            result.sole_alternative = binders[0].sole_alternative
+        if len(definitions) > 0:
+            result = syntax.Let(declarations=definitions, body=result)
+        return result
+
+    def fold_unification(self, lhs, rhs, fresh_vars, scope):
+        """Returns a list of pairs (var, static value) binding the fresh
+           variables if the unification (lhs == rhs) succeeds statically,
+           False if it fails statically, and None otherwise."""
+        value = self.static_value(lhs, scope)
+        if value is None:
+            return None
+        bindings = []
+        matched = self.match(value, rhs, fresh_vars, bindings, scope)
+        if matched is None:
+            return None
+        elif not matched:
+            return False
+        for var, value in bindings:
+            if value.expr.free_variables() & set(fresh_vars):
+                return None
+        return bindings
+
+    def match(self, value, pattern, fresh_vars, bindings, scope):
+        if is_wildcard(pattern):
+            return True
+        elif pattern.is_variable() and pattern.name in fresh_vars:
+            if pattern.name in [var for var, _ in bindings]:
+                return None
+            bindings.append((pattern.name, value))
+            return True
+        elif value.key is None:
+            return None
+        elif pattern.is_integer_constant():
+            return value.key == pattern.value
+        head = pattern.application_head()
+        if not head.is_variable() or head.name in scope \
+           or head.name not in self._constructors:
+            return None
+        args = pattern.application_args()
+        if value.key != head.name or len(value.args) != len(args):
+            return False
+        result = True
+        for value_arg, arg in zip(value.args, args):
+            matched = self.match(value_arg, arg, fresh_vars, bindings, scope)
+            if matched is False:
+                return False
+            elif matched is None:
+                result = None
+        return result
+
+    def static_value(self, expr, scope):
+        "Returns the Static value of the expression, or None."
+        if expr.is_integer_constant():
+            return Static(expr, key=expr.value)
+        elif expr.is_lambda():
+            return Static(expr)
+        elif expr.is_variable():
+            binding = scope.get(expr.name)
+            if binding is None:
+                if expr.name in self._constructors:
+                    return Static(expr, key=expr.name)
+                return None
+            elif binding.is_function():
+                return Static(expr)
+            elif binding.value is not None and \
+                 all([self.same_binding(name, binding.scope, scope)
+                        for arg in binding.value.args
+                        for name in arg.expr.free_variables()]):
+                return binding.value
+            return None
+        elif expr.is_application():
+            head = expr.application_head()
+            if not head.is_variable() or head.name in scope \
+               or head.name not in self._constructors:
+                return None
+            args = []
+            for arg in expr.application_args():
+                value = self.static_value(arg, scope)
+                if value is None:
+                    return None
+                args.append(value)
+            return Static(expr, key=head.name, args=args)
+        return None
+
+    def transform_call(self, head, args, scope):
+        """Rewrites the call of a definition of a function to the given
+           (already rewritten) arguments, or returns None."""
+        binding = scope[head.name]
+        if binding.fixed or \
+           not all([self.same_binding(name, binding.scope, scope)
+                      for name in binding.free]):
+            return None
+        key = self.specialization_key(binding, args, scope)
+        if key in self._copies:
+            name, copy = self._copies[key]
+            if scope.get(name) is copy:
+                return self.call_copy(name, args, key)
+        if not binding.recursive and size(binding.body) <= MAX_INLINE_SIZE:
+            return self.inline(binding, args, scope)
+        elif key is not None and binding not in self._specializing:
+            return self.specialize(head.name, binding, args, key, scope)
+        return None
+
+    def inline(self, binding, args, scope):
+        params = binding.params
+        substitution = {}
+        definitions = []
+        inner = dict(scope)
+        for param, arg in zip(params, args):
+            if arg.is_variable() and arg.name in scope:
+                substitution[param] = arg.name
+            else:
+                var = syntax.fresh_variable(prefix=prefix(param)).name
+                substitution[param] = var
+                definitions.append(
+                  syntax.Definition(lhs=syntax.Variable(name=var),
+                                    rhs=arg, where=[])
+                )
+                inner[var] = Binding()
+                self.bind_value(inner[var], var, arg, scope)
+        remaining = [syntax.fresh_variable(prefix=prefix(param)).name
+                       for param in params[len(args):]]
+        substitution.update(zip(params[len(args):], remaining))
+        body = rename(binding.body, substitution)
+        if not binding.body.is_index() and \
+           determinism.is_deterministic_tree(binding.body):
+            # The body is a single equation, which is the only alternative
+            # that may match, as if it were the body of the definition.
+            body.sole_alternative = True
+        body = self.transform(body, bind(inner, remaining))
+        result = syntax.lambda_many(remaining, body)
+        if len(definitions) > 0:
+            result = syntax.Let(declarations=definitions, body=result)
+        return syntax.application_many(result, args[len(params):])
+
+    def specialization_key(self, binding, args, scope):
+        """The key identifies the definition and the functions passed to
+           it, or is None if no known function is passed to it."""
+        functions = []
+        for i, arg in enumerate(args[:len(binding.params)]):
+            if arg.is_variable() and arg.name in scope \
+               and scope[arg.name].is_function():
+                functions.append((i, id(scope[arg.name])))
+        if len(functions) == 0 or len(functions) == len(binding.params):
+            return None
+        return (id(binding), tuple(functions))
+
+    def specialize(self, name, binding, args, key, scope):
+        copy_name = syntax.fresh_variable(prefix=prefix(name)).name
+        known = dict([(i, args[i].name) for i, _ in key[1]])
+        substitution = {}
+        params = []
+        for i, param in enumerate(binding.params):
+            if i in known:
+                substitution[param] = known[i]
+            else:
+                substitution[param] = \
+                  syntax.fresh_variable(prefix=prefix(param)).name
+                params.append(substitution[param])
+        copy = Binding()
+        copy.params = params
+        copy.recursive = True
+        copy.free = set()
+        inner = dict(scope)
+        inner[copy_name] = copy
+        self._copies[key] = (copy_name, copy)
+        self._specializing.add(binding)
+        rhs = self.transform(
+                syntax.lambda_many(params,
+                                   rename(binding.body, substitution)),
+                inner)
+        self._specializing.remove(binding)
+        copy.params, copy.body = syntax.lambda_params(rhs)
+        copy.scope = inner
+        return syntax.Let(
+                 declarations=[
+                   syntax.Definition(lhs=syntax.Variable(name=copy_name),
+                                     rhs=rhs, where=[])
+                 ],
+                 body=self.call_copy(copy_name, args, key)
+               )
+
+    def call_copy(self, name, args, key):
+        known = set([i for i, _ in key[1]])
+        return syntax.application_many(
+                 syntax.Variable(name=name),
+                 [arg for i, arg in enumerate(args) if i not in known]
+               )
+
+    def same_binding(self, name, scope1, scope2):
+        return scope1.get(name) is scope2.get(name)
+
+    def is_operator(self, head, name, scope):
+        return head.is_variable() and head.name == name \
+               and name not in scope
+
+    def is_unification(self, expr, scope):
+        return expr.is_application() \
+               and self.is_operator(expr.application_head(),
+                                    common.OP_UNIFY, scope) \
+               and len(expr.application_args()) == 2
+
+def bind(scope, names):
+    inner = dict(scope)
+    for name in names:
+        inner[name] = Binding()
+    return inner
+
+def prefix(name):
+    "Prefix for the fresh names of copies of the given name."
+    return name.rstrip('0123456789.') or 'x'
+
+def is_wildcard(expr):
+    "True for the expression (? x . x) of a `_` pattern."
+    return expr.is_fresh() and expr.body.is_variable() \
+           and expr.body.name == expr.var
+
+def size(expr):
+    if expr.is_variable() or expr.is_integer_constant():
+        return 1
+    elif expr.is_lambda() or expr.is_fresh():
+        return 1 + size(expr.body)
+    elif expr.is_application():
+        return size(expr.fun) + size(expr.arg)
+    elif expr.is_let():
+        return 1 + size(expr.body) + \
+               sum([size(decl.rhs) for decl in expr.declarations
+                                   if decl.is_definition()])
+    elif expr.is_index():
+        return 1 + sum([size(alternative)
+                          for alternative in expr.alternatives])
+    return 1
+
+def copy_fresh(binder, var, body):
+    fresh = syntax.Fresh(var=var, body=body, position=binder.position)
+    fresh.type = binder.type
+    fresh.sole_alternative = binder.sole_alternative
+    return fresh
+
+def copy_index(expr, var, transform_branch):
+    default = transform_branch(expr.default)
+    table = {}
+    for key, branch in expr.table.items():
+        branch = transform_branch(branch)
+        # A key with no alternatives left is the same as a missing key
+        # if the default branch has none either.
+        if len(branch) > 0 or len(default) > 0:
+            table[key] = branch
+    index = syntax.Index(
+              var=var,
+              table=table,
+              default=default,
+              alternatives=transform_branch(expr.alternatives),
+              position=expr.position
+            )
+    index.residuating = expr.residuating
+    index.enumerable = expr.enumerable
+    return index
+
+def rename(expr, substitution):
+    """Returns a copy of the expression where each free variable in the
+       substitution is renamed, and every bound variable is given a fresh
+       name, so that no variable in the copy is captured."""
+    if expr.is_integer_constant():
+        return syntax.IntegerConstant(value=expr.value, position=expr.position)
+    elif expr.is_variable():
+        return syntax.Variable(name=substitution.get(expr.name, expr.name),
+                               position=expr.position)
+    elif expr.is_lambda() or expr.is_fresh():
+        var = syntax.fresh_variable(prefix=prefix(expr.var)).name
+        body = rename(expr.body, extend(substitution, {expr.var: var}))
+        if expr.is_lambda():
+            return syntax.Lambda(var=var, body=body, position=expr.position)
+        return copy_fresh(expr, var, body)
+    elif expr.is_application():
+        return syntax.Application(fun=rename(expr.fun, substitution),
+                                  arg=rename(expr.arg, substitution),
+                                  position=expr.position)
+    elif expr.is_let():
+        renaming = dict([
+                     (decl.lhs.name,
+                      syntax.fresh_variable(prefix=prefix(decl.lhs.name)).name)
+                     for decl in expr.declarations if decl.is_definition()
+                   ])
+        inner = extend(substitution, renaming)
+        declarations = []
+        for decl in expr.declarations:
+            if decl.is_definition():
+                declarations.append(
+                  syntax.Definition(
+                    lhs=syntax.Variable(name=inner[decl.lhs.name],
+                                        position=decl.lhs.position),
+                    rhs=rename(decl.rhs, inner),
+                    where=[],
+                    position=decl.position
+                  )
+                )
+            elif decl.is_type_declaration():
+                declarations.append(
+                  syntax.TypeDeclaration(name=inner.get(decl.name, decl.name),
+                                         type=decl.type,
+                                         position=decl.position)
+                )
+            else:
+                declarations.append(
+                  type(decl)(name=inner.get(decl.name, decl.name),
+                             position=decl.position)
+                )
+        return syntax.Let(declarations=declarations,
+                          body=rename(expr.body, inner),
+                          position=expr.position)
+    elif expr.is_index():
+        renamed = {}
+        def rename_branch(branch):
+            result = []
+            for alternative in branch:
+                if id(alternative) not in renamed:
+                    renamed[id(alternative)] = rename(alternative,
+                                                      substitution)
+                result.append(renamed[id(alternative)])
+            return result
+        return copy_index(expr, substitution.get(expr.var, expr.var),
+                          rename_branch)
+    else:
+        raise Exception(
+                'Renaming not implemented for {cls}.'.format(cls=type(expr))
+              )
+
+def extend(substitution, renaming):
+    result = dict(substitution)
+    result.update(renaming)
+    return result
@@ -4,6 +4,15 @@ import lexer
 class AST:
     "Base class for all syntactic constructs."
 
+    # Set by the determinism analysis (see determinism.py).
+    deterministic = False
+    # Set by the closedness analysis (see closedness.py).
+    closed = False
+    # Set by the tail call analysis (see tail_calls.py).
+    tail_call = False
+    # Set by the specialization pass (see specialization.py).
+    sole_alternative = False
+
     def __init__(self, attributes, **kwargs):
         if 'position' in kwargs:
             self.position = kwargs['position']
@@ -36,6 +45,12 @@ class AST:
     def is_type_declaration(self):
         return False
 
+    def is_tabling_declaration(self):
+        return False
+
+    def is_residuation_declaration(self):
+        return False
+
     def is_definition(self):
         return False
 
@@ -57,6 +72,9 @@ class AST:
     def is_let(self):
         return False
 
+    def is_index(self):
+        return False
+
     def is_forall(self):
         return False
 
@@ -202,6 +220,30 @@ class TypeDeclaration(AST):
                  type=self.type.show()
                )
 
+class TablingDeclaration(AST):
+    "Requests the answers of a definition to be tabled."
+
+    def __init__(self, **kwargs):
+        AST.__init__(self, ['name'], **kwargs)
+
+    def is_tabling_declaration(self):
+        return True
+
+    def show(self):
+        return 'tabled {name}'.format(name=self.name)
+
+class ResiduationDeclaration(AST):
+    "Requests the calls to a definition to residuate instead of narrowing."
+
+    def __init__(self, **kwargs):
+        AST.__init__(self, ['name'], **kwargs)
+
+    def is_residuation_declaration(self):
+        return True
+
+    def show(self):
+        return 'residuating {name}'.format(name=self.name)
+
 class Definition(AST):
 
     def __init__(self, **kwargs):
@@ -450,8 +492,20 @@ def lambda_many(vars, body, position=None):
         body = Lambda(var=var, body=body, position=position)
     return body
 
+def lambda_params(expr):
+    """Returns the parameters of the nested lambdas at the root of the
+       expression, and their body."""
+    params = []
+    while expr.is_lambda():
+        params.append(expr.var)
+        expr = expr.body
+    return params, expr
+
 class Fresh(AST):
 
+    # Set by the typechecker to the type of the variable.
+    type = None
+
     def __init__(self, **kwargs):
         AST.__init__(self, ['var', 'body'], **kwargs)
 
@@ -514,6 +568,44 @@ class Let(AST):
         lines.append(common.indent(self.body.show(), 4))
         return '\n'.join(lines)
 
+class Index(AST):
+    """Represents the alternatives of a definition by pattern matching,
+       indexed by the head of one of its parameters.
+       table[key] is the list of alternatives to try if the head of the
+       parameter is the constructor (or integer) `key`, and default
+       the list of alternatives to try for any other rigid value.
+       If the value of the parameter is not rigid, all the alternatives
+       are tried."""
+
+    # Set for the trees of residuating definitions (see residuation.py).
+    residuating = False
+    # Set if an uninstantiated metavariable may be instantiated with the
+    # constructor of each branch in turn (see datatypes.py).
+    enumerable = False
+
+    def __init__(self, **kwargs):
+        AST.__init__(self, ['var', 'table', 'default', 'alternatives'],
+                     **kwargs)
+
+    def is_index(self):
+        return True
+
+    def candidates(self, key):
+        """Returns the alternatives to try for a value with the given key,
+           or all of them if the key is None."""
+        if key is None:
+            return self.alternatives
+        return self.table.get(key, self.default)
+
+    def free_variables(self):
+        return free_variables_list(self.alternatives) | set([self.var])
+
+    def show(self):
+        return 'index {var} . {body}'.format(
+                 var=self.var,
+                 body=alternative_many(self.alternatives).show()
+               )
+
 # Only at the type level
 class Forall(AST):
 
@@ -0,0 +1,80 @@
+import common
+import syntax
+
+# Tail call analysis.
+#
+# A call to a definition f is in tail position in the body of f if
+# running it is the last step of the body. Tail positions are:
+#   - the body of the definition, below its parameters,
+#   - the body of a let or of a fresh in tail position,
+#   - the second argument of a sequence (e1 >> e2) or of an alternative
+#     (e1 <> e2) in tail position,
+#   - the alternatives of an index in tail position.
+# The analysis marks the calls f a1 ... an in tail position in the body
+# of f by setting their `tail_call` attribute to True. They are compiled
+# into tail calls (see runtime.tail), so that a recursive loop runs in
+# the frame of its first iteration when no choice points remain.
+
+def analyze_program(program):
+    Analysis().analyze(program.body, None)
+
+class Analysis:
+
+    def analyze(self, expr, name):
+        # `name` is the name of the definition whose body has `expr` in
+        # tail position, or None.
+        if expr.is_variable() or expr.is_integer_constant():
+            return
+        elif expr.is_lambda():
+            self.analyze(expr.body, None)
+        elif expr.is_fresh():
+            self.analyze(expr.body, unless_bound(name, [expr.var]))
+        elif expr.is_application():
+            head = expr.application_head()
+            args = expr.application_args()
+            if head.is_variable() and head.name == name:
+                expr.tail_call = True
+            elif is_tail_operator(head) and len(args) == 2:
+                self.analyze(args[0], None)
+                self.analyze(args[1], name)
+                return
+            self.analyze(head, None)
+            for arg in args:
+                self.analyze(arg, None)
+        elif expr.is_let():
+            definitions = [decl for decl in expr.declarations
+                                if decl.is_definition()]
+            for decl in definitions:
+                params, body = syntax.lambda_params(decl.rhs)
+                if len(params) == 0:
+                    self.analyze(decl.rhs, None)
+                else:
+                    self.analyze(body, unless_bound(decl.lhs.name, params))
+            self.analyze(expr.body,
+                         unless_bound(name, [decl.lhs.name
+                                               for decl in definitions]))
+        elif expr.is_index():
+            for alternative in index_alternatives(expr):
+                self.analyze(alternative, name)
+        else:
+            raise Exception(
+                    'Tail call analysis not implemented for {cls}.'.format(
+                       cls=type(expr)
+                    )
+                  )
+
+def unless_bound(name, names):
+    "The name of the definition, unless it is shadowed by the names."
+    if name in names:
+        return None
+    return name
+
+def is_tail_operator(head):
+    return head.is_variable() and \
+           head.name in [common.OP_SEQUENCE, common.OP_ALTERNATIVE]
+
+def index_alternatives(expr):
+    alternatives = list(expr.alternatives)
+    for branch in list(expr.table.values()) + [expr.default]:
+        alternatives.extend(branch)
+    return alternatives
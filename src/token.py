@@ -22,6 +22,8 @@ IN = 'IN'
 INFIX = 'INFIX'
 INFIXL = 'INFIXL'
 INFIXR = 'INFIXR'
+RESIDUATING = 'RESIDUATING'
+TABLED = 'TABLED'
 UNDERSCORE = 'UNDERSCORE'
 WHERE = 'WHERE'
 
@@ -1,8 +1,10 @@
+import arithmetic
 import common
 import syntax
 import kinds
 import environment
 import dependencies
+import definitional_trees
 
 def primitive_types():
     return [
@@ -47,8 +49,58 @@ def primitive_values():
                     syntax.function(
                         syntax.Variable(name='a'),
                         syntax.primitive_type_unit())))),
+        (common.OP_DISEQUALITY,
+            syntax.Forall(
+                var='a',
+                body=syntax.function(
+                    syntax.Variable(name='a'),
+                    syntax.function(
+                        syntax.Variable(name='a'),
+                        syntax.primitive_type_unit())))),
 
         (common.VALUE_UNIT, syntax.primitive_type_unit()),
+    ] + [
+        (name,
+            syntax.function(
+                syntax.primitive_type_int(),
+                syntax.function(
+                    syntax.primitive_type_int(),
+                    syntax.primitive_type_int())))
+        for name in arithmetic.OPERATIONS
+    ] + [
+        (name,
+            syntax.function(
+                syntax.primitive_type_int(),
+                syntax.function(
+                    syntax.primitive_type_int(),
+                    syntax.primitive_type_unit())))
+        for name in arithmetic.RELATIONS
+    ] + [
+        (name,
+            syntax.function(
+                syntax.primitive_type_int(),
+                syntax.function(
+                    syntax.primitive_type_int(),
+                    syntax.primitive_type_unit())))
+        for name in [common.OP_FD_EQ, common.OP_FD_NE, common.OP_FD_LT]
+    ] + [
+        (common.OP_FD_DOMAIN,
+            syntax.function(
+                syntax.primitive_type_int(),
+                syntax.function(
+                    syntax.primitive_type_int(),
+                    syntax.function(
+                        syntax.primitive_type_int(),
+                        syntax.primitive_type_unit())))),
+    ] + [
+        # Constrain the integers in a data structure.
+        (name,
+            syntax.Forall(
+                var='a',
+                body=syntax.function(
+                    syntax.Variable(name='a'),
+                    syntax.primitive_type_unit())))
+        for name in [common.OP_FD_ALL_DIFFERENT, common.OP_FD_LABELING]
     ]
 
 class TypeChecker:
@@ -60,6 +112,12 @@ class TypeChecker:
         self._env = environment.Environment()
         for value_name, type in primitive_values():
             self._env.define(value_name, type)
+        # Programs may shadow the primitive values.
+        self._env.open_scope()
+        # Maps each constructor to its type.
+        self._constructors = {
+            common.VALUE_UNIT: self._env.value(common.VALUE_UNIT)
+        }
 
     def check_program(self, program):
         # Check that data declaration LHSs are well-formed.
@@ -118,6 +176,13 @@ class TypeChecker:
                       type=decl.type,
                       position=decl.type.position)
         self._env.define(constructor_name, closed_type)
+        self._constructors[constructor_name] = closed_type
+
+    def is_constructor(self, name):
+        # Constructors may be shadowed by local variables.
+        return name in self._constructors \
+           and self._env.is_defined(name) \
+           and self._env.value(name) is self._constructors[name]
 
     def close_type(self, type):
         free_vars = set([])
@@ -215,13 +280,14 @@ class TypeChecker:
 
     def check_fresh(self, expr):
         self._env.open_scope()
-        self._env.define(expr.var, syntax.Metavar(prefix='t',
-                                                  position=expr.position))
+        t_var = syntax.Metavar(prefix='t', position=expr.position)
+        self._env.define(expr.var, t_var)
         t_body, e_body = self.check_expr(expr.body)
         self._env.close_scope()
-        return (t_body,
-                syntax.Fresh(var=expr.var, body=e_body,
-                             position=expr.position))
+        e_fresh = syntax.Fresh(var=expr.var, body=e_body,
+                               position=expr.position)
+        e_fresh.type = t_var
+        return (t_body, e_fresh)
 
     def check_integer_constant(self, expr):
         return syntax.primitive_type_int(), expr
@@ -230,7 +296,7 @@ class TypeChecker:
         # Check kinds and extend environment
         # to allow for recursive definitions.
 
-        definitions, definition_keys, type_declarations = \
+        definitions, definition_keys, type_declarations, annotations = \
             self.check_let_declarations_well_formed(expr)
 
         # TODO: Dependency graph
@@ -276,6 +342,10 @@ class TypeChecker:
                          )
                 ds.append(t_decl)
                 ds.append(e_decl)
+                for annotation in annotations.get(e_decl.lhs.name, []):
+                    if annotation.is_residuation_declaration():
+                        definitional_trees.mark_residuating(e_decl.rhs)
+                    ds.append(annotation)
             desugared_declarations.append(ds)
 
         t_body, e_body = self.check_expr(expr.body)
@@ -293,11 +363,19 @@ class TypeChecker:
         definitions = {}
         definition_keys = []
         type_declarations = {}
+        # Tabling and residuation declarations of each name.
+        annotations = {}
         for decl in expr.declarations:
             if decl.is_type_declaration():
                 decl = self.check_type_declaration(decl)
                 declared_names.add(decl.name)
                 type_declarations[decl.name] = decl
+            elif decl.is_tabling_declaration() or \
+                 decl.is_residuation_declaration():
+                declared_names.add(decl.name)
+                if decl.name not in annotations:
+                    annotations[decl.name] = []
+                annotations[decl.name].append(decl)
             elif decl.is_definition():
                 head = decl.lhs.application_head()
                 if not head.is_variable():
@@ -319,7 +397,7 @@ class TypeChecker:
                        name=missing.pop(),
                        position=expr.position)
 
-        return definitions, definition_keys, type_declarations
+        return definitions, definition_keys, type_declarations, annotations
 
     def dependency_graph(self, definitions):
         graph = {}
@@ -368,14 +446,16 @@ class TypeChecker:
           syntax.function_many(param_types, result_type)
         )
 
+        rules = []
         for equation in equations:
-            alternatives.append(
+            rules.append(
               self.desugar_equation(params, param_types, result_type, equation)
             )
 
         rhs = syntax.lambda_many(
                 [param.name for param in params],
-                syntax.alternative_many(alternatives, position=position),
+                definitional_trees.definitional_tree(rules,
+                                                     position=position),
                 position=position,
               )
         self._env.close_scope() # Definition scope
@@ -414,18 +494,29 @@ class TypeChecker:
             )
         self.unify_types(d_type, result_type)
 
-        unif_goals = []
-        for param, pattern, t_param in zip(params, patterns, param_types):
+        e_patterns = []
+        keys = []
+        for pattern, t_param in zip(patterns, param_types):
             t_pattern, e_pattern = self.check_expr(pattern)
             self.unify_types(t_param, t_pattern)
-            unif_goals.append(syntax.unify(param, e_pattern))
+            e_patterns.append(e_pattern)
+            keys.append(self.pattern_key(e_pattern))
 
-        alternative = syntax.fresh_many(
-                        fvs,
-                        syntax.sequence_many1(unif_goals, d_body)
-                      )
+        rule = definitional_trees.Rule(fvs, params, e_patterns, keys, d_body)
         self._env.close_scope() # Equation scope
-        return alternative
+        return rule
+
+    def pattern_key(self, pattern):
+        # The key of a pattern is the constructor (or integer) that it
+        # requires at its head, or None if it may match any value.
+        # Must be called in the scope of the equation.
+        head = pattern.application_head()
+        if head.is_integer_constant() and len(pattern.application_args()) == 0:
+            return head.value
+        elif head.is_variable() and self.is_constructor(head.name):
+            return head.name
+        else:
+            return None
 
     def generalize_types_in_current_scope(self):
         forbidden_metavars = set()
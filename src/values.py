@@ -3,8 +3,32 @@ import common
 
 ####
 
+# Each class of values has a kind, a small integer that the runtime uses
+# to dispatch through tables indexed by kind (see runtime.kind_table).
+THUNK = 0
+INTEGER_CONSTANT = 1
+RIGID_STRUCTURE = 2
+FLEX_STRUCTURE = 3
+PRIMITIVE = 4
+CLOSURE = 5
+MULTI_CLOSURE = 6
+METAVAR = 7
+ELISION = 8
+NUM_KINDS = 9
+
 class Value:
 
+    # Values are allocated constantly, so they declare __slots__ and
+    # have no __dict__.
+    __slots__ = ('position',)
+
+    kind = None
+
+    # True if the value is strongly decided and stays so whatever
+    # metavariables are instantiated, so that is_strongly_decided need
+    # not inspect it again.
+    stable = False
+
     def __init__(self):
         self.position = None
 
@@ -38,6 +62,10 @@ class Value:
     def representative(self):
         return self
 
+    def index_key(self):
+        # Key used to select the alternatives of a syntax.Index.
+        return None
+
     def showp(self):
         s = self.show()
         if not self.is_atom():
@@ -79,11 +107,24 @@ class Value:
 
 class Metavar(Value):
 
-    def __init__(self, prefix='x', **kwargs):
+    __slots__ = ('prefix', 'type', 'index', '_indirection',
+                 '_suspended_goals')
+
+    kind = METAVAR
+
+    # Number of instantiations of any metavariable so far. A value that
+    # was strongly decided is still so if the count has not changed.
+    instantiations = 0
+
+    def __init__(self, prefix='x', type=None, **kwargs):
         Value.__init__(self)
         self.prefix = prefix
+        # The type of the metavariable, if known (see datatypes.py).
+        self.type = type
         self.index = common.fresh_index()
         self._indirection = None
+        # Goals waiting for the metavariable to be instantiated.
+        self._suspended_goals = []
 
     def representative(self):
         if self._indirection is None:
@@ -95,10 +136,34 @@ class Metavar(Value):
     def instantiate(self, value):
         assert self._indirection is None
         self._indirection = value
+        Metavar.instantiations += 1
 
     def uninstantiate(self):
         self._indirection = None
 
+    def suspend_goal(self, goal):
+        """Suspends a goal until the metavariable is instantiated. A goal
+           is a function with no parameters that returns an iterable over
+           its solutions."""
+        self._suspended_goals.append(goal)
+
+    def unsuspend_goal(self):
+        "Removes the last suspended goal, when backtracking."
+        self._suspended_goals.pop()
+
+    def has_suspended_goals(self):
+        return len(self._suspended_goals) > 0
+
+    def suspended_goals(self):
+        return list(self._suspended_goals)
+
+    def resume_goals(self):
+        """Returns an iterable over the solutions of all the suspended
+           goals, to be run right after instantiating the metavariable."""
+        if len(self._suspended_goals) == 0:
+            return (None,)
+        return _run_goals(list(self._suspended_goals))
+
     def show(self):
         if self._indirection is None:
             return '?{prefix}{index}'.format(
@@ -123,9 +188,20 @@ class Metavar(Value):
         else:
             return self._indirection.is_strongly_decided()
 
+def _run_goals(goals):
+    if len(goals) == 0:
+        yield None
+        return
+    for _ in goals[0]():
+        yield from _run_goals(goals[1:])
+
 class Thunk(Value):
     "Represents a suspended computation."
 
+    __slots__ = ('expr', 'env')
+
+    kind = THUNK
+
     def __init__(self, expr, env):
         Value.__init__(self)
         self.expr = expr
@@ -152,6 +228,11 @@ class Thunk(Value):
 class IntegerConstant(Value):
     "Represents a number."
 
+    __slots__ = ('value', '__weakref__')
+
+    kind = INTEGER_CONSTANT
+    stable = True
+
     def __init__(self, value):
         Value.__init__(self)
         self.value = value
@@ -162,6 +243,9 @@ class IntegerConstant(Value):
     def is_integer_constant(self):
         return True
 
+    def index_key(self):
+        return self.value
+
     def is_rigid(self):
         return True
 
@@ -174,10 +258,16 @@ class IntegerConstant(Value):
 class RigidStructure(Value):
     "Represents a constructor applied to a number of arguments."
 
+    __slots__ = ('constructor', 'tag', 'args', 'stable', '__weakref__')
+
+    kind = RIGID_STRUCTURE
+
     def __init__(self, constructor, args):
         Value.__init__(self)
         self.constructor = constructor
+        self.tag = constructor_tag(constructor)
         self.args = args
+        self.stable = len(args) == 0
 
     def show(self):
         return self.show_application(self.constructor, self.args)
@@ -188,6 +278,9 @@ class RigidStructure(Value):
     def is_rigid(self):
         return True
 
+    def index_key(self):
+        return self.constructor
+
     def is_atom(self):
         return len(self.args) == 0
 
@@ -198,14 +291,35 @@ class RigidStructure(Value):
         return fmvs
 
     def is_strongly_decided(self):
-        return all([arg.is_strongly_decided() for arg in self.args])
+        if self.stable:
+            return True
+        for arg in self.args:
+            if not arg.is_strongly_decided():
+                return False
+        self.stable = all([arg.stable for arg in self.args])
+        return True
 
 def unit():
     return RigidStructure(common.VALUE_UNIT, [])
 
+# Constructors are identified at run time by small integer tags. Each
+# constructor has a single tag object, so two structures have the same
+# constructor if and only if their tags are identical (`is`).
+_CONSTRUCTOR_TAGS = {}
+
+def constructor_tag(constructor):
+    tag = _CONSTRUCTOR_TAGS.get(constructor)
+    if tag is None:
+        tag = _CONSTRUCTOR_TAGS[constructor] = len(_CONSTRUCTOR_TAGS)
+    return tag
+
 class FlexStructure(Value):
     "Represents a symbolic variable applied to a number of arguments."
 
+    __slots__ = ('symbol', 'args')
+
+    kind = FLEX_STRUCTURE
+
     def __init__(self, symbol, args):
         Value.__init__(self)
         self.symbol = symbol
@@ -245,6 +359,11 @@ class Primitive(Value):
     """"Represents a partially applied (but *not* fully applied) primitive.
         such as (_>>_ foo) or (_+_ 10)."""
 
+    __slots__ = ('name', 'args')
+
+    kind = PRIMITIVE
+    stable = True
+
     def __init__(self, name, args):
         Value.__init__(self)
         self.name = name
@@ -274,6 +393,11 @@ class Primitive(Value):
 class Closure(Value):
     "Represents a closure (lambda function enclosed in an environment)."
 
+    __slots__ = ('var', 'body', 'env')
+
+    kind = CLOSURE
+    stable = True
+
     def __init__(self, var, body, env):
         Value.__init__(self)
         self.var = var
@@ -298,3 +422,54 @@ class Closure(Value):
     def is_strongly_decided(self):
         return True
 
+class MultiClosure(Value):
+    """Represents a closure of a function of several parameters, together
+       with the arguments it has been applied to so far, which are fewer
+       than its parameters. The body is evaluated in a single environment
+       frame that binds all the parameters."""
+
+    __slots__ = ('vars', 'body', 'env', 'args')
+
+    kind = MULTI_CLOSURE
+    stable = True
+
+    def __init__(self, vars, body, env, args):
+        Value.__init__(self)
+        self.vars = vars
+        self.body = body
+        self.env = env
+        self.args = args
+
+    def show(self):
+        closure = '(λ {vars} . {body})@...'.format(
+                    vars=' '.join(self.vars),
+                    body=self.body.show()
+                  )
+        if len(self.args) == 0:
+            return closure
+        return ' '.join([closure] + [arg.showp() for arg in self.args])
+
+    def is_closure(self):
+        return True
+
+    def is_rigid(self):
+        return True
+
+    def is_atom(self):
+        return len(self.args) == 0
+
+    def is_strongly_decided(self):
+        return True
+
+class Elision(Value):
+    "Represents the part of a value that was not rendered (see rendering.py)."
+
+    __slots__ = ()
+
+    kind = ELISION
+
+    def show(self):
+        return '...'
+
+    def is_atom(self):
+        return True
@@ -0,0 +1,91 @@
+"""Runs a program with one of the evaluators and prints its answers.
+
+Usage: run_program.py [options] EVALUATOR FILENAME
+
+The answers are printed one per line, as JSON strings, with their
+metavariables renamed as in benchmark.normalize. Programs are run in a
+separate process since src/token.py shadows the standard module, and
+since some of them overflow the C stack."""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import benchmark
+import codegen
+import evaluator_bfs
+import evaluator_compiled
+import evaluator_dfs
+import parallel
+import runtime
+
+EVALUATORS = ['dfs', 'bfs', 'compiled', 'codegen', 'parallel',
+              'and-parallel']
+
+def results(evaluator, program, jobs):
+    if evaluator == 'dfs':
+        return evaluator_dfs.Evaluator().eval_program(program,
+                                                      strategy='strong')
+    elif evaluator == 'bfs':
+        return evaluator_bfs.Evaluator().eval_program(program,
+                                                      strategy='strong')
+    elif evaluator == 'compiled':
+        return evaluator_compiled.Evaluator().eval_program(program,
+                                                           strategy='strong')
+    elif evaluator == 'codegen':
+        return generated_module(program).main()
+    elif evaluator == 'parallel':
+        def run_worker():
+            return evaluator_compiled.Evaluator().eval_program(
+                     program, strategy='strong')
+        return parallel.solutions(run_worker, jobs=jobs)
+    elif evaluator == 'and-parallel':
+        runtime.CONJUNCTIONS = parallel.Conjunctions(jobs)
+        return evaluator_compiled.Evaluator().eval_program(program,
+                                                           strategy='strong')
+    raise Exception('Unknown evaluator {evaluator}.'.format(
+                      evaluator=evaluator))
+
+def generated_module(program):
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'program.py')
+    with open(filename, 'w') as f:
+        f.write(codegen.generate_module(program))
+    spec = importlib.util.spec_from_file_location('program', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('evaluator', choices=EVALUATORS)
+    parser.add_argument('filename')
+    parser.add_argument('--max-answers', type=int, default=None)
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='processes of the parallel evaluators')
+    parser.add_argument('--share-interval', type=int, default=None,
+                        help='parallel.Search.SHARE_INTERVAL')
+    parser.add_argument('--recursion-limit', type=int, default=1000000)
+    args = parser.parse_args(argv[1:])
+    program = benchmark.load_program(args.filename)
+    if args.share_interval is not None:
+        parallel.Search.SHARE_INTERVAL = args.share_interval
+    sys.setrecursionlimit(args.recursion_limit)
+    for result in itertools.islice(results(args.evaluator, program,
+                                           args.jobs),
+                                   args.max_answers):
+        if type(result) is not str:
+            # The parallel search yields the answers already shown.
+            result = result.show()
+        print(json.dumps(benchmark.normalize(result)), flush=True)
+
+if __name__ == '__main__':
+    main(sys.argv)
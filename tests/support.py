@@ -0,0 +1,39 @@
+"""Helpers to run programs in a separate process (see run_program.py)."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(TESTS_DIR, '..', 'examples')
+
+TIMEOUT = 300
+
+def answers(evaluator, filename, timeout=TIMEOUT, **options):
+    """Returns the list of answers of the program in the given file, as
+       normalized strings. The options are those of run_program.py, such
+       as `max_answers`. Raises AssertionError if the program fails."""
+    command = [sys.executable, os.path.join(TESTS_DIR, 'run_program.py'),
+               evaluator, filename]
+    for option, value in options.items():
+        if value is not None:
+            command += ['--' + option.replace('_', '-'), str(value)]
+    process = subprocess.run(command, capture_output=True, text=True,
+                             timeout=timeout)
+    if process.returncode != 0:
+        raise AssertionError(
+                '{evaluator} failed on {filename}:\n{stderr}'.format(
+                  evaluator=evaluator, filename=filename,
+                  stderr=process.stderr))
+    return [json.loads(line) for line in process.stdout.split('\n')
+                                 if line != '']
+
+def source_file(test, source):
+    "Writes a program to a temporary file, removed after the test."
+    descriptor, filename = tempfile.mkstemp(suffix='.fa')
+    with os.fdopen(descriptor, 'w') as f:
+        f.write(source)
+    test.addCleanup(os.remove, filename)
+    return filename
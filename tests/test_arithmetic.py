@@ -0,0 +1,35 @@
+import unittest
+
+import support
+
+EVALUATORS = ['dfs', 'bfs', 'compiled', 'codegen']
+
+class ArithmeticTest(unittest.TestCase):
+    "Runs arithmetic on metavariables with each evaluator."
+
+    def check(self, source, expected):
+        filename = support.source_file(self, source)
+        for evaluator in EVALUATORS:
+            with self.subTest(evaluator=evaluator):
+                self.assertEqual(support.answers(evaluator, filename),
+                                 expected)
+
+    def test_solve(self):
+        self.check('main = fresh x in (x + 1 == 5) >> x', ['4'])
+        self.check('main = fresh x y in (10 - x * 2 == y) >> (y == 4) >> x',
+                   ['3'])
+        self.check('main = fresh x in (x * 2 == 5) >> x', [])
+
+    def test_resume(self):
+        self.check('main = fresh x in (x < 3) >> (x + 1 == 2) >> x', ['1'])
+        self.check('main = fresh x y in (x + y == 2) >> (x == 1) >> y',
+                   ['1'])
+
+    def test_floundering_answer(self):
+        # The answer that depends on the suspended comparison is shown
+        # with it, and the search goes on.
+        self.check('main = (fresh x in (x < 3) >> x) <> 5',
+                   ['?0 where ?0 < 3', '5'])
+
+if __name__ == '__main__':
+    unittest.main()
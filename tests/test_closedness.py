@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import support
+
+SRC_DIR = os.path.join(support.TESTS_DIR, '..', 'src')
+
+# Prints whether the second operand of the sequence defined by each
+# `use...` definition is marked as closed.
+CLOSED_OPERANDS = '''
+import sys
+sys.path.insert(0, {src_dir!r})
+import closedness
+import determinism
+import main
+program = main.check_file({filename!r})
+constructors = set([constructor.name
+                    for data_decl in program.data_declarations
+                    for constructor in data_decl.constructors])
+determinism.analyze_program(program)
+closedness.analyze_program(program, constructors)
+expr = program.body
+while expr.is_let():
+    for decl in expr.declarations:
+        if decl.is_definition() and decl.lhs.name.startswith('use'):
+            print(decl.lhs.name, decl.rhs.application_args()[1].closed)
+    expr = expr.body
+'''
+
+# A definition is only closed for the expressions that use it if it has
+# exactly one value.
+DEFINITIONS = '''
+data N where
+  z : N
+  s : N → N
+
+one = s z
+three = 1 + 2
+less = 1 < 2
+different = 1 ≠ 2
+quotient = div 1 0
+
+useOne = () >> one
+useThree = () >> three
+useLess = () >> less
+useDifferent = () >> different
+useQuotient = () >> quotient
+
+main = ()
+'''
+
+class ClosednessTest(unittest.TestCase):
+
+    def closed_operands(self, source):
+        filename = support.source_file(self, source)
+        script = CLOSED_OPERANDS.format(src_dir=SRC_DIR, filename=filename)
+        process = subprocess.run([sys.executable, '-c', script],
+                                 capture_output=True, text=True,
+                                 timeout=support.TIMEOUT)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        closed = {}
+        for line in process.stdout.split('\n'):
+            if line != '':
+                name, mark = line.split(' ')
+                closed[name] = mark == 'True'
+        return closed
+
+    def test_primitives_that_may_fail(self):
+        self.assertEqual(self.closed_operands(DEFINITIONS), {
+            'useOne': True,
+            'useThree': True,
+            'useLess': False,
+            'useDifferent': False,
+            'useQuotient': False,
+        })
+
+if __name__ == '__main__':
+    unittest.main()
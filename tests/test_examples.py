@@ -0,0 +1,44 @@
+import collections
+import glob
+import os
+import unittest
+
+import support
+
+# Number of answers compared for each example, since some examples have
+# infinitely many.
+MAX_ANSWERS = 20
+
+# Examples that do not terminate.
+DIVERGING = ['laziness_problem.fa']
+
+# Examples with tabled definitions, which only the compiled evaluators
+# support.
+TABLED = ['tabling.fa', 'tabling_suspended.fa']
+
+class ExamplesTest(unittest.TestCase):
+    "Runs every example with each evaluator and compares their answers."
+
+    def test_evaluators_agree(self):
+        for filename in sorted(glob.glob(os.path.join(support.EXAMPLES_DIR,
+                                                      '*.fa'))):
+            example = os.path.basename(filename)
+            if example in DIVERGING:
+                continue
+            evaluators = ['compiled', 'codegen']
+            if example not in TABLED:
+                evaluators = ['dfs', 'bfs'] + evaluators
+            with self.subTest(example=example):
+                expected = None
+                for evaluator in evaluators:
+                    found = collections.Counter(
+                              support.answers(evaluator, filename,
+                                              max_answers=MAX_ANSWERS))
+                    if expected is None:
+                        expected = found
+                    self.assertEqual(found, expected,
+                                     '{evaluator} on {example}'.format(
+                                       evaluator=evaluator, example=example))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import collections
+import os
+import subprocess
+import sys
+import unittest
+
+import support
+
+LIST = '''
+infixr 250 _∷_
+
+data List a where
+  []  : List a
+  _∷_ : a → List a → List a
+'''
+
+# Choice points after labeling, which enumerates the values of the
+# domains.
+LABELING = LIST + '''
+main = fresh a b in
+         domain a 1 40 >> domain b 1 40 >> labeling (a ∷ b ∷ []) >>
+         (fresh x y in ((x == 1) <> (x == 2)) >> ((y == 1) <> (y == 2)) >>
+                       (a ∷ b ∷ x ∷ y ∷ []))
+'''
+
+LABELING_ONE_CHOICE = LIST + '''
+main = fresh a b in
+         domain a 1 40 >> domain b 1 40 >> labeling (a ∷ b ∷ []) >>
+         (fresh x in ((x == 1) <> (x == 2)) >> (a ∷ b ∷ x ∷ []))
+'''
+
+# Choice points after a unification with two solutions, which does not
+# go through the choice points of the search.
+UNIFICATION = '''
+data N where
+  z : N
+  s : N → N
+
+main = fresh f x in
+         f (s z) == s z >> f x == s z >>
+         (fresh y in ((y == z) <> (y == s z)) >> x)
+'''
+
+class OrParallelTest(unittest.TestCase):
+    """Checks that the or-parallel search finds the same answers as a
+       sequential search, as many times."""
+
+    def check(self, filename, jobs=4, share_interval=None):
+        expected = support.answers('compiled', filename)
+        found = support.answers('parallel', filename, jobs=jobs,
+                                share_interval=share_interval)
+        self.assertEqual(collections.Counter(found),
+                         collections.Counter(expected))
+        return found
+
+    def test_labeling(self):
+        filename = support.source_file(self, LABELING)
+        self.assertEqual(len(self.check(filename)), 6400)
+
+    def test_labeling_odd_interval(self):
+        filename = support.source_file(self, LABELING_ONE_CHOICE)
+        for share_interval in [1, 7, 63]:
+            with self.subTest(share_interval=share_interval):
+                self.assertEqual(len(self.check(filename, share_interval=
+                                                            share_interval)),
+                                 3200)
+
+    def test_unification(self):
+        filename = support.source_file(self, UNIFICATION)
+        for share_interval in [1, 2, 3]:
+            with self.subTest(share_interval=share_interval):
+                self.check(filename, share_interval=share_interval)
+
+    def test_examples(self):
+        for example in ['coloring_disequality.fa', 'filter.fa', 'queens.fa']:
+            filename = os.path.join(support.EXAMPLES_DIR, example)
+            with self.subTest(example=example):
+                self.check(filename, share_interval=1)
+
+class TablingTest(unittest.TestCase):
+    "Runs tabled programs from the command line with parallel modes."
+
+    def run_main(self, mode, jobs, filename):
+        # Answers are confirmed with an empty line each.
+        process = subprocess.run(
+                    [sys.executable,
+                     os.path.join(support.TESTS_DIR, '..', 'src', 'main.py'),
+                     mode, str(jobs), filename],
+                    input='\n' * 100, capture_output=True, text=True,
+                    timeout=support.TIMEOUT)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process
+
+    def test_and_parallel_runs_sequentially(self):
+        filename = os.path.join(support.EXAMPLES_DIR, 'tabling.fa')
+        process = self.run_main('and-parallel', 2, filename)
+        self.assertEqual(process.stderr,
+                         'Tabled programs are not run in parallel.\n')
+        shown = [line.lstrip(' ;') for line in process.stdout.split('\n')]
+        self.assertEqual(shown[-2:], ['done.', ''])
+        self.assertEqual(collections.Counter(shown[:-2]),
+                         collections.Counter(support.answers('compiled',
+                                                             filename)))
+
+if __name__ == '__main__':
+    unittest.main()
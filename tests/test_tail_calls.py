@@ -0,0 +1,57 @@
+import unittest
+
+import support
+
+# Recursion limit low enough for a loop that nests a generator in each
+# iteration to fail.
+RECURSION_LIMIT = 20000
+
+# Loops over data built lazily: each element has to be evaluated before
+# it can be matched.
+MAP = '''
+infixr 250 _∷_
+
+data List a where
+  []  : List a
+  _∷_ : a → List a → List a
+
+upto n = (n ≤ 0 >> []) <> (0 < n >> n ∷ upto (n - 1))
+
+ok x = ()
+
+map! f []       = ()
+map! f (x ∷ xs) = f x >> map! f xs
+
+main = map! ok (upto 12000)
+'''
+
+LOOP = '''
+data N where
+  z : N
+  s : N → N
+
+nat n = (n ≤ 0 >> z) <> (0 < n >> s (nat (n - 1)))
+
+loop z     = ()
+loop (s n) = loop n
+
+main = loop (nat 15000)
+'''
+
+class TailCallsTest(unittest.TestCase):
+    "Runs deep self-recursive loops with the compiled evaluator."
+
+    def check(self, source):
+        filename = support.source_file(self, source)
+        self.assertEqual(support.answers('compiled', filename,
+                                         recursion_limit=RECURSION_LIMIT),
+                         ['()'])
+
+    def test_map_lazy_list(self):
+        self.check(MAP)
+
+    def test_loop_lazy_naturals(self):
+        self.check(LOOP)
+
+if __name__ == '__main__':
+    unittest.main()